@@ -0,0 +1,198 @@
+"""
+End-to-end load test of the learner flow.
+
+Each simulated user goes through
+    paste (SSE Q1) -> answer Q1 (Q2) -> answer Q2 (verdict) -> mentor chat (SSE) -> run
+against a local server in demo mode, so the LLM side is mock_service with
+the latency profile picked by --profile (see MOCK_LATENCY_PROFILE).
+
+Reports, per endpoint, time to first SSE event and completion time
+(p50/p95/p99), plus event-loop lag: a separate thread pings GET / every
+--probe-interval ms, and lag is its latency above the idle baseline. A
+blocking call on the server's loop shows up as lag in the hundreds of ms.
+
+Usage (from backend/):
+    python -m benchmarks.bench_flow --users 50 --profile realistic
+    python -m benchmarks.bench_flow --users 200 --profile instant --think 0.5
+    python -m benchmarks.bench_flow --url http://127.0.0.1:8000   # existing server
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.common import percentile, start_server, stop_server, summarize
+
+SNIPPET = "\n".join(
+    ["import sqlite3", "", "def load_users(path):", "    conn = sqlite3.connect(path)", "    cursor = conn.cursor()"]
+    + [f"    cursor.execute('SELECT * FROM users WHERE id = {i}')" for i in range(22)]
+    + ["    return cursor.fetchall()"]
+)
+RUN_CODE = "total = 0\nfor i in range(10000):\n    total += i\nprint(total)\n"
+ANSWER = "The connection is never closed, so if execute raises the connection leaks from the pool."
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)  # metric name -> ms samples
+        self.errors = defaultdict(int)
+
+    def add(self, name: str, started: float):
+        self.latency[name].append((time.perf_counter() - started) * 1000)
+
+
+def record_error(rec: Recorder, name: str, response: httpx.Response):
+    # Admission-control rejections are counted apart from failures
+    rec.errors[f"{name} (429)" if response.status_code == 429 else name] += 1
+
+
+async def stream_sse(client: httpx.AsyncClient, path: str, body: dict, rec: Recorder, name: str, headers: dict = None):
+    """POST an SSE endpoint, recording first-event and completion time. Returns (headers, text)."""
+    started = time.perf_counter()
+    first = True
+    text = []
+    async with client.stream("POST", path, json=body, headers=headers) as response:
+        if response.status_code != 200:
+            record_error(rec, name, response)
+            return response.headers, ""
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            if first:
+                rec.add(f"{name} first event", started)
+                first = False
+            data = line[5:].removeprefix(" ")
+            if data == "[DONE]":
+                break
+            text.append(data)
+        rec.add(f"{name} complete", started)
+        return response.headers, "".join(text)
+
+
+async def post_json(client: httpx.AsyncClient, path: str, body: dict, rec: Recorder, name: str, headers: dict = None):
+    started = time.perf_counter()
+    response = await client.post(path, json=body, headers=headers)
+    if response.status_code != 200:
+        record_error(rec, name, response)
+        return None
+    rec.add(name, started)
+    return response.json()
+
+
+async def user_flow(client: httpx.AsyncClient, rec: Recorder, think: float, rng: random.Random, user: int = 0):
+    # Each simulated user is its own browser, as admission control sees it
+    headers = {"X-Client-Id": f"bench-user-{user:06d}"}
+
+    async def pause():
+        if think:
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think)
+
+    started = time.perf_counter()
+    response_headers, _ = await stream_sse(client, "/analyze_paste", {"code_snippet": SNIPPET, "context_summary": SNIPPET}, rec, "paste Q1", headers)
+    session_id = response_headers.get("x-session-id")
+    if not session_id:
+        rec.errors["paste Q1"] += 1
+        return
+    await pause()
+    await post_json(client, "/validate_answer", {"session_id": session_id, "user_answer": ANSWER, "question_number": 1}, rec, "answer Q1", headers)
+    await pause()
+    await post_json(client, "/validate_answer", {"session_id": session_id, "user_answer": ANSWER, "question_number": 2}, rec, "answer Q2 (verdict)", headers)
+    await pause()
+    await stream_sse(
+        client, "/mentor_chat",
+        {"selected_code": SNIPPET.splitlines()[3], "user_query": "Why does this leak?", "full_file": SNIPPET},
+        rec, "mentor chat", headers,
+    )
+    await pause()
+    result = await post_json(client, "/api/run", {"code": RUN_CODE}, rec, "run", headers)
+    if result and result.get("status") == "busy":
+        rec.errors["run (busy)"] += 1
+    rec.add("full flow", started)
+
+
+class LagProbe(threading.Thread):
+    """Pings GET / from its own thread and connection, so client load does not skew it."""
+
+    def __init__(self, base_url: str, interval: float):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def measure(self, client: httpx.Client) -> float:
+        started = time.perf_counter()
+        client.get(self.base_url + "/")
+        return (time.perf_counter() - started) * 1000
+
+    def run(self):
+        with httpx.Client(timeout=30) as client:
+            while not self._done.is_set():
+                self.samples.append(self.measure(client))
+                self._done.wait(self.interval)
+
+    def baseline(self, n: int = 50) -> float:
+        with httpx.Client(timeout=30) as client:
+            return percentile([self.measure(client) for _ in range(n)], 50)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+async def bench(args, base_url: str):
+    probe = LagProbe(base_url, args.probe_interval / 1000)
+    idle = probe.baseline()
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.users * 2 + 5)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        probe.start()
+        started = time.perf_counter()
+
+        async def delayed_user(i: int):
+            await asyncio.sleep(args.ramp * i / max(args.users, 1))
+            try:
+                await user_flow(client, rec, args.think, rng, i)
+            except httpx.HTTPError:
+                rec.errors["transport"] += 1
+
+        await asyncio.gather(*(delayed_user(i) for i in range(args.users)))
+        wall = time.perf_counter() - started
+        probe.stop()
+
+    print(f"{args.users} users, profile={args.profile}, think={args.think}s, wall={wall:.2f}s, "
+          f"{len(rec.latency['full flow']) / wall:.2f} flows/s")
+    for name in sorted(rec.latency):
+        print(summarize(name, rec.latency[name]))
+    lag = [max(0.0, sample - idle) for sample in probe.samples]
+    print(summarize("event-loop lag", lag) + f"  (idle ping {idle:.1f}ms)")
+    if rec.errors:
+        print("errors: " + ", ".join(f"{name}={count}" for name, count in sorted(rec.errors.items())))
+
+
+def main(args):
+    if args.url:
+        asyncio.run(bench(args, args.url))
+        return
+    proc, base_url = start_server(env={"MOCK_LATENCY_PROFILE": args.profile, "MOCK_LATENCY_SEED": str(args.seed)})
+    try:
+        asyncio.run(bench(args, base_url))
+    finally:
+        stop_server(proc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--profile", default="realistic", help="MOCK_LATENCY_PROFILE for the server")
+    parser.add_argument("--think", type=float, default=0.0, help="mean user think time between steps (s)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which users arrive")
+    parser.add_argument("--probe-interval", type=float, default=20.0, help="loop-lag ping interval (ms)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of starting one")
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+"""
+Code runner throughput/latency benchmark.
+
+Fires bursts of concurrent POST /api/run requests while SSE streams from
+/mock_stream are open, and reports run latency, throughput, busy rejections
+and 429s (admission control is off unless the environment turns it on),
+and the largest gap between SSE events (a blocked event loop shows up as a
+multi-second gap).
+
+Usage (from backend/):
+    python -m benchmarks.bench_runner --runs 40 --concurrency 20 --streams 10
+    python -m benchmarks.bench_runner --compare --pool-size 4   # cold start vs pre-warmed pool
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.common import start_server, stop_server, summarize
+
+SNIPPET = "total = 0\nfor i in range(10000):\n    total += i\nprint(total)\n"
+
+
+async def run_once(client: httpx.AsyncClient, results: dict):
+    start = time.perf_counter()
+    response = await client.post("/api/run", json={"code": SNIPPET})
+    elapsed = (time.perf_counter() - start) * 1000
+    if response.status_code == 429:
+        results["rejected"] += 1
+    elif response.json().get("status") == "busy":
+        results["busy"] += 1
+    else:
+        results["latency"].append(elapsed)
+
+
+async def stream_once(client: httpx.AsyncClient, gaps: list):
+    body = {"code_snippet": SNIPPET, "context_summary": ""}
+    last = time.perf_counter()
+    async with client.stream("POST", "/mock_stream", json=body) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            now = time.perf_counter()
+            gaps.append((now - last) * 1000)
+            last = now
+
+
+async def bench(args, env: dict, label: str = ""):
+    proc, base_url = start_server(env=env)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency + args.streams + 5)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            results = {"latency": [], "busy": 0, "rejected": 0}
+            gaps = []
+            sem = asyncio.Semaphore(args.concurrency)
+
+            async def bounded_run():
+                async with sem:
+                    await run_once(client, results)
+
+            start = time.perf_counter()
+            streams = [asyncio.create_task(stream_once(client, gaps)) for _ in range(args.streams)]
+            await asyncio.gather(*(bounded_run() for _ in range(args.runs)))
+            wall = time.perf_counter() - start
+            await asyncio.gather(*streams)
+
+        if label:
+            print(f"--- {label} ---")
+        print(summarize("POST /api/run", results["latency"]))
+        print(f"{'throughput':<28} {len(results['latency']) / wall:.1f} runs/s over {wall:.2f}s, busy={results['busy']}, "
+              f"429={results['rejected']}")
+        print(summarize("SSE inter-event gap", gaps))
+    finally:
+        stop_server(proc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--streams", type=int, default=10)
+    parser.add_argument("--pool-size", type=int, default=None, help="RUNNER_POOL_SIZE for the server (0 = cold start)")
+    parser.add_argument("--compare", action="store_true", help="run once cold (pool size 0) and once with the pool")
+    args = parser.parse_args()
+
+    pool_env = {} if args.pool_size is None else {"RUNNER_POOL_SIZE": str(args.pool_size)}
+    if args.compare:
+        asyncio.run(bench(args, {"RUNNER_POOL_SIZE": "0"}, "cold start"))
+        asyncio.run(bench(args, pool_env, "pre-warmed pool"))
+    else:
+        asyncio.run(bench(args, pool_env))
@@ -0,0 +1,114 @@
+"""
+Near-duplicate snippet index benchmark.
+
+Indexes N synthetic snippets, then queries with
+  - lightly edited copies of stored snippets (renamed variables, reformatted
+    whitespace, added comments, one changed line) -> recall
+  - fresh snippets that were never stored -> precision
+and reports lookup latency. Runs in-process; no server needed.
+
+Usage (from backend/):
+    python -m benchmarks.bench_snippet_index --snippets 100000 --queries 1000
+"""
+import argparse
+import random
+import re
+import time
+
+from benchmarks.common import summarize
+from services.snippet_index import SnippetIndex, signature
+
+CALLS = [
+    "cursor.execute", "conn.commit", "session.get", "response.json", "os.path.join",
+    "json.loads", "data.append", "items.sort", "logger.info", "file.write",
+    "re.match", "requests.post", "db.query", "cache.set", "queue.put",
+    "socket.send", "math.sqrt", "random.choice", "time.sleep", "path.exists",
+]
+STATEMENTS = [
+    "{v} = {call}({a}, {n})",
+    "if {a} > {n}:\n    {v} = {call}({a})",
+    "for {v} in range({n}):\n    {call}({v}, {a})",
+    "{v} = [{a} * {n} for {a} in {b}]",
+    "try:\n    {call}({a})\nexcept ValueError:\n    {v} = None",
+    "while {a} < {n}:\n    {a} += {call}({b})",
+    "with open({s}) as {v}:\n    {call}({v}.read())",
+    "{v} = {{{s}: {a}, {s}: {b}}}",
+    "return {call}({a}) + {b}",
+    "{v} = {a} if {b} else {call}({n})",
+    "assert {call}({a}) == {n}",
+    "{v}.{attr} = {call}({s})",
+]
+ATTRS = ["timeout", "retries", "status", "payload", "owner", "buffer"]
+
+
+def make_snippet(rng: random.Random) -> str:
+    names = [f"var_{rng.randrange(10**6)}" for _ in range(6)]
+    lines = [f"def handler_{rng.randrange(10**6)}({names[0]}, {names[1]}):"]
+    while len(lines) < rng.randint(25, 40):
+        stmt = rng.choice(STATEMENTS).format(
+            v=rng.choice(names), a=rng.choice(names), b=rng.choice(names),
+            call=rng.choice(CALLS), n=rng.randrange(100), s=repr(f"k{rng.randrange(100)}"),
+            attr=rng.choice(ATTRS),
+        )
+        lines.extend("    " + line for line in stmt.split("\n"))
+    return "\n".join(lines) + "\n"
+
+
+def lightly_edit(code: str, rng: random.Random) -> str:
+    renamed = re.sub(r"var_(\d+)", lambda m: f"renamed_{m.group(1)[::-1]}", code)
+    lines = renamed.replace("    ", "  ").split("\n")
+    lines.insert(rng.randrange(1, len(lines)), "  # pasted from a tutorial")
+    body = [i for i, line in enumerate(lines) if line.startswith("  ") and "=" in line]
+    if body:
+        i = rng.choice(body)
+        lines[i] = lines[i].split("=")[0] + "= None"
+    return "\n\n".join(lines) if rng.random() < 0.5 else "\n".join(lines)
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    index = SnippetIndex(threshold=args.threshold, max_entries=args.snippets)
+
+    stored = []
+    start = time.perf_counter()
+    for _ in range(args.snippets):
+        code = make_snippet(rng)
+        index.add(code, {"question": "q"})
+        if len(stored) < args.queries:
+            stored.append(code)
+    build_s = time.perf_counter() - start
+    print(f"indexed {len(index)} snippets in {build_s:.1f}s ({build_s / args.snippets * 1e6:.0f} us/snippet)")
+
+    latencies, signature_ms = [], []
+    true_pos = false_neg = false_pos = 0
+    queries = [(lightly_edit(code, rng), True) for code in stored]
+    queries += [(make_snippet(rng), False) for _ in range(args.queries)]
+    for code, expected in queries:
+        t0 = time.perf_counter()
+        sig = signature(code)
+        t1 = time.perf_counter()
+        found = index.lookup(code, sig) is not None
+        t2 = time.perf_counter()
+        signature_ms.append((t1 - t0) * 1000)
+        latencies.append((t2 - t0) * 1000)
+        if expected and found:
+            true_pos += 1
+        elif expected:
+            false_neg += 1
+        elif found:
+            false_pos += 1
+
+    recall = true_pos / (true_pos + false_neg) if queries else 0
+    precision = true_pos / (true_pos + false_pos) if true_pos + false_pos else 0
+    print(f"recall={recall:.3f} precision={precision:.3f} (threshold {args.threshold})")
+    print(summarize("signature", signature_ms))
+    print(summarize("signature + lookup", latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snippets", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""
+Cold-start benchmark.
+
+Measures, over --repeat fresh processes:
+  - import time of `main` (with a placeholder API key, so the Anthropic
+    client is configured the way it is in production)
+  - time to ready: spawning uvicorn until GET / answers
+  - first-request latency: time to the first SSE event of the first
+    POST /analyze_paste, and the first POST /api/run
+
+By default the LLM side is mock_service (instant latency profile), so the
+numbers are the server's own overhead. With --live the server uses the real
+ANTHROPIC_API_KEY from the environment (this spends tokens) and the first
+paste is timed with the upstream connection warm-up on and off.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup --repeat 5
+    python -m benchmarks.bench_startup --live --delay 2
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.common import BACKEND_DIR, start_server, stop_server, summarize
+
+SNIPPET = "def add(a, b):\n    return a + b\n\nprint(add(2, 3))\n"
+IMPORT_PROBE = "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"
+
+
+def import_time_ms() -> float:
+    env = {**os.environ, "ANTHROPIC_API_KEY": "sk-placeholder-for-benchmark"}
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def first_event_ms(client: httpx.Client) -> float:
+    started = time.perf_counter()
+    body = {"code_snippet": SNIPPET, "context_summary": SNIPPET}
+    with client.stream("POST", "/analyze_paste", json=body) as response:
+        for line in response.iter_lines():
+            if line.startswith("data:"):
+                return (time.perf_counter() - started) * 1000
+    return (time.perf_counter() - started) * 1000
+
+
+def cold_start(env: dict, delay: float) -> dict:
+    started = time.perf_counter()
+    proc, base_url = start_server(env=env)
+    ready = (time.perf_counter() - started) * 1000
+    try:
+        time.sleep(delay)
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            paste = first_event_ms(client)
+            run_started = time.perf_counter()
+            client.post("/api/run", json={"code": SNIPPET})
+            run = (time.perf_counter() - run_started) * 1000
+            warmup = client.get("/cache_stats").json().get("llm_warmup")
+    finally:
+        stop_server(proc)
+    return {"ready": ready, "paste": paste, "run": run, "warmup": warmup}
+
+
+def report(label: str, samples: list):
+    print(f"--- {label} ---")
+    print(summarize("time to ready", [s["ready"] for s in samples]))
+    print(summarize("first paste (first event)", [s["paste"] for s in samples]))
+    print(summarize("first /api/run", [s["run"] for s in samples]))
+    print(f"{'llm warm-up (last run)':<28} {samples[-1]['warmup']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds between ready and the first request")
+    parser.add_argument("--live", action="store_true", help="use the real Anthropic API (spends tokens)")
+    args = parser.parse_args()
+
+    print(summarize("import main", [import_time_ms() for _ in range(args.repeat)]))
+    if args.live:
+        key = {"ANTHROPIC_API_KEY": os.environ["ANTHROPIC_API_KEY"]}
+        report("no warm-up", [cold_start({**key, "LLM_PREWARM_CONNECTIONS": "0"}, args.delay) for _ in range(args.repeat)])
+        report("warm-up", [cold_start(key, args.delay) for _ in range(args.repeat)])
+    else:
+        mock = {"MOCK_LATENCY_PROFILE": "instant"}
+        report("demo mode", [cold_start(mock, args.delay) for _ in range(args.repeat)])
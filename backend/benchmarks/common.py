@@ -0,0 +1,76 @@
+"""
+Shared helpers for the benchmark scripts.
+Benchmarks talk to a real uvicorn process over HTTP so that anything
+blocking the event loop shows up in the numbers. Requires httpx.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(env: dict = None, port: int = None, ready_timeout: float = 20.0):
+    """
+    Starts `uvicorn main:app` from the backend directory and waits for GET /.
+    The Anthropic key is blanked so every LLM endpoint uses mock_service, and
+    admission control is off so load from one address is not answered with
+    429s (pass ADMISSION_ENABLED=true in `env` to measure it).
+    Returns (process, base_url).
+    """
+    port = port or free_port()
+    proc_env = {**os.environ, "ANTHROPIC_API_KEY": "", "ADMISSION_ENABLED": "false", **(env or {})}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=proc_env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/", timeout=0.5).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Backend did not become ready")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name: str, values_ms) -> str:
+    return (
+        f"{name:<28} n={len(values_ms):<5} "
+        f"p50={percentile(values_ms, 50):8.1f}ms "
+        f"p95={percentile(values_ms, 95):8.1f}ms "
+        f"p99={percentile(values_ms, 99):8.1f}ms "
+        f"max={max(values_ms, default=0):8.1f}ms"
+    )
@@ -1,54 +1,237 @@
 
 import asyncio
-import sys
-import subprocess
-import tempfile
-from fastapi import FastAPI, HTTPException
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from sse_starlette.sse import EventSourceResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 
-from models.schemas import AnalyzePasteRequest, ValidateAnswerRequest, ValidateAnswerResponse, AnalyzeErrorRequest, MentorChatRequest, CodeExecutionRequest
-from services import claude_service, mock_service
+from models.schemas import AnalyzePasteRequest, ValidateAnswerRequest, ValidateAnswerResponse, AnalyzeErrorRequest, MentorChatRequest, CodeExecutionRequest, WorkspaceRefs, BlobQuery
+from services import claude_service, mock_service, code_runner, response_cache, snippet_index, speculation, error_classifier, metrics, sse, code_analyzer, blob_store, chat_history, state_backend, admission, run_cache, llm_client
+from services.llm_policy import CircuitOpen
+from services.session_store import sessions
 
 load_dotenv()
 
-app = FastAPI(title="Anti-Copilot API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pre-warm the code runner's interpreter pool before serving requests
+    await code_runner.start_pool()
+    snippet_index.load()
+    metrics.start_loop_monitor()
+    # Import the Anthropic SDK and open upstream connections in the background:
+    # the server is ready at once, and the first paste finds a warm pool
+    warm = asyncio.create_task(llm_client.prewarm(claude_service.client))
+    yield
+    warm.cancel()
+    await metrics.stop_loop_monitor()
+    snippet_index.save()
+    code_analyzer.shutdown()
+    await code_runner.stop_pool()
+    # Flush the state backend's queued writes before the process exits
+    await asyncio.to_thread(state_backend.backend.close)
 
+app = FastAPI(title="Anti-Copilot API", lifespan=lifespan)
+
+# Added first so it sits inside CORS: 429 responses still carry CORS headers
+app.add_middleware(admission.AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id", "Retry-After"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 @app.get("/")
 def health():
     return {"status": "Anti-Copilot API Running"}
 
+@app.get("/cache_stats")
+def cache_stats():
+    """Hit/miss counters for the Socratic question cache, near-duplicate index and local error hints."""
+    return {
+        "questions": response_cache.question_cache.stats(),
+        "near_duplicates": snippet_index.snippet_index.stats(),
+        "error_hints": error_classifier.stats(),
+        "single_flight": claude_service.flights.stats(),
+        "analysis": code_analyzer.stats(),
+        "blobs": blob_store.blobs.stats(),
+        "prompt_fragments": blob_store.fragments.stats(),
+        "chat_history": chat_history.stats(),
+        "run_results": run_cache.results.stats(),
+        "llm_warmup": llm_client.warmup,
+        "state": {**state_backend.backend.stats(), "sessions": len(sessions)}
+    }
+
+# Scraped at /metrics alongside the counters recorded in services.metrics
+metrics.collect("runner_queue_depth", "Code runs waiting for an execution slot.", code_runner.queue_depth)
+metrics.collect("runner_running", "Code runs currently executing.", code_runner.running)
+metrics.collect("runner_kernels", "Persistent per-session kernels currently running.", lambda: code_runner.kernel_stats()["running"])
+metrics.collect("runner_kernel_events_total", "Kernel lifecycle events (started, evicted, idle_stopped, crashed, restarted).",
+                lambda: [({"event": event}, count) for event, count in code_runner.kernel_counters.items()], kind="counter")
+metrics.collect("cache_lookups_total", "Cache lookups by cache and result.", lambda: [
+    ({"cache": "questions", "result": "hit"}, response_cache.question_cache.hits),
+    ({"cache": "questions", "result": "miss"}, response_cache.question_cache.misses),
+    ({"cache": "near_duplicates", "result": "hit"}, snippet_index.snippet_index.hits),
+    ({"cache": "near_duplicates", "result": "miss"}, snippet_index.snippet_index.lookups - snippet_index.snippet_index.hits),
+    ({"cache": "run_results", "result": "hit"}, run_cache.results.hits),
+    ({"cache": "run_results", "result": "miss"}, run_cache.results.misses),
+], kind="counter")
+metrics.collect("cache_hit_ratio", "Hit rate since startup by cache.", lambda: [
+    ({"cache": "questions"}, response_cache.question_cache.stats()["hit_rate"]),
+    ({"cache": "near_duplicates"}, snippet_index.snippet_index.stats()["hit_rate"]),
+    ({"cache": "error_hints_local"}, error_classifier.stats()["local_rate"]),
+])
+metrics.collect("single_flight_requests_total", "Coalesced stream requests by role.", lambda: [
+    ({"role": "started"}, claude_service.flights.started),
+    ({"role": "joined"}, claude_service.flights.joined),
+], kind="counter")
+metrics.collect("llm_slots_in_use", "Anthropic calls holding one of the LLM_MAX_CONCURRENCY slots.",
+                lambda: claude_service.policy.slots.in_use)
+metrics.collect("llm_queue_depth", "Anthropic calls waiting for a free slot.", lambda: claude_service.policy.slots.waiting)
+metrics.collect("llm_circuit_open", "1 while the Claude circuit breaker is not closed.",
+                lambda: int(claude_service.policy.breaker.state != "closed"))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus text exposition of request, LLM, cache, runner and event-loop metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/llm_stats")
+def llm_stats():
+    """Circuit breaker state, failure/retry/hedge counters, current adaptive timeouts and model routing."""
+    return claude_service.policy.stats()
+
+@app.get("/usage_stats")
+def usage_stats():
+    """Token usage per Claude call type, including prompt-cache reads and writes."""
+    return claude_service.usage_totals
+
+# --- Sessions ---
+
+SESSION_HEADER = "X-Session-Id"
+
+async def start_quiz_session(code_snippet: str) -> str:
+    return await sessions.create(kind="quiz", code_snippet=code_snippet, question_1=None, answer_1=None, question_2=None)
+
+async def record_question(session_id: str, chunks):
+    """
+    Pass chunks through, then store the full Q1 text in the quiz session and,
+    if SPECULATIVE_Q2 is on, start preparing Q2 in the background.
+    """
+    text = []
+    async for chunk in chunks:
+        text.append(chunk)
+        yield chunk
+    question_1 = "".join(text)
+    session = await sessions.update(session_id, question_1=question_1)
+    if session and not question_1.startswith("Error"):
+        code_snippet = session["code_snippet"]
+        if claude_service.available():
+            generate = lambda: claude_service.generate_followup_question(code_snippet, question_1)
+        else:
+            generate = lambda: mock_service.mock_second_question(code_snippet, question_1, "")
+        await speculation.start(session_id, generate)
+
+async def record_turn(session_id: str, user_query: str, chunks):
+    """
+    Pass chunks through, then append the exchange to the mentor chat session
+    and compact older turns into the digest once the history grows too long.
+    """
+    text = []
+    async for chunk in chunks:
+        text.append(chunk)
+        yield chunk
+    reply = "".join(text)
+    if not reply or reply.startswith("Error"):
+        return
+    session = await chat_history.add_turn(session_id, user_query, reply)
+    if session is not None:
+        chat_history.schedule_compaction(session, session_id, claude_service.summarize_chat if claude_service.available() else None)
+
+async def speculative_answer(request: ValidateAnswerRequest) -> Optional[ValidateAnswerResponse]:
+    """Q2 prepared while the user was answering Q1, if it can be used."""
+    if request.question_number != 1:
+        return None
+    q2_text = await speculation.take(request.session_id, request.user_answer, request.question, request.code_snippet)
+    if q2_text is None:
+        return None
+    return ValidateAnswerResponse(status="next_question", feedback="Good start.", next_question=q2_text)
+
+async def resolve_quiz_request(request: ValidateAnswerRequest) -> ValidateAnswerRequest:
+    """
+    Fill in the fields a session-based client leaves out from its quiz session.
+    Full payloads without a session_id pass through unchanged.
+    """
+    if request.session_id:
+        # A mentor chat session id is as unknown here as an expired one
+        session = await sessions.get(request.session_id, kind="quiz")
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired session")
+        number = request.question_number or (2 if session.get("question_2") else 1)
+        update = {
+            "question_number": number,
+            "code_snippet": request.code_snippet or session["code_snippet"]
+        }
+        if number == 1:
+            update["question"] = request.question or session.get("question_1")
+        else:
+            update["question"] = request.question or session.get("question_2")
+            update["question_1"] = request.question_1 or session.get("question_1")
+            update["answer_1"] = request.answer_1 or session.get("answer_1")
+        request = request.model_copy(update=update)
+
+    if request.question is None or request.code_snippet is None or request.question_number is None:
+        raise HTTPException(status_code=400, detail="Send session_id or question, code_snippet and question_number")
+    return request
+
+async def record_answer(request: ValidateAnswerRequest, response: ValidateAnswerResponse):
+    if request.session_id and response.status == "next_question":
+        await sessions.update(request.session_id, answer_1=request.user_answer, question_2=response.next_question)
+
+@app.delete("/session/{session_id}")
+async def end_session(session_id: str):
+    """Called when the paste is undone: cancels speculative work and drops the session."""
+    speculation.cancel(session_id)
+    await sessions.delete(session_id)
+    return {"status": "ended"}
+
 # --- Real Claude Endpoints ---
 
 @app.post("/analyze_paste")
 async def analyze_paste(request: AnalyzePasteRequest):
     """
     Streams Claude's first question via SSE.
+    Starts a quiz session whose id is returned in the X-Session-Id header.
     """
-    if not claude_service.client:
+    metrics.mark("parse")
+    session_id = await start_quiz_session(request.code_snippet)
+    headers = {SESSION_HEADER: session_id}
+
+    async def mock_event_generator():
+        async for chunk in sse.coalesce(record_question(session_id, mock_service.mock_stream_question(request.code_snippet, request.context_summary))):
+            yield {"data": chunk}
+        yield {"data": "[DONE]"}
+
+    if not claude_service.available():
         # Fallback to mock
-        async def mock_event_generator():
-            async for chunk in mock_service.mock_stream_question(request.code_snippet, request.context_summary):
-                yield {"data": chunk}
-            yield {"data": "[DONE]"}
-        return EventSourceResponse(mock_event_generator())
+        return sse.response(mock_event_generator(), headers=headers)
 
     async def event_generator():
         try:
             iterator = claude_service.stream_first_question(request.code_snippet, request.context_summary)
-            async for chunk in iterator:
+            async for chunk in sse.coalesce(record_question(session_id, iterator)):
                 yield {"data": chunk}
             yield {"data": "[DONE]"}
+        except CircuitOpen:
+            # The breaker opened while this call was retrying (nothing was sent yet): answer like demo mode
+            async for event in mock_event_generator():
+                yield event
         except asyncio.TimeoutError:
              yield {"data": "API Timeout. Bypassing..."}
              yield {"data": "[DONE]"}
@@ -56,7 +239,7 @@ async def analyze_paste(request: AnalyzePasteRequest):
              yield {"data": f"Error: {str(e)}"}
              yield {"data": "[DONE]"}
 
-    return EventSourceResponse(event_generator())
+    return sse.response(event_generator(), headers=headers)
 
 @app.post("/validate_answer")
 async def validate_answer(request: ValidateAnswerRequest):
@@ -64,31 +247,47 @@ async def validate_answer(request: ValidateAnswerRequest):
     Validates answer. 
     If Q1 -> Return Q2 (next_question).
     If Q2 -> Return Pass/Fail.
+    Accepts either the full payload or just session_id + user_answer.
     """
-    if not claude_service.client:
+    metrics.mark("parse")
+    request = await resolve_quiz_request(request)
+    response = await speculative_answer(request) or await evaluate_answer(request)
+    await record_answer(request, response)
+    return response
+
+async def demo_evaluate_answer(request: ValidateAnswerRequest) -> Optional[ValidateAnswerResponse]:
+    if request.question_number == 1:
+        q2_text = await mock_service.mock_second_question(request.code_snippet, request.question, request.user_answer)
+        return ValidateAnswerResponse(status="next_question", feedback="Good start (Demo Mode).", next_question=q2_text)
+    elif request.question_number == 2:
+        result = await mock_service.mock_evaluate_combined(request.code_snippet, request.question_1 or "", request.answer_1 or "", request.question, request.user_answer)
+        return ValidateAnswerResponse(status=result["status"], feedback=result["feedback"] + " (Demo Mode)")
+    return None
+
+async def evaluate_answer(request: ValidateAnswerRequest) -> ValidateAnswerResponse:
+    if not claude_service.available():
         # Fallback to mock
-        if request.question_number == 1:
-            q2_text = await mock_service.mock_second_question(request.code_snippet, request.question, request.user_answer)
-            return ValidateAnswerResponse(status="next_question", feedback="Good start (Demo Mode).", next_question=q2_text)
-        elif request.question_number == 2:
-            result = await mock_service.mock_evaluate_combined(request.code_snippet, request.question_1 or "", request.answer_1 or "", request.question, request.user_answer)
-            return ValidateAnswerResponse(status=result["status"], feedback=result["feedback"] + " (Demo Mode)")
+        response = await demo_evaluate_answer(request)
+        if response is not None:
+            return response
     
     if request.question_number == 1:
         try:
             # User answered Q1. Generate Q2.
-            q2_text = await asyncio.wait_for(
-                claude_service.generate_second_question(
-                    request.code_snippet, 
-                    request.question, 
-                    request.user_answer
-                ), timeout=10.0
+            # Timeouts and retries are handled by claude_service.policy
+            q2_text = await claude_service.generate_second_question(
+                request.code_snippet,
+                request.question,
+                request.user_answer
             )
             return ValidateAnswerResponse(
                 status="next_question",
                 feedback="Good start.",
                 next_question=q2_text
             )
+        except CircuitOpen:
+            # The breaker opened while this call was retrying: answer like demo mode
+            return await demo_evaluate_answer(request)
         except asyncio.TimeoutError:
             # Fallback to allow progress
             return ValidateAnswerResponse(
@@ -100,19 +299,20 @@ async def validate_answer(request: ValidateAnswerRequest):
     elif request.question_number == 2:
         # User answered Q2. Evaluate combined.
         try:
-            result = await asyncio.wait_for(
-                claude_service.evaluate_combined_answers(
-                    request.code_snippet,
-                    request.question_1 or "",
-                    request.answer_1 or "",
-                    request.question,
-                    request.user_answer
-                ), timeout=10.0
+            result = await claude_service.evaluate_combined_answers(
+                request.code_snippet,
+                request.question_1 or "",
+                request.answer_1 or "",
+                request.question,
+                request.user_answer
             )
             return ValidateAnswerResponse(
                 status=result["status"],
-                feedback=result["feedback"]
+                feedback=result["feedback"],
+                feedback_id=result.get("feedback_id")
             )
+        except CircuitOpen:
+            return await demo_evaluate_answer(request)
         except asyncio.TimeoutError:
              return ValidateAnswerResponse(
                 status="pass",
@@ -122,90 +322,181 @@ async def validate_answer(request: ValidateAnswerRequest):
     else:
         raise HTTPException(status_code=400, detail="Invalid question number")
 
+@app.get("/verdict_feedback/{feedback_id}")
+async def verdict_feedback(feedback_id: str):
+    """
+    Streams the explanation behind a PASS/FAIL verdict via SSE.
+    /validate_answer returns the verdict as soon as its first line arrives;
+    this picks up the rest (from the start) while it is still generating.
+    """
+    async def event_generator():
+        async for chunk in sse.coalesce(claude_service.stream_verdict_feedback(feedback_id)):
+            yield {"data": chunk}
+        yield {"data": "[DONE]"}
+
+    return sse.response(event_generator())
+
+def runner_busy_response():
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "1"},
+        content={
+            "stdout": "",
+            "stderr": "The code runner is busy. Please try again in a moment.",
+            "status": "busy"
+        }
+    )
+
 @app.post("/api/run")
 async def run_code(request: CodeExecutionRequest):
     """
-    Executes Python code securely in a temporary file with a 5-second timeout.
-    Returns stdout, stderr, and execution status.
+    Executes Python code in a separate interpreter with a 5-second timeout.
+    Runs are capped at RUNNER_MAX_CONCURRENCY; extra requests wait in a fair
+    (per-client) queue of RUNNER_MAX_QUEUE and get a 503 "busy" response beyond that.
+    Returns stdout, stderr, and execution status; cached is true when the
+    result was reused from an identical deterministic run (RUN_CACHE_ENABLED).
+    With kernel_id, runs in a persistent per-session kernel that keeps
+    imported modules warm and skips unchanged leading imports and function
+    definitions, notebook style.
     """
-    temp_file = None
     try:
-        # Create a temporary Python file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_file:
-            temp_file.write(request.code)
-            temp_file_path = temp_file.name
+        return await code_runner.execute(request.code, request.kernel_id)
+    except code_runner.RunnerBusy:
+        return runner_busy_response()
 
-        # Execute the code with a 5-second timeout
+@app.post("/api/run/stream")
+async def run_code_stream(request: CodeExecutionRequest):
+    """
+    Streams program output via SSE while the code runs.
+    "stdout"/"stderr" events carry {"data": chunk}; the final "exit" event
+    carries status, returncode, truncated, duration_ms and cached.
+    """
+    if code_runner.saturated() and not await code_runner.has_cached_result(request.code, request.kernel_id):
+        return runner_busy_response()
+
+    async def event_generator():
         try:
-            result = subprocess.run(
-                [sys.executable, temp_file_path],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
+            async for event in code_runner.stream(request.code, request.kernel_id):
+                name = event.pop("event")
+                yield {"event": name, "data": json.dumps(event)}
+        except code_runner.RunnerBusy:
+            yield {"event": "exit", "data": json.dumps({"status": "busy", "returncode": None, "truncated": False, "duration_ms": 0})}
 
-            return {
-                "stdout": result.stdout,
-                "stderr": result.stderr,
-                "status": "success" if result.returncode == 0 else "error"
-            }
-
-        except subprocess.TimeoutExpired:
-            return {
-                "stdout": "",
-                "stderr": "Execution timed out after 5 seconds. Your code may have an infinite loop.",
-                "status": "timeout"
-            }
-
-    except Exception as e:
-        return {
-            "stdout": "",
-            "stderr": f"Execution error: {str(e)}",
-            "status": "error"
-        }
+    return sse.response(event_generator())
 
-    finally:
-        # Clean up the temporary file
-        if temp_file:
-            try:
-                import os
-                os.unlink(temp_file_path)
-            except:
-                pass
+@app.post("/api/kernel/{kernel_id}/restart")
+async def restart_kernel(kernel_id: str):
+    """Stops a session's kernel; the next run with kernel_id "new" starts a clean one."""
+    return {"restarted": await code_runner.restart_kernel(kernel_id)}
 
 @app.post("/analyze_error")
 async def analyze_error(request: AnalyzeErrorRequest):
     """
     Streams a proactive hint for an error.
+    Routine syntax errors get a templated hint from error_classifier without
+    an LLM call; only errors it cannot classify go to Claude (or the mock).
     """
-    if not claude_service.client:
-        # Fallback to mock
-        async def mock_gen():
-            async for chunk in mock_service.mock_stream_error_hint(request.error_message, request.line_code, request.context_summary):
-                yield {"data": chunk}
+    metrics.mark("parse")
+    hint = error_classifier.local_hint(request.error_message, request.line_code, request.context_summary)
+    if hint:
+        async def local_gen():
+            yield {"data": hint}
             yield {"data": "[DONE]"}
-        return EventSourceResponse(mock_gen())
+        return sse.response(local_gen())
+
+    async def mock_gen():
+        async for chunk in sse.coalesce(mock_service.mock_stream_error_hint(request.error_message, request.line_code, request.context_summary)):
+            yield {"data": chunk}
+        yield {"data": "[DONE]"}
+
+    if not claude_service.available():
+        # Fallback to mock
+        return sse.response(mock_gen())
 
     async def event_generator():
         try:
             iterator = claude_service.stream_error_hint(request.error_message, request.line_code, request.context_summary)
-            async for chunk in iterator:
+            async for chunk in sse.coalesce(iterator):
                 yield {"data": chunk}
             yield {"data": "[DONE]"}
+        except CircuitOpen:
+            async for event in mock_gen():
+                yield event
         except Exception as e:
              yield {"data": f"Error: {str(e)}"}
              yield {"data": "[DONE]"}
 
-    return EventSourceResponse(event_generator())
+    return sse.response(event_generator())
+
+# --- Workspace blobs ---
+
+@app.put("/blobs/{blob_hash}")
+async def put_blob(blob_hash: str, http_request: Request):
+    """
+    Stores one workspace file, keyed by the sha256 of its UTF-8 content.
+    The body is the raw file text. Chat requests then refer to it by hash.
+    """
+    try:
+        content = (await http_request.body()).decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Blob must be UTF-8 text")
+    try:
+        await blob_store.blobs.put(blob_hash, content)
+    except blob_store.BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except blob_store.HashMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"hash": blob_hash}
+
+@app.post("/blobs/missing")
+async def missing_blobs(request: BlobQuery):
+    """Which of the given hashes the server does not have (and the client must upload)."""
+    return {"missing": await blob_store.blobs.missing(request.hashes)}
+
+async def resolve_workspace_refs(refs: WorkspaceRefs) -> dict:
+    """
+    Workspace context dict built from blob hashes.
+    Raises 409 listing the hashes to upload when any blob is unknown or was evicted.
+    """
+    hashes = [refs.activeFile.hash] + [rf.hash for rf in refs.relatedFiles]
+    missing = await blob_store.blobs.missing(hashes)
+    if missing:
+        raise HTTPException(status_code=409, detail={"missing": missing})
+    return {
+        "activeFile": {"path": refs.activeFile.path, "content": await blob_store.blobs.get(refs.activeFile.hash), "hash": refs.activeFile.hash},
+        "relatedFiles": [
+            {"path": rf.path, "content": await blob_store.blobs.get(rf.hash), "relation": rf.relation, "hash": rf.hash}
+            for rf in refs.relatedFiles
+        ],
+        "fileTree": refs.fileTree
+    }
 
 @app.post("/mentor_chat")
 async def mentor_chat(request: MentorChatRequest):
     """
     Streams response to manual mentor query.
-    Now supports workspace_context for multi-file awareness.
+    Now supports workspace_context for multi-file awareness, or
+    workspace_refs naming files already uploaded to /blobs.
+    With a session_id, omitted full_file / workspace_context / context_summary
+    are taken from the previous message of the same session, and earlier
+    turns of the conversation are part of the prompt. `history` seeds the
+    digest of a new session.
     """
-    # Convert workspace_context to dict if present
-    workspace_ctx_dict = None
+    metrics.mark("parse")
+    resolved_refs = await resolve_workspace_refs(request.workspace_refs) if request.workspace_refs else None
+    session = await sessions.get(request.session_id, kind="mentor")
+    sends_context = request.full_file is not None or request.workspace_context is not None or resolved_refs is not None
+    if request.session_id and session is None and not sends_context:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    if session is None:
+        session_id = await sessions.create(kind="mentor", full_file=None, workspace_context=None, context_summary="",
+                                     turns=[], digest=chat_history.keep_tail(request.history or ""))
+        session = await sessions.get(session_id)
+    else:
+        session_id = request.session_id
+
+    # Context sent with this message replaces the stored context as a whole
+    workspace_ctx_dict = None if sends_context else session["workspace_context"]
     if request.workspace_context:
         workspace_ctx_dict = {
             "activeFile": request.workspace_context.activeFile,
@@ -219,45 +510,67 @@ async def mentor_chat(request: MentorChatRequest):
             ],
             "fileTree": request.workspace_context.fileTree
         }
+    elif resolved_refs:
+        workspace_ctx_dict = resolved_refs
+    full_file = request.full_file if sends_context else session["full_file"]
+    if full_file is None and resolved_refs:
+        full_file = resolved_refs["activeFile"]["content"]
+    context_summary = request.context_summary or session["context_summary"]
+    await sessions.update(session_id, workspace_context=workspace_ctx_dict, full_file=full_file, context_summary=context_summary)
+    headers = {SESSION_HEADER: session_id}
 
-    if not claude_service.client:
+    async def mock_gen():
+        chunks = mock_service.mock_stream_mentor_chat(request.selected_code, request.user_query, context_summary, full_file or "")
+        async for chunk in sse.coalesce(record_turn(session_id, request.user_query, chunks)):
+            yield {"data": chunk}
+        yield {"data": "[DONE]"}
+
+    if not claude_service.available():
         # Fallback to mock
-        async def mock_gen():
-            async for chunk in mock_service.mock_stream_mentor_chat(request.selected_code, request.user_query, request.context_summary, request.full_file or ""):
-                yield {"data": chunk}
-            yield {"data": "[DONE]"}
-        return EventSourceResponse(mock_gen())
+        return sse.response(mock_gen(), headers=headers)
 
     async def event_generator():
         try:
             iterator = claude_service.stream_mentor_chat(
                 request.selected_code,
                 request.user_query,
-                request.context_summary,
-                request.full_file or "",
-                workspace_ctx_dict
+                context_summary,
+                full_file or "",
+                workspace_ctx_dict,
+                turns=list(session["turns"]),
+                digest=session["digest"]
             )
-            async for chunk in iterator:
+            async for chunk in sse.coalesce(record_turn(session_id, request.user_query, iterator)):
                 yield {"data": chunk}
             yield {"data": "[DONE]"}
+        except CircuitOpen:
+            async for event in mock_gen():
+                yield event
         except Exception as e:
              yield {"data": f"Error: {str(e)}"}
              yield {"data": "[DONE]"}
 
-    return EventSourceResponse(event_generator())
+    return sse.response(event_generator(), headers=headers)
 
 # --- Mock Endpoints (Fallback) ---
 
 @app.post("/mock_stream")
 async def mock_stream(request: AnalyzePasteRequest):
+    session_id = await start_quiz_session(request.code_snippet)
     async def event_generator():
-        async for chunk in mock_service.mock_stream_question(request.code_snippet, request.context_summary):
+        async for chunk in sse.coalesce(record_question(session_id, mock_service.mock_stream_question(request.code_snippet, request.context_summary))):
             yield {"data": chunk}
         yield {"data": "[DONE]"}
-    return EventSourceResponse(event_generator())
+    return sse.response(event_generator(), headers={SESSION_HEADER: session_id})
 
 @app.post("/mock_validate")
 async def mock_validate(request: ValidateAnswerRequest):
+    request = await resolve_quiz_request(request)
+    response = await speculative_answer(request) or await mock_evaluate_answer(request)
+    await record_answer(request, response)
+    return response
+
+async def mock_evaluate_answer(request: ValidateAnswerRequest) -> ValidateAnswerResponse:
     if request.question_number == 1:
         q2_text = await mock_service.mock_second_question(
             request.code_snippet,
@@ -7,10 +7,13 @@ class AnalyzePasteRequest(BaseModel):
     context_summary: str    # Full main.py content
 
 class ValidateAnswerRequest(BaseModel):
-    question: str           # The question text
     user_answer: str        # User's answer
-    code_snippet: str       # The pasted code block
-    question_number: int    # 1 or 2
+    # Session-based clients send only session_id + user_answer; the rest
+    # comes from the quiz session started by /analyze_paste.
+    session_id: Optional[str] = None
+    question: Optional[str] = None          # The question text
+    code_snippet: Optional[str] = None      # The pasted code block
+    question_number: Optional[int] = None   # 1 or 2
     # For Q2, also include Q1 context:
     question_1: Optional[str] = None
     answer_1: Optional[str] = None
@@ -19,6 +22,9 @@ class ValidateAnswerResponse(BaseModel):
     status: str             # "next_question" | "pass" | "fail"
     feedback: str           # Claude's feedback
     next_question: Optional[str] = None  # Q2 text (only when status="next_question")
+    # Verdicts return as soon as PASS/FAIL is known; the full explanation
+    # streams from GET /verdict_feedback/{feedback_id}
+    feedback_id: Optional[str] = None
 
 class AnalyzeErrorRequest(BaseModel):
     error_message: str
@@ -35,14 +41,38 @@ class WorkspaceContextData(BaseModel):
     relatedFiles: List[RelatedFile]
     fileTree: List[str]  # List of file paths
 
+class FileRef(BaseModel):
+    path: str
+    hash: str  # sha256 of the UTF-8 content, uploaded via PUT /blobs/{hash}
+
+class RelatedFileRef(FileRef):
+    relation: str  # 'import' | 'sibling' | 'dependency'
+
+class WorkspaceRefs(BaseModel):
+    """Same shape as WorkspaceContextData, with blob hashes instead of contents."""
+    activeFile: FileRef
+    relatedFiles: List[RelatedFileRef]
+    fileTree: List[str]
+
+class BlobQuery(BaseModel):
+    hashes: List[str]
+
 class MentorChatRequest(BaseModel):
     selected_code: str
     full_file: Optional[str] = None
     user_query: str
-    context_summary: str
-    history: Optional[str] = None # For chat history if needed
+    context_summary: str = ""
+    history: Optional[str] = None # Earlier conversation; seeds the digest of a new session
     workspace_context: Optional[WorkspaceContextData] = None
+    # Alternative to workspace_context once the files are in the blob store
+    workspace_refs: Optional[WorkspaceRefs] = None
+    # Reuses full_file / workspace_context / context_summary stored by an
+    # earlier message when they are omitted
+    session_id: Optional[str] = None
 
 class CodeExecutionRequest(BaseModel):
     code: str
+    # Kernel mode: run in a persistent per-session interpreter. Send "new"
+    # first, then the id returned in the result's "kernel" field.
+    kernel_id: Optional[str] = None
 
@@ -0,0 +1,247 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from services import metrics, state_backend
+
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Per-client token bucket: RATE_LIMIT_PER_MIN requests per minute on the
+# expensive routes, with bursts of up to RATE_LIMIT_BURST. A client is a
+# browser (the frontend's X-Client-Id header) at an address, so students
+# behind one NAT do not share a budget.
+RATE_LIMIT_PER_MIN = float(os.getenv("RATE_LIMIT_PER_MIN", "60"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "15"))
+# Requests (streams, runs) one client may have open at once
+CLIENT_MAX_IN_FLIGHT = int(os.getenv("CLIENT_MAX_IN_FLIGHT", "4"))
+# Ceilings per address, whatever client ids it sends (a classroom, or one
+# script rotating ids)
+IP_RATE_LIMIT_PER_MIN = float(os.getenv("IP_RATE_LIMIT_PER_MIN", "600"))
+IP_RATE_LIMIT_BURST = float(os.getenv("IP_RATE_LIMIT_BURST", "100"))
+IP_MAX_IN_FLIGHT = int(os.getenv("IP_MAX_IN_FLIGHT", "64"))
+# Behind a proxy (e.g. Render), take the address from X-Forwarded-For. Each
+# proxy appends the address it saw, so only the last TRUSTED_PROXY_HOPS
+# entries are trustworthy; anything further left is client-supplied.
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# Routes that cost an Anthropic call or a code run
+LIMITED_ROUTES = {"/analyze_paste", "/analyze_error", "/mentor_chat", "/validate_answer", "/api/run", "/api/run/stream"}
+
+# An in-flight count left behind by a crashed worker expires this long after
+# the client's last request
+_IN_FLIGHT_TTL = 600
+
+_CLIENT_ID = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+_current_client: contextvars.ContextVar[str] = contextvars.ContextVar("current_client", default="")
+
+
+def current_client() -> str:
+    """Client key of the request being served ("" outside admission-controlled routes)."""
+    return _current_client.get()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class FairLimiter:
+    """
+    `capacity` slots shared by all clients. When they are all taken, waiters
+    are served by weighted fair queuing rather than FIFO: each client's
+    waiters get virtual finish tags 1/weight apart, so a client with many
+    queued requests cannot push everyone else to the back of the line.
+    """
+
+    def __init__(self, capacity: int, max_waiting: Optional[int] = None):
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.in_use = 0
+        self.waiting = 0
+        self._waiters = []  # heap of (finish tag, seq, future)
+        self._finish = {}  # client -> finish tag of its last queued request
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+    def saturated(self) -> bool:
+        """True when a new request would get QueueFull."""
+        return self.in_use >= self.capacity and self.max_waiting is not None and self.waiting >= self.max_waiting
+
+    @asynccontextmanager
+    async def slot(self, client: Optional[str] = None, weight: float = 1.0):
+        if self.in_use < self.capacity and not self.waiting:
+            self.in_use += 1
+        else:
+            await self._wait(current_client() if client is None else client, weight)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _wait(self, client: str, weight: float):
+        if self.max_waiting is not None and self.waiting >= self.max_waiting:
+            raise QueueFull()
+        tag = max(self._vtime, self._finish.get(client, 0.0)) + 1 / weight
+        self._finish[client] = tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (tag, next(self._seq), future))
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # the slot was handed over just as we were cancelled
+            else:
+                future.cancel()
+                self.waiting -= 1
+            raise
+
+    def _release(self):
+        while self._waiters:
+            tag, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # cancelled waiter, already uncounted
+            self.waiting -= 1
+            self._vtime = tag
+            future.set_result(None)  # the slot passes straight to the waiter
+            return
+        self.in_use -= 1
+        self._finish.clear()  # nobody waiting: no backlog to be fair about
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, "in_use": self.in_use, "waiting": self.waiting}
+
+
+# --- Per-client limits ---
+
+def client_address(scope) -> str:
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if TRUST_PROXY_HEADERS:
+        headers = dict(scope.get("headers") or [])
+        hops = [hop.strip() for hop in headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")]
+        hops = [hop for hop in hops if hop]
+        if hops:
+            address = hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return address
+
+
+def client_key(scope) -> str:
+    """The client's address, plus its X-Client-Id when it sends a well-formed one."""
+    address = client_address(scope)
+    headers = dict(scope.get("headers") or [])
+    client_id = headers.get(b"x-client-id", b"").decode("latin-1")
+    return f"{address}/{client_id}" if _CLIENT_ID.fullmatch(client_id) else address
+
+
+def take_token(key: str, per_min: Optional[float] = None, burst: Optional[float] = None,
+               now: Optional[float] = None) -> float:
+    """
+    Spend one token from the key's bucket (RATE_LIMIT_PER_MIN / RATE_LIMIT_BURST
+    unless given). Returns 0 if there was one, else the seconds until there
+    will be. Read-modify-write on the state backend, so with several workers
+    a race can let an extra request through.
+    """
+    now = time.time() if now is None else now
+    per_min = RATE_LIMIT_PER_MIN if per_min is None else per_min
+    burst = RATE_LIMIT_BURST if burst is None else burst
+    rate = per_min / 60
+    state = state_backend.backend.get("rate_limit", key)
+    tokens, updated = state if state else (burst, now)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    state_backend.backend.set("rate_limit", key, [tokens - 1, now], ttl=burst / rate + 1)
+    return 0.0
+
+
+def take_tokens(client: str, address: str, now: Optional[float] = None) -> float:
+    """Spend from the address's bucket, then the client's. Returns 0 or the seconds to wait."""
+    if client != address:
+        retry_after = take_token("ip:" + address, IP_RATE_LIMIT_PER_MIN, IP_RATE_LIMIT_BURST, now)
+        if retry_after:
+            return retry_after
+    return take_token(client, now=now)
+
+
+def _too_many(retry_after: float, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ]
+    return body, headers
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware for LIMITED_ROUTES: rejects a client with 429 and
+    Retry-After when its token bucket is empty or it already has
+    CLIENT_MAX_IN_FLIGHT requests open (streams count until they end), with
+    looser ceilings per address, and tags the request with its client key
+    for the fair queues. State backend round trips run off the event loop.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (not ADMISSION_ENABLED or scope["type"] != "http" or scope["path"] not in LIMITED_ROUTES
+                or scope["method"] == "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        client = client_key(scope)
+        address = client_address(scope)
+        keys = [client] if client == address else [client, "ip:" + address]
+        in_flight = await self._in_flight(keys, 1)
+        try:
+            if in_flight[0] > CLIENT_MAX_IN_FLIGHT:
+                await self._reject(send, scope, 1, "in_flight", f"At most {CLIENT_MAX_IN_FLIGHT} requests at a time.")
+                return
+            if len(in_flight) > 1 and in_flight[1] > IP_MAX_IN_FLIGHT:
+                await self._reject(send, scope, 1, "ip_in_flight", "Too many requests from this network at once.")
+                return
+            if state_backend.backend.shared:
+                retry_after = await asyncio.to_thread(take_tokens, client, address)
+            else:
+                retry_after = take_tokens(client, address)
+            if retry_after:
+                await self._reject(send, scope, retry_after, "rate", "Too many requests. Please slow down.")
+                return
+
+            token = _current_client.set(client)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _current_client.reset(token)
+        finally:
+            await self._in_flight(keys, -1)
+
+    @staticmethod
+    async def _in_flight(keys, amount: int):
+        # Sliding TTL, and never below zero: a count that expired mid-stream
+        # cannot be pushed negative by the late decrement
+        return await asyncio.gather(*(
+            state_backend.backend.aincr("in_flight", key, amount, ttl=_IN_FLIGHT_TTL, floor=0, sliding=True)
+            for key in keys
+        ))
+
+    async def _reject(self, send, scope, retry_after: float, reason: str, detail: str):
+        metrics.admission_rejected.inc(route=scope["path"], reason=reason)
+        body, headers = _too_many(retry_after, detail)
+        await send({"type": "http.response.start", "status": 429, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,127 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from services import state_backend
+from services.state_backend import StateBackend
+
+load_dotenv()
+
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_MB", "256")) * 1024 * 1024
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_KB", "1024")) * 1024  # largest single file accepted
+FRAGMENT_MAX_ENTRIES = int(os.getenv("PROMPT_FRAGMENT_MAX_ENTRIES", "4096"))
+BLOB_TTL = int(os.getenv("BLOB_TTL", "86400"))  # seconds a blob is kept in a shared state backend
+
+_NS = "blob"
+
+
+def blob_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class HashMismatch(Exception):
+    pass
+
+
+class BlobStore:
+    """
+    Content-addressed store of workspace file contents, keyed by the sha256
+    of their UTF-8 bytes. Bounded by total size; least recently used blobs
+    are dropped first, and clients re-upload when a chat request names a
+    hash the store no longer has. With a shared state backend, blobs are
+    also written there so a file uploaded through one worker is found by all;
+    the methods are coroutines so those round trips happen off the event loop.
+    """
+
+    def __init__(self, max_bytes: int = BLOB_STORE_MAX_BYTES, shared: Optional[StateBackend] = None):
+        self.max_bytes = max_bytes
+        self._shared = shared
+        if shared is not None:
+            shared.set_limit(_NS, max_bytes=max_bytes)
+        self.size = 0
+        self._blobs = OrderedDict()  # hash -> content
+        self.uploads = 0
+        self.evictions = 0
+
+    async def put(self, expected_hash: str, content: str) -> str:
+        data_len = len(content.encode("utf-8"))
+        if data_len > BLOB_MAX_BYTES:
+            raise BlobTooLarge(f"Blob is {data_len} bytes; the limit is {BLOB_MAX_BYTES}")
+        actual = blob_hash(content)
+        if actual != expected_hash:
+            raise HashMismatch(f"Content hashes to {actual}")
+        if self._shared is not None:
+            await self._shared.aset(_NS, actual, content, ttl=BLOB_TTL)
+        if actual in self._blobs:
+            self._blobs.move_to_end(actual)
+            return actual
+        self.uploads += 1
+        self._remember(actual, content, data_len)
+        return actual
+
+    def _remember(self, key: str, content: str, data_len: int):
+        self._blobs[key] = content
+        self.size += data_len
+        while self.size > self.max_bytes and len(self._blobs) > 1:
+            _, dropped = self._blobs.popitem(last=False)
+            self.size -= len(dropped.encode("utf-8"))
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        content = self._blobs.get(key)
+        if content is not None:
+            self._blobs.move_to_end(key)
+        elif self._shared is not None:
+            content = await self._shared.aget(_NS, key, ttl=BLOB_TTL)
+            if content is not None:
+                self._remember(key, content, len(content.encode("utf-8")))
+        return content
+
+    async def missing(self, keys: Iterable[str]) -> List[str]:
+        return [key for key in dict.fromkeys(keys) if key not in self._blobs and await self.get(key) is None]
+
+    def stats(self) -> dict:
+        return {"blobs": len(self._blobs), "bytes": self.size, "uploads": self.uploads, "evictions": self.evictions}
+
+
+class FragmentCache:
+    """LRU of rendered prompt fragments keyed by blob hash plus rendering parameters."""
+
+    def __init__(self, max_entries: int = FRAGMENT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, key: tuple, build: Callable[[], str]) -> str:
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        fragment = self._fragments[key] = build()
+        while len(self._fragments) > self.max_entries:
+            self._fragments.popitem(last=False)
+        return fragment
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._fragments),
+        }
+
+
+# Workspace files uploaded via PUT /blobs/{hash}, and prompt text rendered from them
+blobs = BlobStore(shared=state_backend.backend if state_backend.backend.shared else None)
+fragments = FragmentCache()
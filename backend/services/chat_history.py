@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional
+
+from dotenv import load_dotenv
+
+from services import state_backend
+from services.session_store import sessions
+from services.token_budget import CHARS_PER_TOKEN, estimate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Once the verbatim turns of a mentor chat pass this many tokens, all but the
+# most recent CHAT_KEEP_RECENT_TURNS are folded into the session's digest
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "3000"))
+CHAT_KEEP_RECENT_TURNS = int(os.getenv("CHAT_KEEP_RECENT_TURNS", "4"))
+CHAT_DIGEST_MAX_TOKENS = int(os.getenv("CHAT_DIGEST_MAX_TOKENS", "500"))
+# A compaction claim left behind by a crashed worker expires after this long
+COMPACTION_CLAIM_TTL = 120
+
+_CLAIM_NS = "chat_compaction"
+
+# summarize(previous_digest, turns) -> new digest
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+counters = {"turns": 0, "compactions": 0, "llm_digests": 0, "local_digests": 0}
+_tasks = set()
+
+
+def keep_tail(text: str, max_tokens: int = CHAT_DIGEST_MAX_TOKENS) -> str:
+    """Keep the end of the text (the most recent part of a digest), cut on a line boundary."""
+    text = text or ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    tail = text[-max_tokens * CHARS_PER_TOKEN:]
+    if "\n" in tail:
+        tail = tail[tail.index("\n") + 1:]
+    return tail
+
+
+def history_tokens(session: dict) -> int:
+    return sum(estimate_tokens(t["user"]) + estimate_tokens(t["assistant"]) for t in session["turns"])
+
+
+async def add_turn(session_id: str, user_query: str, reply: str) -> Optional[dict]:
+    turn = {"user": user_query, "assistant": reply}
+    session = await sessions.modify(session_id, lambda data: {**data, "turns": data["turns"] + [turn]})
+    if session is not None:
+        counters["turns"] += 1
+    return session
+
+
+def needs_compaction(session: dict) -> bool:
+    return len(session["turns"]) > CHAT_KEEP_RECENT_TURNS and history_tokens(session) > CHAT_HISTORY_MAX_TOKENS
+
+
+def local_digest(digest: str, turns: List[dict]) -> str:
+    """Digest without a model call: one line per turn, first sentence of each reply."""
+    lines = [digest] if digest else []
+    for turn in turns:
+        reply = turn["assistant"].strip().split(". ")[0][:300]
+        lines.append(f"- Student asked: {turn['user'].strip()[:200]} / Mentor: {reply}")
+    return keep_tail("\n".join(lines))
+
+
+async def compact(session_id: str, summarize: Optional[Summarizer] = None):
+    """
+    Fold the older turns into the digest. Turns added while the summary is
+    being written are kept; only the turns that were summarized are dropped.
+    """
+    session = await sessions.get(session_id)
+    if session is None:
+        return
+    folded = session["turns"][:-CHAT_KEEP_RECENT_TURNS]
+    if not folded:
+        return
+    digest = None
+    if summarize is not None:
+        try:
+            digest = await summarize(session["digest"], folded)
+            counters["llm_digests"] += 1
+        except Exception:
+            logger.exception("chat digest failed; using local digest")
+    if not digest:
+        digest = local_digest(session["digest"], folded)
+        counters["local_digests"] += 1
+    digest = keep_tail(digest)
+    if await sessions.modify(session_id, lambda data: {**data, "digest": digest, "turns": data["turns"][len(folded):]}):
+        counters["compactions"] += 1
+
+
+async def _compact_claimed(session_id: str, summarize: Optional[Summarizer]):
+    # One compaction per session at a time, across all workers
+    if await state_backend.backend.aincr(_CLAIM_NS, session_id, ttl=COMPACTION_CLAIM_TTL) != 1:
+        return
+    try:
+        await compact(session_id, summarize)
+    finally:
+        await state_backend.backend.adelete(_CLAIM_NS, session_id)
+
+
+def schedule_compaction(session: dict, session_id: str, summarize: Optional[Summarizer] = None):
+    """Compact in the background so the reply that crossed the threshold is not delayed."""
+    if not needs_compaction(session):
+        return
+    task = asyncio.create_task(_compact_claimed(session_id, summarize))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def stats() -> dict:
+    return {**counters, "compacting": len(_tasks)}
@@ -1,15 +1,36 @@
 
 import os
-import anthropic
+import logging
+import secrets
+import time
 import asyncio
+from typing import Optional
 from dotenv import load_dotenv
 
+from services import chat_history, code_analyzer, metrics, state_backend
+from services.blob_store import fragments
+from services.llm_client import LazyClient
+from services.llm_policy import CircuitOpen, LLMPolicy
+from services.response_cache import make_key, question_cache
+from services.single_flight import SingleFlight
+from services.snippet_index import snippet_index
+from services.token_budget import MAX_INPUT_TOKENS, fit_workspace, truncate_to_tokens
+
 load_dotenv()
 
-# Initialize Async Anthropic client
+logger = logging.getLogger(__name__)
+
+# Initialize Async Anthropic client (the SDK is imported on first use, see llm_client)
 api_key = os.getenv("ANTHROPIC_API_KEY")
-client = anthropic.AsyncAnthropic(api_key=api_key) if api_key and api_key != "placeholder" else None
-MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022")
+# Retries are done by the policy layer, which also knows about the breaker
+client = LazyClient(api_key=api_key, max_retries=0) if api_key and api_key != "placeholder" else None
+# Timeouts, retries, hedging and the circuit breaker around `client`; its
+# router picks the model per call type (CLAUDE_MODEL / LLM_MODEL_FAST, see model_router)
+policy = LLMPolicy(client)
+
+def available() -> bool:
+    """True when calls should go to Claude; False means use mock_service."""
+    return policy.available()
 
 SYSTEM_PROMPT = """You are a Senior Software Engineer conducting a code review.
 You are part of the "Anti-Copilot" system that detects when developers paste code without understanding it.
@@ -68,33 +89,130 @@ Your goal is to guide the developer to the solution WITHOUT giving them the answ
       So we should use it."
 </rules>"""
 
+def cached_system(prompt: str) -> list:
+    """System prompt as a content block marked for provider-side prompt caching."""
+    return [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+
+def routed(call: str, **kwargs) -> dict:
+    """
+    Request kwargs with the model the router picks for them. Response caches
+    key on that model, and the call is sent to it, so a latency fallback or
+    a size upgrade never serves one model's cached answer as another's.
+    """
+    return {**kwargs, "model": policy.router.choose(call, kwargs)}
+
+# Identical Q1 / error-hint requests in flight share one upstream stream
+flights = SingleFlight()
+
+# Token usage per call type since startup
+usage_totals = {}
+
+def record_usage(call: str, usage):
+    """Log one request's token usage and add it to usage_totals."""
+    if usage is None:
+        return
+    report = {
+        "input_tokens": usage.input_tokens or 0,
+        "cached_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "output_tokens": usage.output_tokens or 0,
+    }
+    totals = usage_totals.setdefault(call, {"requests": 0, **{k: 0 for k in report}})
+    totals["requests"] += 1
+    for k, v in report.items():
+        totals[k] += v
+    for kind, key in (("input", "input_tokens"), ("output", "output_tokens"),
+                      ("cache_read", "cached_input_tokens"), ("cache_write", "cache_write_tokens")):
+        metrics.llm_tokens.inc(report[key], call=call, kind=kind)
+    logger.info("claude %s usage: %s", call, report)
+
 async def stream_first_question(code_snippet: str, context_summary: str):
     """
     Streams Q1 via Claude API (Async).
+    Cached questions, and questions generated for near-duplicate snippets,
+    are replayed chunk by chunk without calling the API. Concurrent requests
+    for the same snippet and context share a single upstream stream.
+    Static analysis runs first: a confident finding becomes the question
+    directly, otherwise its facts ground a shorter prompt.
     """
     if not client:
         yield "Error: Anthropic API Key not configured."
         return
 
-    message = f"""The developer just pasted this code into their editor:
+    # Routed on the full-context prompt, the larger of the two Q1 prompts
+    model = routed("first_question", max_tokens=300, system=cached_system(SYSTEM_PROMPT),
+                   messages=[{"role": "user", "content": _first_question_prompt(code_snippet, context_summary, {})}])["model"]
+    cache_key = make_key("q1", model, code_snippet, context_summary)
+    # Near duplicates only count when generated for the same model and file context
+    scope = make_key("q1", model, context_summary)
+    cached = await question_cache.get(cache_key)
+    if cached is None:
+        cached = snippet_index.lookup(code_snippet, scope=scope)
+        if cached is not None:
+            await question_cache.set(cache_key, cached)
+    if cached is not None:
+        for chunk in cached:
+            yield chunk
+        return
+
+    facts = await code_analyzer.analyze_async(code_snippet)
+    question = code_analyzer.template_question(facts)
+    if question:
+        code_analyzer.outcomes["templated"] += 1
+        await question_cache.set(cache_key, [question])
+        snippet_index.add(code_snippet, [question], scope=scope)
+        yield question
+        return
+
+    upstream = lambda: _stream_first_question_upstream(cache_key, scope, model, code_snippet, context_summary, facts)
+    async for chunk in flights.stream(cache_key, upstream):
+        yield chunk
+
+def _first_question_prompt(code_snippet: str, context_summary: str, facts: dict) -> str:
+    if facts.get("parsed"):
+        return f"""The developer just pasted this code into their editor:
+
+PASTED CODE:
+{code_snippet}
+
+STATIC ANALYSIS (automated, may be incomplete):
+{code_analyzer.summarize(facts)}
+
+SURROUNDING FILE (excerpt):
+{truncate_to_tokens(context_summary, code_analyzer.GROUNDED_CONTEXT_TOKENS)}
+
+Ask ONE question about this pasted code, about the most important issue above if any is real."""
+    return f"""The developer just pasted this code into their editor:
 
 PASTED CODE:
 {code_snippet}
 
 FULL FILE CONTEXT:
-{context_summary}
+{truncate_to_tokens(context_summary, MAX_INPUT_TOKENS)}
 
 Ask ONE question about this pasted code."""
 
+async def _stream_first_question_upstream(cache_key: str, scope: str, model: str, code_snippet: str, context_summary: str, facts: dict):
+    if facts.get("parsed"):
+        code_analyzer.outcomes["grounded"] += 1
+    message = _first_question_prompt(code_snippet, context_summary, facts)
     try:
-        async with client.messages.stream(
-            model=MODEL,
+        async with policy.stream(
+            "first_question",
+            model=model,
             max_tokens=300,
-            system=SYSTEM_PROMPT,
+            system=cached_system(SYSTEM_PROMPT),
             messages=[{"role": "user", "content": message}]
         ) as stream:
+            chunks = []
             async for text in stream.text_stream:
+                chunks.append(text)
                 yield text
+            record_usage("first_question", (await stream.get_final_message()).usage)
+        await question_cache.set(cache_key, chunks)
+        snippet_index.add(code_snippet, chunks, scope=scope)
+    except CircuitOpen:
+        raise
     except Exception as e:
         yield f"Error calling Claude: {str(e)}"
 
@@ -113,21 +231,96 @@ User Answer: {answer_1}
 
 The user answered the first question. Now ask a SECOND, DIFFERENT question about the same code to verify deeper understanding.
 Keep it strictly conceptual (no code blocks)."""
+    request = routed(
+        "second_question",
+        max_tokens=300,
+        system=cached_system(SYSTEM_PROMPT),
+        messages=[{"role": "user", "content": message}]
+    )
+
+    cache_key = make_key("q2", request["model"], code_snippet, question_1, answer_1)
+    cached = await question_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        response = await client.messages.create(
-            model=MODEL,
-            max_tokens=300,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": message}]
-        )
-        return response.content[0].text
+        response = await policy.create("second_question", **request)
+        record_usage("second_question", response.usage)
+        question = response.content[0].text
+        await question_cache.set(cache_key, question)
+        return question
+    except CircuitOpen:
+        raise
+    except asyncio.TimeoutError:
+        raise
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+async def generate_followup_question(code_snippet: str, question_1: str):
+    """
+    Answer-independent Q2 candidate, generated speculatively while the user
+    is still answering Q1. (Async)
+    """
+    if not client:
+        return "Error: No API Key."
+
+    message = f"""Pasted Code:
+{code_snippet}
+
+Question 1: {question_1}
+
+The user is answering the first question. Ask a SECOND, DIFFERENT question about the same code to verify deeper understanding.
+It must make sense whatever they answer, so do not refer to their answer.
+Keep it strictly conceptual (no code blocks)."""
+    request = routed(
+        "followup_question",
+        max_tokens=300,
+        system=cached_system(SYSTEM_PROMPT),
+        messages=[{"role": "user", "content": message}]
+    )
+
+    cache_key = make_key("q2_followup", request["model"], code_snippet, question_1)
+    cached = await question_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await policy.create("followup_question", **request)
+        record_usage("followup_question", response.usage)
+        question = response.content[0].text
+        await question_cache.set(cache_key, question)
+        return question
     except Exception as e:
         return f"Error: {str(e)}"
 
-async def evaluate_combined_answers(code_snippet: str, q1: str, a1: str, q2: str, a2: str):
+# Verdict streams by feedback id; /verdict_feedback reads the rest of the text from here
+verdict_flights = SingleFlight()
+VERDICT_FEEDBACK_TTL = 600  # seconds the finished feedback stays fetchable
+
+def parse_verdict(text: str) -> Optional[str]:
+    """
+    "pass" / "fail" as soon as the first line settles it, None while it is
+    still arriving. A finished first line without PASS counts as a fail.
+    Leading blank lines and spaces before the verdict are skipped.
+    """
+    first_line, newline, _ = text.lstrip().partition("\n")
+    verdict = first_line.upper().replace("*", "")  # Handle bolding if any
+    if "PASS" in verdict:
+        return "pass"
+    if "FAIL" in verdict or newline:
+        return "fail"
+    return None
+
+def feedback_text(text: str) -> str:
+    """Everything after the verdict line."""
+    return text.lstrip().partition("\n")[2].strip()
+
+async def evaluate_combined_answers(code_snippet: str, q1: str, a1: str, q2: str, a2: str, feedback_id: str = None):
     """
     Evaluate both answers. Returns dict with status and feedback. (Async)
+    The verdict is streamed and returned as soon as its first line decides
+    pass/fail; the explanation keeps generating under `feedback_id` (see
+    stream_verdict_feedback). "feedback" holds whatever arrived by then.
     """
     if not client:
         return {"status": "pass", "feedback": "Mock Pass (No API Key)"}
@@ -144,26 +337,83 @@ A2: {a2}
 Evaluate if the developer demonstrates genuine understanding of the code.
 Respond with EXACTLY 'PASS' or 'FAIL' on the first line, followed by a brief 1-sentence explanation."""
 
+    feedback_id = feedback_id or secrets.token_urlsafe(12)
+    chunks = verdict_flights.stream(feedback_id, lambda: _stream_verdict_upstream(feedback_id, message))
+    text = ""
     try:
-        response = await client.messages.create(
-            model=MODEL,
-            max_tokens=300,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": message}]
-        )
-        text = response.content[0].text.strip()
-        lines = text.split('\n')
-        verdict = lines[0].upper().replace("*", "") # Handle bolding if any
-        feedback = "\n".join(lines[1:]).strip()
-        
-        status = "pass" if "PASS" in verdict else "fail"
-        return {"status": status, "feedback": feedback}
+        async for chunk in chunks:
+            text += chunk
+            if parse_verdict(text):
+                break
+        # Leaving early only ends this subscription; the feedback keeps streaming
+        await chunks.aclose()
+        return {"status": parse_verdict(text) or "fail", "feedback": feedback_text(text), "feedback_id": feedback_id}
+    except CircuitOpen:
+        raise
+    except asyncio.TimeoutError:
+        raise
     except Exception as e:
         return {"status": "fail", "feedback": f"Error: {str(e)}"}
 
+async def _stream_verdict_upstream(feedback_id: str, message: str):
+    text = []
+    async with policy.stream(
+        "evaluate",
+        max_tokens=300,
+        system=cached_system(SYSTEM_PROMPT),
+        messages=[{"role": "user", "content": message}]
+    ) as stream:
+        async for chunk in stream.text_stream:
+            text.append(chunk)
+            yield chunk
+        record_usage("evaluate", (await stream.get_final_message()).usage)
+    # Stored before the flight ends, so a reader that misses the flight finds it here
+    await state_backend.backend.aset("verdict_feedback", feedback_id, feedback_text("".join(text)), ttl=VERDICT_FEEDBACK_TTL)
+
+async def stream_verdict_feedback(feedback_id: str, wait: float = 15.0):
+    """
+    The explanation that follows a verdict: live from the verdict stream if it
+    is still running in this worker, else the stored text once it is there.
+    """
+    live = verdict_flights.join(feedback_id)
+    if live is not None:
+        text = ""
+        sent = None  # how much of text has been passed on (or skipped as the verdict line)
+        started = False
+        async for chunk in live:
+            text += chunk
+            if sent is None:
+                # The verdict line ends at the first newline after any leading blank lines
+                lead = len(text) - len(text.lstrip())
+                end = text.find("\n", lead)
+                if lead == len(text) or end < 0:
+                    continue
+                sent = end + 1
+            rest = text[sent:] if started else text[sent:].lstrip()
+            if rest:
+                yield rest
+                started = True
+            sent = len(text)
+        return
+
+    # Another worker may still be generating it (only possible with a shared backend)
+    deadline = time.monotonic() + (wait if state_backend.backend.shared else 0)
+    while True:
+        feedback = await state_backend.backend.aget("verdict_feedback", feedback_id)
+        if feedback is not None:
+            if feedback:
+                yield feedback
+            return
+        if time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(0.2)
+
 async def stream_error_hint(error_message: str, line_code: str, context_summary: str):
     """
     Streams a proactive hint for an error.
+    Hints are memoized per (error, line) pair: the same marker re-firing
+    while the user keeps typing elsewhere replays the earlier hint, and
+    requests arriving while it is still streaming join that stream.
     """
     if not client:
         yield "Error: Anthropic API Key not configured."
@@ -174,61 +424,140 @@ Error: {error_message}
 Line: {line_code}
 
 Context:
-{context_summary}
+{truncate_to_tokens(context_summary, MAX_INPUT_TOKENS)}
 
 Provide a short, 1-sentence hint to help them fix it. Do not write the fix."""
+    request = routed(
+        "error_hint",
+        max_tokens=150,
+        system=cached_system(MENTOR_SYSTEM_PROMPT),
+        messages=[{"role": "user", "content": message}]
+    )
+
+    cache_key = make_key("error_hint", request["model"], error_message, line_code)
+    cached = await question_cache.get(cache_key)
+    if cached is not None:
+        for chunk in cached:
+            yield chunk
+        return
 
+    upstream = lambda: _stream_error_hint_upstream(cache_key, request)
+    async for chunk in flights.stream(cache_key, upstream):
+        yield chunk
+
+async def _stream_error_hint_upstream(cache_key: str, request: dict):
     try:
-        async with client.messages.stream(
-            model=MODEL,
-            max_tokens=150,
-            system=MENTOR_SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": message}]
-        ) as stream:
+        async with policy.stream("error_hint", **request) as stream:
+            chunks = []
             async for text in stream.text_stream:
+                chunks.append(text)
                 yield text
+            record_usage("error_hint", (await stream.get_final_message()).usage)
+        await question_cache.set(cache_key, chunks)
+    except CircuitOpen:
+        raise
     except Exception as e:
         yield f"Error: {str(e)}"
 
-async def stream_mentor_chat(selected_code: str, user_query: str, context_summary: str, full_file: str = "", workspace_context: dict = None):
+def _truncate_file(file: dict, max_tokens: int) -> str:
+    """truncate_to_tokens, memoized per blob for files that came from the blob store."""
+    if not file.get("hash"):
+        return truncate_to_tokens(file.get("content", ""), max_tokens)
+    return fragments.render(("truncated", file["hash"], max_tokens),
+                            lambda: truncate_to_tokens(file.get("content", ""), max_tokens))
+
+def _related_fragment(rf: dict) -> str:
+    render = lambda: f"\n--- {rf['path']} ({rf['relation']}) ---\n{rf['content']}\n"
+    if not rf.get("hash"):
+        return render()
+    return fragments.render(("related", rf["hash"], rf["path"], rf["relation"], len(rf["content"])), render)
+
+def _chat_messages(context_block: str, query_block: str, turns: list, digest: str) -> list:
+    """
+    Prompt layout, most stable part first so it stays in the prompt cache:
+    workspace/file context, then the digest of older turns, then the recent
+    turns verbatim, then the new question. The last stored turn is a second
+    cache breakpoint, so a follow-up only pays for the newest exchange.
+    """
+    opening = [{"type": "text", "text": context_block, "cache_control": {"type": "ephemeral"}}]
+    if digest:
+        opening.append({"type": "text", "text": f"EARLIER IN THIS CONVERSATION (summary):\n{digest}"})
+    if not turns:
+        return [{"role": "user", "content": opening + [{"type": "text", "text": query_block}]}]
+
+    messages = [{"role": "user", "content": opening + [{"type": "text", "text": turns[0]["user"]}]}]
+    for i, turn in enumerate(turns):
+        if i:
+            messages.append({"role": "user", "content": turn["user"]})
+        messages.append({"role": "assistant", "content": turn["assistant"]})
+    messages[-1]["content"] = [{"type": "text", "text": turns[-1]["assistant"], "cache_control": {"type": "ephemeral"}}]
+    messages.append({"role": "user", "content": query_block})
+    return messages
+
+async def summarize_chat(digest: str, turns: list) -> str:
+    """Fold older mentor chat turns into the running digest of the conversation."""
+    transcript = "\n\n".join(f"Student: {t['user']}\nMentor: {t['assistant']}" for t in turns)
+    message = f"""Summary of the conversation so far:
+{digest or "(none)"}
+
+Next part of the conversation:
+{transcript}
+
+Rewrite the summary to cover both, in at most {chat_history.CHAT_DIGEST_MAX_TOKENS * 3 // 4} words.
+Keep what the student asked, what they understood or got wrong, and which files or functions were discussed.
+Plain sentences, no code blocks."""
+
+    response = await policy.create(
+        "chat_digest",
+        max_tokens=chat_history.CHAT_DIGEST_MAX_TOKENS,
+        messages=[{"role": "user", "content": message}]
+    )
+    record_usage("chat_digest", response.usage)
+    return response.content[0].text
+
+async def stream_mentor_chat(selected_code: str, user_query: str, context_summary: str, full_file: str = "",
+                             workspace_context: dict = None, turns: list = None, digest: str = ""):
     """
     Streams a response to a user's question about code.
     Receives both selected_code (highlighted snippet) and full_file (entire file)
     so Claude has global context but focuses on the highlighted section.
-    Now also supports workspace_context for multi-file awareness.
+    Now also supports workspace_context for multi-file awareness, and the
+    session's earlier turns (recent ones verbatim, older ones as a digest).
     """
     if not client:
         yield "Error: Anthropic API Key not configured."
         return
 
-    # Build context block with workspace awareness if available
+    highlighted = selected_code if selected_code else "(No specific selection — user is asking about the file in general.)"
+
+    # The workspace/file block comes first and is marked cacheable: it stays
+    # identical across follow-up questions, so only the query part is new input.
     if workspace_context:
-        # Build rich workspace context prompt
-        active_file = workspace_context.get("activeFile", {})
-        related_files = workspace_context.get("relatedFiles", [])
-        file_tree = workspace_context.get("fileTree", [])
+        # Build rich workspace context prompt, trimmed to the token budget
+        fitted = fit_workspace(workspace_context, MAX_INPUT_TOKENS, truncate=_truncate_file)
+        active_file = fitted["activeFile"]
 
-        # Limit file tree display to 50 files
-        tree_display = "\n".join(file_tree[:50])
-        if len(file_tree) > 50:
-            tree_display += f"\n... and {len(file_tree) - 50} more files"
+        tree_display = "\n".join(fitted["fileTree"])
+        if fitted["fileTreeTotal"] > len(fitted["fileTree"]):
+            tree_display += f"\n... and {fitted['fileTreeTotal'] - len(fitted['fileTree'])} more files"
 
         # Build related files section
         related_section = ""
-        if related_files:
+        if fitted["relatedFiles"]:
             related_section = "\n\nRELATED FILES:\n"
-            for rf in related_files:
-                related_section += f"\n--- {rf['path']} ({rf['relation']}) ---\n{rf['content']}\n"
+            related_section += "".join(_related_fragment(rf) for rf in fitted["relatedFiles"])
+        if fitted["omittedFiles"]:
+            related_section += f"\n(Omitted to fit context: {', '.join(fitted['omittedFiles'])})\n"
 
-        message = f"""WORKSPACE STRUCTURE:
+        context_block = f"""WORKSPACE STRUCTURE:
 {tree_display}
 
 ACTIVE FILE: {active_file.get('path', 'unknown')}
 {active_file.get('content', '')}
-{related_section}
+{related_section}"""
 
-HIGHLIGHTED SECTION (focus on this):
-{selected_code if selected_code else "(No specific selection — user is asking about the file in general.)"}
+        query_block = f"""HIGHLIGHTED SECTION (focus on this):
+{highlighted}
 
 User Query: "{user_query}"
 
@@ -238,24 +567,27 @@ Answer the user's question conceptually. You have full workspace context - refer
         # Fallback to old single-file format
         file_context = full_file if full_file else context_summary
 
-        message = f"""FULL FILE (for context):
-{file_context}
+        context_block = f"""FULL FILE (for context):
+{truncate_to_tokens(file_context, MAX_INPUT_TOKENS)}"""
 
-HIGHLIGHTED SECTION (focus on this):
-{selected_code if selected_code else "(No specific selection — user is asking about the file in general.)"}
+        query_block = f"""HIGHLIGHTED SECTION (focus on this):
+{highlighted}
 
 User Query: "{user_query}"
 
 Answer the user's question conceptually. Focus on the highlighted section but use the full file for context. Remember: NO CODE BLOCKS."""
 
     try:
-        async with client.messages.stream(
-            model=MODEL,
+        async with policy.stream(
+            "mentor_chat",
             max_tokens=500,  # Increased from 400 to accommodate richer responses
-            system=MENTOR_SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": message}]
+            system=cached_system(MENTOR_SYSTEM_PROMPT),
+            messages=_chat_messages(context_block, query_block, turns or [], digest)
         ) as stream:
             async for text in stream.text_stream:
                 yield text
+            record_usage("mentor_chat", (await stream.get_final_message()).usage)
+    except CircuitOpen:
+        raise
     except Exception as e:
         yield f"Error: {str(e)}"
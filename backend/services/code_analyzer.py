@@ -0,0 +1,315 @@
+import ast
+import asyncio
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from services.response_cache import ResponseCache, make_key
+
+load_dotenv()
+
+# Snippets larger than this are analyzed in the process pool instead of inline
+INLINE_MAX_BYTES = int(os.getenv("ANALYZER_INLINE_MAX_BYTES", "4096"))
+WORKERS = int(os.getenv("ANALYZER_WORKERS", "2"))
+# Findings at or above this confidence are asked as a templated Q1 (no LLM call)
+TEMPLATE_CONFIDENCE = float(os.getenv("ANALYZER_TEMPLATE_CONFIDENCE", "0.85"))
+CACHE_MAX_ENTRIES = int(os.getenv("ANALYZER_CACHE_MAX_ENTRIES", "2048"))
+# With analysis facts in the prompt, the surrounding file is cut to this many tokens
+GROUNDED_CONTEXT_TOKENS = int(os.getenv("ANALYZER_CONTEXT_TOKENS", "1500"))
+
+# Calls that hand back something that must be closed
+RESOURCE_CALLS = {
+    "open": "file", "connect": "connection", "socket": "socket", "urlopen": "connection",
+    "Session": "session", "Popen": "process", "ZipFile": "archive", "cursor": "cursor",
+}
+# Cursors are usually released with their connection, so leaking one matters less
+RESOURCE_CONFIDENCE = {"cursor": 0.6}
+SQL_METHODS = {"execute", "executemany", "executescript", "raw", "text"}
+_SQL_WORDS = re.compile(r"\b(SELECT|INSERT|UPDATE|DELETE|CREATE|DROP|WHERE)\b", re.I)
+COMPLEXITY_THRESHOLD = 10
+DEEP_LOOP_DEPTH = 3
+
+TEMPLATES = {
+    "sql_injection": (
+        "On line {line} the SQL passed to **{call}** is built by pasting values into the query string. "
+        "What could a caller do if one of those values came from user input, and how could the values "
+        "reach the database without becoming part of the SQL text?"
+    ),
+    "unclosed_resource": (
+        "Line {line} opens a **{resource}** (**{name}**) but nothing guarantees it gets closed. "
+        "What happens to it if an exception is raised partway through, and how would you make "
+        "the cleanup unconditional?"
+    ),
+    "close_not_guaranteed": (
+        "**{name}** from line {line} is closed on the happy path only. If an earlier statement raises, "
+        "what happens to the **{resource}**, and where should the cleanup live instead?"
+    ),
+    "swallowed_exception": (
+        "The handler on line {line} catches every exception and carries on. Which failures do you "
+        "actually expect there, and what do you lose when an unexpected one is silently ignored?"
+    ),
+    "nested_loops": (
+        "This code nests loops {depth} levels deep (around line {line}). How does the running time grow "
+        "as the inputs get larger, and could a different data structure avoid rescanning the inner data?"
+    ),
+    "high_complexity": (
+        "**{name}** has a cyclomatic complexity of {complexity}. How many paths would you need to test "
+        "to trust it, and which responsibilities could be pulled out of it?"
+    ),
+}
+
+
+def _call_name(node: ast.AST) -> str:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = _call_name(node.value)
+        return f"{base}.{node.attr}" if base else node.attr
+    return ""
+
+
+def _is_built_string(node: ast.AST) -> Optional[str]:
+    """How a string expression was assembled from values, if it was."""
+    if isinstance(node, ast.JoinedStr) and any(isinstance(v, ast.FormattedValue) for v in node.values):
+        return "f-string"
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+        operands = (node.left, node.right)
+        if any(isinstance(o, ast.Constant) and isinstance(o.value, str) for o in operands) or any(_is_built_string(o) for o in operands):
+            return "concatenation" if isinstance(node.op, ast.Add) else "% formatting"
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "format":
+        return ".format()"
+    return None
+
+
+def _string_text(node: ast.AST) -> str:
+    return " ".join(n.value for n in ast.walk(node) if isinstance(n, ast.Constant) and isinstance(n.value, str))
+
+
+def _complexity(func: ast.AST) -> int:
+    score = 1
+    for node in ast.walk(func):
+        if isinstance(node, (ast.If, ast.For, ast.AsyncFor, ast.While, ast.IfExp, ast.ExceptHandler, ast.Assert)):
+            score += 1
+        elif isinstance(node, ast.BoolOp):
+            score += len(node.values) - 1
+        elif isinstance(node, ast.comprehension):
+            score += 1 + len(node.ifs)
+        elif isinstance(node, ast.match_case):
+            score += 1
+    return score
+
+
+class _Visitor(ast.NodeVisitor):
+    def __init__(self):
+        self.loop_depth = 0
+        self.max_loop_depth = 0
+        self.deepest_loop_line = None
+        self.in_finally = 0
+        self.scope = ("<module>",)  # names below are qualified by the enclosing function
+        self.with_resources = set()
+        self.acquired = []  # (scoped name, call, resource, line)
+        self.closed = {}  # scoped name -> closed inside a finally block?
+        self.sql_vars = {}  # scoped name -> how its SQL string was built
+        self.sql = []
+        self.swallowed = []
+
+    def _loop(self, node, extra_depth: int = 1):
+        self.loop_depth += extra_depth
+        if self.loop_depth > self.max_loop_depth:
+            self.max_loop_depth = self.loop_depth
+            self.deepest_loop_line = node.lineno
+        self.generic_visit(node)
+        self.loop_depth -= extra_depth
+
+    visit_For = visit_AsyncFor = visit_While = _loop
+
+    def visit_ListComp(self, node):
+        self._loop(node, len(node.generators))
+
+    visit_SetComp = visit_GeneratorExp = visit_DictComp = visit_ListComp
+
+    def visit_FunctionDef(self, node):
+        outer = self.scope
+        self.scope = outer + (node.name,)
+        self.generic_visit(node)
+        self.scope = outer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _scoped(self, name: str) -> tuple:
+        return self.scope + (name,)
+
+    def visit_With(self, node):
+        for item in node.items:
+            if isinstance(item.optional_vars, ast.Name):
+                self.with_resources.add(self._scoped(item.optional_vars.id))
+        self.generic_visit(node)
+
+    visit_AsyncWith = visit_With
+
+    def visit_Try(self, node):
+        for child in node.body + node.orelse:
+            self.visit(child)
+        for handler in node.handlers:
+            self.visit(handler)
+        self.in_finally += 1
+        for child in node.finalbody:
+            self.visit(child)
+        self.in_finally -= 1
+
+    visit_TryStar = visit_Try
+
+    def visit_ExceptHandler(self, node):
+        broad = node.type is None or _call_name(node.type) in ("Exception", "BaseException")
+        only_pass = all(isinstance(stmt, (ast.Pass, ast.Continue)) or
+                        (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant)) for stmt in node.body)
+        if broad and (node.type is None or only_pass):
+            self.swallowed.append(node.lineno)
+        self.generic_visit(node)
+
+    def visit_Assign(self, node):
+        target = node.targets[0] if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) else None
+        if target is not None:
+            if isinstance(node.value, ast.Call):
+                call = _call_name(node.value.func)
+                resource = RESOURCE_CALLS.get(call.rsplit(".", 1)[-1])
+                if resource:
+                    self.acquired.append((self._scoped(target.id), call, resource, node.lineno))
+            built = _is_built_string(node.value)
+            if built and _SQL_WORDS.search(_string_text(node.value)):
+                self.sql_vars[self._scoped(target.id)] = built
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        name = _call_name(node.func)
+        method = name.rsplit(".", 1)[-1]
+        if method == "close" and isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name):
+            owner = self._scoped(node.func.value.id)
+            self.closed[owner] = self.closed.get(owner, False) or self.in_finally > 0
+        if method in SQL_METHODS and node.args:
+            query = node.args[0]
+            built = _is_built_string(query)
+            if built is None and isinstance(query, ast.Name):
+                built = self.sql_vars.get(self._scoped(query.id))
+            if built:
+                self.sql.append({"line": node.lineno, "call": name, "how": built})
+        self.generic_visit(node)
+
+
+def analyze(code: str) -> dict:
+    """
+    Structural facts about a Python snippet plus ranked findings.
+    Pure and picklable so it can run in a worker process.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError):
+        return {"parsed": False, "findings": []}
+
+    visitor = _Visitor()
+    visitor.visit(tree)
+
+    findings = []
+    for item in visitor.sql:
+        findings.append({"kind": "sql_injection", "confidence": 0.9 if item["how"] == "f-string" else 0.85, **item})
+    for scoped, call, resource, line in visitor.acquired:
+        if scoped in visitor.with_resources:
+            continue
+        finding = {"name": scoped[-1], "call": call, "resource": resource, "line": line}
+        if scoped not in visitor.closed:
+            confidence = RESOURCE_CONFIDENCE.get(resource, 0.85)
+            findings.append({"kind": "unclosed_resource", "confidence": confidence, **finding})
+        elif not visitor.closed[scoped]:
+            confidence = min(RESOURCE_CONFIDENCE.get(resource, 0.7), 0.7)
+            findings.append({"kind": "close_not_guaranteed", "confidence": confidence, **finding})
+    for line in visitor.swallowed:
+        findings.append({"kind": "swallowed_exception", "confidence": 0.8, "line": line})
+    if visitor.max_loop_depth >= DEEP_LOOP_DEPTH:
+        findings.append({"kind": "nested_loops", "confidence": 0.75, "depth": visitor.max_loop_depth, "line": visitor.deepest_loop_line})
+
+    complexity = {
+        node.name: _complexity(node)
+        for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    }
+    for name, score in complexity.items():
+        if score >= COMPLEXITY_THRESHOLD:
+            findings.append({"kind": "high_complexity", "confidence": 0.6, "name": name, "complexity": score,
+                             "line": next(n.lineno for n in ast.walk(tree) if getattr(n, "name", None) == name)})
+
+    findings.sort(key=lambda f: (-f["confidence"], f.get("line", 0)))
+    return {
+        "parsed": True,
+        "max_loop_depth": visitor.max_loop_depth,
+        "complexity": complexity,
+        "findings": findings,
+    }
+
+
+def template_question(facts: dict) -> Optional[str]:
+    """A Q1 written from the top finding, when it is confident enough."""
+    findings = facts.get("findings") or []
+    if not findings or findings[0]["confidence"] < TEMPLATE_CONFIDENCE:
+        return None
+    top = findings[0]
+    return TEMPLATES[top["kind"]].format(**top)
+
+
+def summarize(facts: dict) -> str:
+    """Facts as short prompt lines for the LLM."""
+    if not facts.get("parsed"):
+        return "- The snippet does not parse as Python."
+    lines = [f"- line {f.get('line', '?')}: {f['kind'].replace('_', ' ')}"
+             + (f" ({f['call']})" if f.get("call") else "")
+             + (f" depth {f['depth']}" if f.get("depth") else "")
+             + (f" {f['name']} complexity {f['complexity']}" if f.get("complexity") else "")
+             for f in facts["findings"][:6]]
+    lines.append(f"- max loop nesting: {facts['max_loop_depth']}")
+    if facts["complexity"]:
+        name, score = max(facts["complexity"].items(), key=lambda kv: kv[1])
+        lines.append(f"- most complex function: {name} (cyclomatic {score})")
+    return "\n".join(lines)
+
+
+analysis_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES)
+# How Q1s were produced: from a template, or by the LLM with facts in the prompt
+outcomes = {"templated": 0, "grounded": 0}
+_pool = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Not fork: the server process has an event loop, threads and open
+        # sockets that a forked child would inherit half-initialized
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+async def analyze_async(code: str) -> dict:
+    """Cached `analyze`; large snippets run in the process pool so parsing never blocks the loop."""
+    key = make_key("analysis", "", code)
+    facts = await analysis_cache.get(key)
+    if facts is not None:
+        return facts
+    if len(code) <= INLINE_MAX_BYTES:
+        facts = analyze(code)
+    else:
+        facts = await asyncio.get_running_loop().run_in_executor(_get_pool(), analyze, code)
+    await analysis_cache.set(key, facts)
+    return facts
+
+
+def stats() -> dict:
+    return {**outcomes, "cache": analysis_cache.stats()}
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
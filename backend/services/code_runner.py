@@ -0,0 +1,641 @@
+import asyncio
+import codecs
+import json
+import logging
+import os
+import secrets
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from services import metrics, run_cache
+from services.admission import FairLimiter
+
+logger = logging.getLogger(__name__)
+
+RUN_TIMEOUT = 5  # seconds
+MAX_CONCURRENCY = int(os.getenv("RUNNER_MAX_CONCURRENCY", "4"))
+MAX_QUEUE = int(os.getenv("RUNNER_MAX_QUEUE", "16"))
+# Combined stdout+stderr a single run may produce before it is killed
+MAX_OUTPUT_BYTES = int(os.getenv("RUNNER_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+
+# Per-run resource limits, applied with setrlimit in the forked child (0 = unlimited).
+# RLIMIT_NPROC counts every process of the server's user, so size it with headroom.
+LIMITS = {
+    "memory_bytes": int(os.getenv("RUNNER_MAX_MEMORY_MB", "512")) * 1024 * 1024,
+    "cpu_seconds": int(os.getenv("RUNNER_MAX_CPU_SECONDS", str(RUN_TIMEOUT))),
+    "processes": int(os.getenv("RUNNER_MAX_PROCESSES", "64")),
+    "file_bytes": int(os.getenv("RUNNER_MAX_FILE_MB", "10")) * 1024 * 1024,
+}
+
+# Sandboxed runs need fork + resource (POSIX). Elsewhere code runs in a plain
+# subprocess with only the wall-clock timeout and output cap.
+SANDBOXED = hasattr(os, "fork")
+
+# Pre-warmed worker pool (see runner_worker.py). 0 disables it and every run
+# cold-starts a one-shot worker. Workers are replaced after RECYCLE_AFTER runs
+# and after any timeout.
+POOL_SIZE = int(os.getenv("RUNNER_POOL_SIZE", str(MAX_CONCURRENCY))) if SANDBOXED else 0
+RECYCLE_AFTER = int(os.getenv("RUNNER_RECYCLE_AFTER", "50"))
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner_worker.py")
+# Largest message line a worker may send back (one JSON-escaped output chunk)
+_WORKER_LINE_LIMIT = 4 * 1024 * 1024
+# A run waits this long for an idle pooled worker (e.g. while replacements
+# fail to spawn) before it cold-starts its own
+_POOL_WAIT = 2.0
+_RESPAWN_MAX_DELAY = 30.0
+
+# Kernel mode (see kernel_worker.py): one persistent interpreter per editor
+# session, stopped after KERNEL_IDLE_TIMEOUT seconds unused or when
+# MAX_KERNELS are running and another session needs one (least recently used first)
+KERNELS_ENABLED = SANDBOXED and os.getenv("RUNNER_KERNELS", "true").lower() == "true"
+MAX_KERNELS = int(os.getenv("RUNNER_MAX_KERNELS", "8"))
+KERNEL_IDLE_TIMEOUT = float(os.getenv("RUNNER_KERNEL_IDLE_TIMEOUT", "600"))
+KERNEL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernel_worker.py")
+# How long an interrupted kernel gets to report back before it is killed
+_KERNEL_INTERRUPT_GRACE = 1.0
+
+# Everything besides the source that a run's output can depend on (part of the run cache key)
+_CACHE_LIMITS = {**LIMITS, "max_output_bytes": MAX_OUTPUT_BYTES, "timeout": RUN_TIMEOUT}
+
+TIMEOUT_MESSAGE = f"Execution timed out after {RUN_TIMEOUT} seconds. Your code may have an infinite loop."
+TRUNCATED_MESSAGE = f"\n[Output truncated after {MAX_OUTPUT_BYTES} bytes. The program was stopped.]\n"
+
+
+class RunnerBusy(Exception):
+    """Raised when every execution slot is taken and the wait queue is full."""
+
+
+_slots = FairLimiter(MAX_CONCURRENCY, max_waiting=MAX_QUEUE)
+
+
+def queue_depth() -> int:
+    """Number of runs waiting for a free execution slot."""
+    return _slots.waiting
+
+
+def running() -> int:
+    """Number of runs currently executing."""
+    return _slots.in_use
+
+
+@asynccontextmanager
+async def execution_slot():
+    """
+    Acquire one of MAX_CONCURRENCY execution slots.
+    Waiters are served fairly across clients (see FairLimiter); once
+    MAX_QUEUE runs are already waiting, new requests are rejected with
+    RunnerBusy instead of piling up.
+    """
+    if _slots.saturated():
+        raise RunnerBusy()
+    async with _slots.slot():
+        yield
+
+
+def saturated() -> bool:
+    """True when a new run would be rejected with RunnerBusy."""
+    return _slots.saturated()
+
+
+async def has_cached_result(code: str, kernel_id: Optional[str] = None) -> bool:
+    """True when stream()/execute() would answer from the run cache without taking a slot."""
+    if (kernel_id and KERNELS_ENABLED) or not run_cache.RUN_CACHE_ENABLED or not run_cache.is_deterministic(code):
+        return False
+    return await run_cache.results.contains(run_cache.cache_key(code, _CACHE_LIMITS))
+
+
+async def execute(code: str, kernel_id: Optional[str] = None) -> dict:
+    """
+    Runs code in a separate interpreter without blocking the event loop.
+    Returns stdout, stderr, status ("success" | "error" | "timeout" |
+    "truncated", the last when output passed MAX_OUTPUT_BYTES) and
+    usage (cpu_time_ms, peak_rss_kb, output_bytes, file_bytes, wall_time_ms)
+    and cached (True when the result was reused from an earlier identical run).
+    With a kernel_id, the code runs in that session's kernel and the result
+    also has "kernel" ({"id", "fresh", "runs", ...}).
+    """
+    stdout, stderr = [], []
+    final = None
+    async for event in stream(code, kernel_id):
+        if event["event"] == "stdout":
+            stdout.append(event["data"])
+        elif event["event"] == "stderr":
+            stderr.append(event["data"])
+        else:
+            final = event
+
+    extra = {"kernel": final["kernel"]} if "kernel" in final else {}
+    extra["cached"] = final.get("cached", False)
+    if final["status"] == "timeout":
+        return {
+            "stdout": "",
+            "stderr": TIMEOUT_MESSAGE,
+            "status": "timeout",
+            "usage": final["usage"],
+            **extra
+        }
+    return {
+        "stdout": "".join(stdout),
+        "stderr": "".join(stderr),
+        "status": final["status"],
+        "usage": final["usage"],
+        **extra
+    }
+
+
+async def stream(code: str, kernel_id: Optional[str] = None):
+    """
+    Runs code and yields events as they happen:
+    {"event": "stdout" | "stderr", "data": str} for output chunks, then one
+    {"event": "exit", "status", "returncode", "truncated", "duration_ms", "usage"}.
+    Output beyond MAX_OUTPUT_BYTES is dropped and the program is stopped;
+    the exit event then has status "truncated" (unless it also timed out).
+    Raises RunnerBusy before yielding anything if the runner is saturated.
+    A kernel_id runs the code in that session's persistent kernel instead
+    (ids the runner does not know get a new kernel under a new id); the exit
+    event then carries "kernel", including the id to send next time.
+    Outside kernel mode, deterministic code may be answered from the run
+    cache without running; the exit event's "cached" says which happened.
+    """
+    key = None if kernel_id and KERNELS_ENABLED else run_cache.key_for(code, _CACHE_LIMITS)
+    if key is not None:
+        hit = await run_cache.results.get(key)
+        if hit is not None:
+            for name in ("stdout", "stderr"):
+                if hit[name]:
+                    yield {"event": name, "data": hit[name]}
+            yield {**_exit_event(hit["status"], 0 if hit["status"] == "success" else 1, usage=hit["usage"]),
+                   "duration_ms": 0.0, "cached": True}
+            return
+
+    output = {"stdout": [], "stderr": []}
+    async with execution_slot():
+        start = time.perf_counter()
+        if kernel_id and KERNELS_ENABLED:
+            source = _stream_kernel(kernel_id, code)
+        elif _idle_workers is not None:
+            source = _stream_pooled(code)
+        elif SANDBOXED:
+            source = _stream_one_shot(code)
+        else:
+            source = _stream_subprocess(code)
+        try:
+            async for event in source:
+                if event["event"] == "exit":
+                    if event["truncated"]:
+                        yield {"event": "stderr", "data": TRUNCATED_MESSAGE}
+                        if event["status"] != "timeout":
+                            event["status"] = "truncated"
+                    event["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                    event["usage"] = {**(event.get("usage") or {}), "wall_time_ms": event["duration_ms"]}
+                    metrics.runner_duration.observe(event["duration_ms"] / 1000, status=event["status"])
+                    event["cached"] = False
+                    if key is not None and not event["truncated"]:
+                        await run_cache.results.put(key, "".join(output["stdout"]), "".join(output["stderr"]),
+                                                    event["status"], event["usage"], event["returncode"])
+                elif key is not None:
+                    output[event["event"]].append(event["data"])
+                yield event
+        finally:
+            await source.aclose()
+
+
+def _exit_event(status: str, returncode=None, truncated: bool = False, usage: dict = None) -> dict:
+    return {"event": "exit", "status": status, "returncode": returncode, "truncated": truncated, "usage": usage}
+
+
+def _status_for(returncode: int) -> str:
+    return "success" if returncode == 0 else "error"
+
+
+# --- Worker pool ---
+
+class _Worker:
+    def __init__(self, proc, workdir: str):
+        self.proc = proc
+        self.workdir = workdir
+        self.runs = 0
+        self.healthy = False  # set after each job that completed cleanly
+
+
+_idle_workers = None  # asyncio.Queue of _Worker, created by start_pool()
+_all_workers = set()
+_background_tasks = set()
+
+
+async def start_pool():
+    """Spawn POOL_SIZE workers. Called once from the app lifespan."""
+    global _idle_workers
+    if POOL_SIZE <= 0 or _idle_workers is not None:
+        return
+    _idle_workers = asyncio.Queue()
+    workers = await asyncio.gather(*(_spawn_worker() for _ in range(POOL_SIZE)))
+    for worker in workers:
+        _idle_workers.put_nowait(worker)
+    if KERNELS_ENABLED:
+        _spawn_background(_reap_idle_kernels())
+
+
+async def stop_pool():
+    global _idle_workers
+    _idle_workers = None
+    for task in list(_background_tasks):
+        task.cancel()
+    for kernel_id in list(_kernels):
+        await _stop_kernel(kernel_id)
+    for worker in list(_all_workers):
+        await _discard_worker(worker)
+
+
+async def _spawn_worker() -> _Worker:
+    workdir = tempfile.mkdtemp(prefix="drona-worker-")
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, WORKER_SCRIPT, workdir,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        start_new_session=True,  # own process group, so a kill also takes any children
+        limit=_WORKER_LINE_LIMIT,
+    )
+    worker = _Worker(proc, workdir)
+    _all_workers.add(worker)
+    return worker
+
+
+async def _discard_worker(worker: _Worker):
+    _all_workers.discard(worker)
+    try:
+        os.killpg(worker.proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    await worker.proc.wait()
+    shutil.rmtree(worker.workdir, ignore_errors=True)
+
+
+async def _replace_worker(worker: _Worker):
+    """Swap a worker for a fresh one, retrying the spawn with backoff so the pool does not shrink."""
+    idle = _idle_workers
+    await _discard_worker(worker)
+    delay = 0.5
+    while idle is not None and idle is _idle_workers:
+        try:
+            replacement = await _spawn_worker()
+        except Exception:
+            logger.exception("could not respawn a runner worker; retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RESPAWN_MAX_DELAY)
+            continue
+        if idle is _idle_workers:
+            idle.put_nowait(replacement)
+        else:
+            await _discard_worker(replacement)  # the pool was stopped meanwhile
+        return
+
+
+def _spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _recycle(worker: _Worker):
+    _spawn_background(_replace_worker(worker))
+
+
+async def _stream_pooled(code: str):
+    idle = _idle_workers
+    try:
+        worker = await asyncio.wait_for(idle.get(), timeout=_POOL_WAIT)
+    except asyncio.TimeoutError:
+        # Replacements are not coming up: run cold rather than hold the slot indefinitely
+        async for event in _stream_one_shot(code):
+            yield event
+        return
+    try:
+        async for event in _stream_worker(worker, code):
+            yield event
+    finally:
+        if worker.healthy and worker.runs < RECYCLE_AFTER:
+            idle.put_nowait(worker)
+        else:
+            _recycle(worker)
+
+
+async def _stream_one_shot(code: str):
+    """Cold path: a fresh worker interpreter for this run only."""
+    worker = None
+    try:
+        worker = await _spawn_worker()
+        async for event in _stream_worker(worker, code):
+            yield event
+    except Exception as e:
+        yield {"event": "stderr", "data": f"Execution error: {str(e)}"}
+        yield _exit_event("error")
+    finally:
+        if worker is not None:
+            _retire(worker)
+
+
+def _retire(worker: _Worker):
+    _spawn_background(_discard_worker(worker))
+
+
+async def _stream_worker(worker: _Worker, code: str):
+    """Send one job to a worker and relay its events until the final result line."""
+    worker.healthy = False
+    try:
+        job = {"code": code, "max_output": MAX_OUTPUT_BYTES, "limits": LIMITS}
+        worker.proc.stdin.write(json.dumps(job).encode() + b"\n")
+        await worker.proc.stdin.drain()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RUN_TIMEOUT
+        while True:
+            line = await asyncio.wait_for(worker.proc.stdout.readline(), timeout=max(0, deadline - loop.time()))
+            if not line:
+                raise RuntimeError("worker exited unexpectedly")
+            message = json.loads(line)
+            if "stream" in message:
+                yield {"event": message["stream"], "data": message["data"]}
+                continue
+            worker.runs += 1
+            worker.healthy = True
+            yield _exit_event(_status_for(message["returncode"]), message["returncode"], message["truncated"], message["usage"])
+            return
+    except asyncio.TimeoutError:
+        yield {"event": "stderr", "data": TIMEOUT_MESSAGE}
+        yield _exit_event("timeout")
+    except Exception as e:
+        yield {"event": "stderr", "data": f"Execution error: {str(e)}"}
+        yield _exit_event("error")
+
+
+# --- Kernels ---
+
+class _Kernel(_Worker):
+    def __init__(self, proc, workdir: str):
+        super().__init__(proc, workdir)
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()  # one run at a time per kernel
+
+
+_kernels = OrderedDict()  # kernel id -> _Kernel, least recently used first
+kernel_counters = {"started": 0, "evicted": 0, "idle_stopped": 0, "crashed": 0, "restarted": 0}
+
+
+async def _spawn_kernel() -> _Kernel:
+    workdir = tempfile.mkdtemp(prefix="drona-kernel-")
+    limits = {k: v for k, v in LIMITS.items() if k != "cpu_seconds"}  # moved per run by the kernel
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, KERNEL_SCRIPT, workdir, json.dumps(limits),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        limit=_WORKER_LINE_LIMIT,
+    )
+    kernel = _Kernel(proc, workdir)
+    ready = await asyncio.wait_for(proc.stdout.readline(), timeout=RUN_TIMEOUT)
+    if not ready:
+        await _discard_worker(kernel)
+        raise RuntimeError("kernel failed to start")
+    kernel_counters["started"] += 1
+    return kernel
+
+
+async def _stop_kernel(kernel_id: str):
+    kernel = _kernels.pop(kernel_id, None)
+    if kernel is not None:
+        await _discard_worker(kernel)
+
+
+async def restart_kernel(kernel_id: str) -> bool:
+    """Drop a session's kernel; its next run starts a fresh one. False if there was none."""
+    if kernel_id not in _kernels:
+        return False
+    kernel_counters["restarted"] += 1
+    await _stop_kernel(kernel_id)
+    return True
+
+
+async def _acquire_kernel(kernel_id: str) -> tuple:
+    """(kernel id, kernel, fresh). Unknown ids get a new kernel under a new id."""
+    kernel = _kernels.get(kernel_id)
+    if kernel is not None and kernel.proc.returncode is not None:
+        kernel_counters["crashed"] += 1
+        await _stop_kernel(kernel_id)
+        kernel = None
+    if kernel is not None:
+        _kernels.move_to_end(kernel_id)
+        return kernel_id, kernel, False
+
+    while len(_kernels) >= MAX_KERNELS:
+        victim = next((kid for kid, k in _kernels.items() if not k.lock.locked()), None)
+        if victim is None:
+            raise RunnerBusy()
+        kernel_counters["evicted"] += 1
+        await _stop_kernel(victim)
+    # Ids are minted here so one client cannot guess its way into another's namespace
+    kernel_id = secrets.token_urlsafe(16)
+    _kernels[kernel_id] = kernel = await _spawn_kernel()
+    return kernel_id, kernel, True
+
+
+async def _reap_idle_kernels():
+    while True:
+        await asyncio.sleep(min(60.0, KERNEL_IDLE_TIMEOUT / 4))
+        cutoff = time.monotonic() - KERNEL_IDLE_TIMEOUT
+        for kernel_id, kernel in list(_kernels.items()):
+            if kernel.last_used < cutoff and not kernel.lock.locked():
+                kernel_counters["idle_stopped"] += 1
+                await _stop_kernel(kernel_id)
+
+
+async def _stream_kernel(kernel_id: str, code: str):
+    try:
+        kernel_id, kernel, fresh = await _acquire_kernel(kernel_id)
+    except RunnerBusy:
+        raise
+    except Exception as e:
+        yield {"event": "stderr", "data": f"Execution error: {str(e)}"}
+        yield _exit_event("error")
+        return
+
+    async with kernel.lock:
+        kernel.last_used = time.monotonic()
+        try:
+            job_id = secrets.token_hex(8)
+            job = {"id": job_id, "code": code, "max_output": MAX_OUTPUT_BYTES, "cpu_seconds": LIMITS["cpu_seconds"]}
+            before = _kernel_usage(kernel.proc.pid)
+            kernel.proc.stdin.write(json.dumps(job).encode() + b"\n")
+            await kernel.proc.stdin.drain()
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + RUN_TIMEOUT
+            interrupted = False
+            written = 0
+            truncated = False
+            while True:
+                try:
+                    line = await asyncio.wait_for(kernel.proc.stdout.readline(), timeout=max(0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    if interrupted:
+                        raise
+                    # Interrupt the run but keep the namespace, if the kernel answers in time
+                    interrupted = True
+                    kernel.proc.send_signal(signal.SIGINT)
+                    deadline = loop.time() + _KERNEL_INTERRUPT_GRACE
+                    continue
+                if not line:
+                    raise RuntimeError("kernel exited unexpectedly")
+                # User code runs in the kernel process and could write to the
+                # channel, so messages are checked here rather than trusted:
+                # stray job ids are skipped, and output, usage and timeouts
+                # come from this side's own accounting
+                message = json.loads(line)
+                if not isinstance(message, dict) or message.get("job") != job_id:
+                    continue
+                if "stream" in message:
+                    data = message.get("data")
+                    if message["stream"] not in ("stdout", "stderr") or not isinstance(data, str):
+                        raise RuntimeError("kernel sent a malformed message")
+                    if truncated:
+                        continue
+                    encoded = data.encode("utf-8", errors="replace")
+                    if written + len(encoded) > MAX_OUTPUT_BYTES:
+                        encoded, truncated = encoded[:MAX_OUTPUT_BYTES - written], True
+                    written += len(encoded)
+                    if encoded:
+                        yield {"event": message["stream"], "data": encoded.decode("utf-8", errors="ignore")}
+                    continue
+                returncode = message.get("returncode")
+                if type(returncode) is not int:
+                    raise RuntimeError("kernel sent a malformed message")
+                kernel.runs += 1
+                usage = _kernel_usage(kernel.proc.pid, before)
+                usage["output_bytes"] = written
+                event = _exit_event(_status_for(returncode), returncode, truncated or message.get("truncated") is True, usage)
+                if interrupted:
+                    yield {"event": "stderr", "data": TIMEOUT_MESSAGE}
+                    event["status"] = "timeout"
+                reused = (message.get("kernel") or {}).get("reused")
+                event["kernel"] = {"id": kernel_id, "fresh": fresh, "runs": kernel.runs,
+                                   "reused": reused if type(reused) is int else 0}
+                yield event
+                return
+        except asyncio.TimeoutError:
+            kernel_counters["crashed"] += 1
+            await _stop_kernel(kernel_id)
+            yield {"event": "stderr", "data": TIMEOUT_MESSAGE + " The kernel was restarted."}
+            yield {**_exit_event("timeout"), "kernel": {"id": kernel_id, "fresh": fresh, "restarted": True}}
+        except Exception as e:
+            kernel_counters["crashed"] += 1
+            await _stop_kernel(kernel_id)
+            yield {"event": "stderr", "data": f"Execution error: {str(e)}. The kernel was restarted."}
+            yield {**_exit_event("error"), "kernel": {"id": kernel_id, "fresh": fresh, "restarted": True}}
+        finally:
+            kernel.last_used = time.monotonic()
+
+
+def _kernel_usage(pid: int, before: Optional[dict] = None) -> dict:
+    """CPU time and peak RSS of a kernel process from /proc; with `before`, CPU used since then."""
+    usage = {"cpu_time_ms": None, "peak_rss_kb": None}
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage["cpu_time_ms"] = round((int(fields[11]) + int(fields[12])) * 1000 / os.sysconf("SC_CLK_TCK"), 1)
+        with open(f"/proc/{pid}/status") as f:
+            usage["peak_rss_kb"] = next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), None)
+    except (OSError, ValueError, IndexError):
+        return usage
+    if before and before["cpu_time_ms"] is not None:
+        usage["cpu_time_ms"] = round(usage["cpu_time_ms"] - before["cpu_time_ms"], 1)
+    return usage
+
+
+def kernel_stats() -> dict:
+    return {"enabled": KERNELS_ENABLED, "running": len(_kernels), "max": MAX_KERNELS, **kernel_counters}
+
+
+# --- Unsandboxed fallback (no fork) ---
+
+async def _stream_subprocess(code: str):
+    temp_file_path = None
+    proc = None
+    pumps = []
+    try:
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_file:
+            temp_file.write(code)
+            temp_file_path = temp_file.name
+
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, temp_file_path,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        )
+
+        # Bounded so a slow consumer backs up into the pipe instead of memory
+        chunks = asyncio.Queue(maxsize=16)
+
+        async def pump(reader, name):
+            while True:
+                chunk = await reader.read(65536)
+                await chunks.put((name, chunk))
+                if not chunk:
+                    return
+
+        pumps = [
+            asyncio.create_task(pump(proc.stdout, "stdout")),
+            asyncio.create_task(pump(proc.stderr, "stderr")),
+        ]
+        decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in ("stdout", "stderr")}
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RUN_TIMEOUT
+        written = 0
+        truncated = False
+        open_streams = 2
+        while open_streams:
+            name, chunk = await asyncio.wait_for(chunks.get(), timeout=max(0, deadline - loop.time()))
+            if not chunk:
+                open_streams -= 1
+                text = decoders[name].decode(b"", final=True)
+            elif truncated:
+                continue
+            else:
+                if written + len(chunk) > MAX_OUTPUT_BYTES:
+                    chunk = chunk[:MAX_OUTPUT_BYTES - written]
+                    truncated = True
+                    proc.kill()
+                written += len(chunk)
+                text = decoders[name].decode(chunk)
+            if text:
+                yield {"event": name, "data": text.replace("\r\n", "\n")}
+
+        returncode = await asyncio.wait_for(proc.wait(), timeout=max(0, deadline - loop.time()))
+        yield _exit_event(_status_for(returncode), returncode, truncated, {"output_bytes": written})
+
+    except asyncio.TimeoutError:
+        yield {"event": "stderr", "data": TIMEOUT_MESSAGE}
+        yield _exit_event("timeout")
+
+    except Exception as e:
+        yield {"event": "stderr", "data": f"Execution error: {str(e)}"}
+        yield _exit_event("error")
+
+    finally:
+        for task in pumps:
+            task.cancel()
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        if temp_file_path:
+            try:
+                os.unlink(temp_file_path)
+            except OSError:
+                pass
@@ -0,0 +1,179 @@
+import ast
+import io
+import os
+import re
+import tokenize
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Distinct (error, line) pairs remembered by the local classifier
+MEMO_MAX_ENTRIES = int(os.getenv("ERROR_HINT_MEMO_MAX_ENTRIES", "4096"))
+# Most source parsed per request for the compiler's diagnosis (the parse runs on the event loop)
+CONTEXT_MAX_BYTES = int(os.getenv("ERROR_HINT_CONTEXT_MAX_BYTES", "16384"))
+
+BLOCK_KEYWORDS = ("def", "class", "if", "elif", "else", "for", "while", "try", "except", "finally", "with")
+_OPENERS = {"(": ")", "[": "]", "{": "}"}
+
+# (rule name, pattern over the error message, Socratic hint). Checked in
+# order; the first match wins. Hints never contain the fix itself.
+RULES = [
+    ("missing_colon", re.compile(r"expected ':'", re.I),
+     "Look at the end of the line that opens this `{keyword}` block: what does Python expect there before the indented body starts?"),
+    ("print_statement", re.compile(r"missing parentheses in call to 'print'", re.I),
+     "In Python 3 `print` is a function, so how do you pass it the thing you want printed?"),
+    ("unterminated_string", re.compile(r"unterminated (triple-quoted )?string|EOL while scanning|EOF while scanning triple-quoted", re.I),
+     "Where does the string on this line end? Check that every opening quote has a matching closing quote."),
+    ("unclosed_bracket", re.compile(r"was never closed|unexpected EOF while parsing", re.I),
+     "Count the brackets on this line: does every `(`, `[` and `{{` you opened get closed again?"),
+    ("mismatched_bracket", re.compile(r"unmatched '[)\]}]'|does not match opening parenthesis|closing parenthesis .* does not match", re.I),
+     "One of the closing brackets here has no partner, or pairs with the wrong kind of opener. Which bracket closes which?"),
+    ("missing_comma", re.compile(r"perhaps you forgot a comma", re.I),
+     "Look at the items listed on this line: what separates one item from the next in Python?"),
+    ("expected_indent", re.compile(r"expected an indented block", re.I),
+     "A line ending in a colon needs a body. Which lines are meant to belong to it, and how does Python know?"),
+    ("unexpected_indent", re.compile(r"unexpected indent", re.I),
+     "This line is indented further than the code around it. Which block is it supposed to be part of?"),
+    ("inconsistent_indent", re.compile(r"unindent does not match|inconsistent use of tabs|TabError", re.I),
+     "Compare the leading whitespace of this line with the lines above it: are they indented with the same characters and the same width?"),
+    ("assign_vs_compare", re.compile(r"maybe you meant '==' |cannot assign to (comparison|expression|literal)|invalid syntax\. maybe you meant '=='", re.I),
+     "Are you comparing two values here, or storing one in a variable? Python uses a different operator for each."),
+    ("outside_function", re.compile(r"'(return|yield|await)' outside (async )?function", re.I),
+     "Which function is this `{keyword}` supposed to belong to? Check its indentation against the `def` above it."),
+    ("outside_loop", re.compile(r"'(break|continue)' (not properly in|outside) loop", re.I),
+     "Which loop should this `{keyword}` affect? Is it actually inside that loop's body?"),
+]
+
+_memo = OrderedDict()  # (error_message, line_code) -> hint or None
+_counts = {"local": 0, "escalated": 0, "memo_hits": 0}
+
+
+def _first_keyword(line_code: str) -> str:
+    match = re.match(r"\s*(\w+)", line_code or "")
+    return match.group(1) if match else "block"
+
+
+def _line_shape(line_code: str) -> Optional[str]:
+    """Rule name for problems visible from the line alone, via tokenize."""
+    stripped = (line_code or "").strip()
+    if not stripped:
+        return None
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(stripped + "\n").readline))
+    except tokenize.TokenError as e:
+        message = str(e.args[0]) if e.args else ""
+        return "unterminated_string" if "string" in message else "unclosed_bracket"
+    except (SyntaxError, IndentationError):
+        return None
+
+    stack = []
+    for tok in tokens:
+        if tok.type != tokenize.OP:
+            continue
+        if tok.string in _OPENERS:
+            stack.append(tok.string)
+        elif tok.string in _OPENERS.values():
+            if not stack or _OPENERS[stack.pop()] != tok.string:
+                return "mismatched_bracket"
+    if stack:
+        return "unclosed_bracket"
+
+    significant = [t for t in tokens if t.type not in (tokenize.COMMENT, tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER)]
+    if significant and significant[0].string in BLOCK_KEYWORDS and significant[-1].string != ":":
+        # `if x: return y` style one-liners contain a colon before the end
+        if not any(t.string == ":" for t in significant):
+            return "missing_colon"
+    return None
+
+
+def _parse_window(line_code: str, context: str) -> Optional[str]:
+    """
+    The context, or for contexts over CONTEXT_MAX_BYTES the top-level block
+    (from one unindented line to the next) that contains the line.
+    """
+    if len(context) <= CONTEXT_MAX_BYTES:
+        return context
+    lines = context.split("\n")
+    target = next((i for i, line in enumerate(lines) if line.strip() == line_code.strip()), None)
+    if target is None:
+        return None
+
+    def top_level(i: int) -> bool:
+        return bool(lines[i]) and not lines[i][0].isspace()
+
+    start = next((i for i in range(target, -1, -1) if top_level(i)), 0)
+    stop = next((i for i in range(target + 1, len(lines)) if top_level(i)), len(lines))
+    window = "\n".join(lines[start:stop])
+    return window if len(window) <= CONTEXT_MAX_BYTES else None
+
+
+def _compiler_message(line_code: str, context: str) -> Optional[str]:
+    """The interpreter's own SyntaxError message, if it points at this line."""
+    if not context or not line_code.strip():
+        return None
+    source = _parse_window(line_code, context)
+    if source is None:
+        return None
+    try:
+        ast.parse(source)
+    except SyntaxError as e:
+        if (e.text or "").strip() == line_code.strip():
+            return f"{type(e).__name__}: {e.msg}"
+    except (ValueError, RecursionError):
+        pass
+    return None
+
+
+def _hint_for(rule_name: str, line_code: str) -> str:
+    template = next(hint for name, _, hint in RULES if name == rule_name)
+    return template.format(keyword=_first_keyword(line_code))
+
+
+def _classify(error_message: str, line_code: str, context: str) -> Optional[str]:
+    for name, pattern, _ in RULES:
+        if pattern.search(error_message or ""):
+            return name
+    compiled = _compiler_message(line_code, context)
+    if compiled:
+        for name, pattern, _ in RULES:
+            if pattern.search(compiled):
+                return name
+    if "syntax" in (error_message or "").lower():
+        return _line_shape(line_code)
+    return None
+
+
+def local_hint(error_message: str, line_code: str, context: str = "") -> Optional[str]:
+    """
+    Templated Socratic hint for routine syntax errors, or None when the error
+    should go to the LLM. The editor message is matched against RULES first;
+    otherwise the context is parsed to get Python's own diagnosis for the
+    line, and finally the line itself is checked for brackets and colons.
+    Results are memoized per (error_message, line_code) pair, so the context
+    is only consulted the first time a pair is seen.
+    """
+    key = (error_message, line_code)
+    if key in _memo:
+        _memo.move_to_end(key)
+        _counts["memo_hits"] += 1
+        hint = _memo[key]
+    else:
+        rule = _classify(error_message, line_code, context)
+        hint = _hint_for(rule, line_code) if rule else None
+        _memo[key] = hint
+        while len(_memo) > MEMO_MAX_ENTRIES:
+            _memo.popitem(last=False)
+    _counts["local" if hint else "escalated"] += 1
+    return hint
+
+
+def stats() -> dict:
+    total = _counts["local"] + _counts["escalated"]
+    return {
+        **_counts,
+        "local_rate": round(_counts["local"] / total, 3) if total else 0.0,
+        "memo_entries": len(_memo),
+    }
@@ -0,0 +1,236 @@
+"""
+Persistent interpreter ("kernel") for the code runner's kernel mode.
+
+Started by services/code_runner.py, one process per editor session, with a
+private scratch directory as its only argument. Reads one JSON job per line
+on stdin ({"id", "code", "max_output", "cpu_seconds"}) and runs the code in
+an interpreter that persists between jobs. Output is relayed as JSON lines
+({"job", "stream": "stdout" | "stderr", "data": ...}) followed by one final
+{"job", "returncode", "truncated", "usage", "kernel"} line. The pool checks
+these against its own accounting, since user code shares the process.
+
+Jobs are whole files, run cell by cell: the leading top-level imports and
+function definitions that are unchanged since the previous run are not
+executed again, and the names they bound are restored. Every other name is
+dropped before the run, and everything from the first changed or
+side-effecting statement onwards executes, so prints and mutations behave
+as in a fresh run. Modules stay in sys.modules, so later imports are free.
+
+Resource limits are set once for the whole process; the CPU limit is moved
+forward before each job. A SIGINT interrupts the running job (the pool sends
+it on timeout) without losing the namespace. Crashes and hard kills are
+handled by the pool, which starts a fresh kernel on the next run.
+"""
+import ast
+import io
+import json
+import os
+import resource
+import signal
+import sys
+import tempfile
+import traceback
+
+_RLIMITS = {
+    "memory_bytes": resource.RLIMIT_AS,
+    "processes": resource.RLIMIT_NPROC,
+    "file_bytes": resource.RLIMIT_FSIZE,
+}
+
+
+class _OutputLimit(BaseException):
+    """Raised from print() once a job has produced max_output bytes."""
+
+
+class _Emitter(io.TextIOBase):
+    """sys.stdout / sys.stderr replacement that relays lines as JSON messages."""
+
+    def __init__(self, name: str, job):
+        self.name = name
+        self.job = job
+        self._buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text: str) -> int:
+        self._buffer += text
+        if "\n" in text or len(self._buffer) > 8192:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            text, self._buffer = self._buffer, ""
+            self.job.output(self.name, text)
+
+
+class _Job:
+    def __init__(self, emit, job_id, max_output: int):
+        self.emit = emit
+        self.job_id = job_id
+        self.max_output = max_output
+        self.written = 0
+        self.truncated = False
+
+    def output(self, name: str, text: str):
+        if self.truncated:
+            raise _OutputLimit()
+        data = text.encode("utf-8", errors="replace")
+        if self.written + len(data) > self.max_output:
+            data = data[:self.max_output - self.written]
+            self.truncated = True
+        self.written += len(data)
+        if data:
+            self.emit({"job": self.job_id, "stream": name, "data": data.decode("utf-8", errors="ignore")})
+        if self.truncated:
+            raise _OutputLimit()
+
+
+def _reusable(stmt: ast.stmt) -> bool:
+    """Statements whose only effect is binding names: safe to skip when unchanged."""
+    if isinstance(stmt, ast.Import):
+        return True
+    if isinstance(stmt, ast.ImportFrom):
+        return stmt.module != "__future__" and all(alias.name != "*" for alias in stmt.names)
+    if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        args = stmt.args
+        defaults = args.defaults + [d for d in args.kw_defaults if d is not None]
+        return not stmt.decorator_list and all(isinstance(d, ast.Constant) for d in defaults)
+    return isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant)  # docstring
+
+
+def _bound_names(stmt: ast.stmt) -> list:
+    if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+        return [alias.asname or alias.name.split(".")[0] for alias in stmt.names]
+    if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return [stmt.name]
+    return ["__doc__"]
+
+
+class Kernel:
+    def __init__(self, workdir: str, emit):
+        self.workdir = workdir
+        self.emit = emit
+        self.code_path = os.path.join(workdir, "main.py")
+        self.namespace = {}
+        self.cells = []  # (ast.dump with positions, {name: value}) for the reusable prefix of the last run
+        self.runs = 0
+
+    def _reset_namespace(self, keep: list):
+        # Cleared in place: functions kept from earlier runs hold this dict as their globals
+        self.namespace.clear()
+        self.namespace.update({"__name__": "__main__", "__file__": self.code_path, "__builtins__": __builtins__})
+        for _, bindings in keep:
+            self.namespace.update(bindings)
+
+    def _execute(self, code: str) -> int:
+        """Run the file, reusing the unchanged prefix of the previous run. Returns the statements reused."""
+        tree = ast.parse(code, self.code_path)
+        dumps = [ast.dump(stmt, include_attributes=True) for stmt in tree.body]
+        # Future imports only apply within one compiled unit, so such files always run whole
+        cellwise = not any(isinstance(stmt, ast.ImportFrom) and stmt.module == "__future__" for stmt in tree.body)
+        reused = 0
+        while cellwise and reused < min(len(self.cells), len(tree.body)) and self.cells[reused][0] == dumps[reused]:
+            reused += 1
+        del self.cells[reused:]
+        self._reset_namespace(self.cells)
+
+        position = reused
+        while cellwise and position < len(tree.body) and _reusable(tree.body[position]):
+            stmt = tree.body[position]
+            exec(compile(ast.Module(body=[stmt], type_ignores=[]), self.code_path, "exec"), self.namespace)
+            self.cells.append((dumps[position], {name: self.namespace[name] for name in _bound_names(stmt)}))
+            position += 1
+        exec(compile(ast.Module(body=tree.body[position:], type_ignores=[]), self.code_path, "exec"), self.namespace)
+        return reused
+
+    def _print_user_traceback(self):
+        etype, value, tb = sys.exc_info()
+        while tb is not None and tb.tb_frame.f_code.co_filename != self.code_path:
+            tb = tb.tb_next
+        traceback.print_exception(etype, value, tb)
+
+    def run(self, job_id, code: str, max_output: int, cpu_seconds: int) -> dict:
+        with open(self.code_path, "w") as f:
+            f.write(code)
+        job = _Job(self.emit, job_id, max_output)
+        stdout, stderr = _Emitter("stdout", job), _Emitter("stderr", job)
+        sys.stdout, sys.stderr = stdout, stderr
+
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        if cpu_seconds > 0:
+            used = before.ru_utime + before.ru_stime
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (int(used) + cpu_seconds + 1, hard))
+
+        returncode, reused = 0, 0
+        self.runs += 1
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            reused = self._execute(code)
+        except SystemExit as e:
+            if e.code is not None and not isinstance(e.code, int):
+                print(e.code, file=sys.stderr)
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except (KeyboardInterrupt, _OutputLimit):
+            returncode = 1
+        except BaseException:
+            returncode = 1
+            self._print_user_traceback()
+        finally:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            for stream in (stdout, stderr):
+                try:
+                    stream.flush()
+                except _OutputLimit:
+                    pass
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            "job": job.job_id,
+            "returncode": returncode,
+            "truncated": job.truncated,
+            "usage": {
+                "cpu_time_ms": round((after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime) * 1000, 1),
+                "peak_rss_kb": after.ru_maxrss,
+                "output_bytes": job.written,
+            },
+            "kernel": {"runs": self.runs, "reused": reused},
+        }
+
+
+def serve(workdir: str, limits: dict):
+    # The job channel moves off fds 0/1 to non-inheritable copies, so input(),
+    # os.write(1, ...) and subprocesses cannot read or corrupt it
+    channel_in = os.fdopen(os.dup(0), "rb")
+    channel_out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    sys.stdin = open(os.devnull)
+
+    def emit(message: dict):
+        channel_out.write(json.dumps(message).encode() + b"\n")
+        channel_out.flush()
+
+    run_dir = tempfile.mkdtemp(dir=workdir)
+    os.chdir(run_dir)
+    os.environ["TMPDIR"] = run_dir
+    tempfile.tempdir = run_dir
+    sys.path[0] = run_dir
+    for name, value in limits.items():
+        if name in _RLIMITS and value and value > 0:
+            resource.setrlimit(_RLIMITS[name], (value, value))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    kernel = Kernel(run_dir, emit)
+    emit({"ready": True})
+    for line in channel_in:
+        job = json.loads(line)
+        emit(kernel.run(job["id"], job["code"], job["max_output"], job.get("cpu_seconds", 0)))
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], json.loads(sys.argv[2]) if len(sys.argv) > 2 else {})
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Connection pool of the HTTP client under the Anthropic SDK. Keep-alive is
+# longer than httpx's 5 s default so connections warmed at startup (and
+# between bursts of requests) are still open when the next call comes.
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+# Connections opened (TCP + TLS) at startup so the first user does not pay
+# for them; 0 disables the warm-up
+PREWARM_CONNECTIONS = int(os.getenv("LLM_PREWARM_CONNECTIONS", "2"))
+PREWARM_TIMEOUT = float(os.getenv("LLM_PREWARM_TIMEOUT", "10"))
+
+warmup = {"import_ms": None, "connect_ms": None, "connections": 0, "error": None}
+
+
+class LazyClient:
+    """
+    Stands in for anthropic.AsyncAnthropic. The SDK (the slowest import in
+    the app, over a second) is imported and the client built on first use,
+    so startup does not wait for it and demo mode never loads it.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._client = None
+        self.http = None  # the httpx.AsyncClient whose pool the SDK uses
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    import anthropic
+                    import httpx
+
+                    limits = httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    )
+                    self.http = anthropic.DefaultAsyncHttpxClient(limits=limits)
+                    self._client = anthropic.AsyncAnthropic(http_client=self.http, **self._kwargs)
+                    warmup["import_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+async def prewarm(client, connections: int = PREWARM_CONNECTIONS):
+    """
+    Import the SDK off the event loop, then open `connections` pooled
+    connections to the API host with concurrent HEAD requests. The answers
+    (404/405) do not matter; the kept-alive TLS connections do.
+    """
+    if not isinstance(client, LazyClient) or connections <= 0:
+        return
+    try:
+        real = await asyncio.to_thread(client.get)
+        started = time.perf_counter()
+        url = str(real.base_url)
+        http = client.http
+        results = await asyncio.wait_for(
+            asyncio.gather(*(http.head(url) for _ in range(connections)), return_exceptions=True),
+            PREWARM_TIMEOUT,
+        )
+        warmup["connections"] = sum(1 for r in results if not isinstance(r, BaseException))
+        warmup["connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        if failures:
+            warmup["error"] = repr(failures[0])
+    except Exception as e:
+        warmup["error"] = repr(e)
+        logger.warning("LLM connection warm-up failed: %r", e)
@@ -0,0 +1,415 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from services import metrics
+from services.admission import FairLimiter
+from services.model_router import ModelRouter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Adaptive timeouts: p95 latency of the call type times the multiplier,
+# clamped to [min, max]. Until MIN_SAMPLES calls have been seen, max is used.
+TIMEOUT_MIN = float(os.getenv("LLM_TIMEOUT_MIN", "2"))
+TIMEOUT_MAX = float(os.getenv("LLM_TIMEOUT_MAX", "10"))
+TIMEOUT_MULTIPLIER = float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "2"))
+MIN_SAMPLES = int(os.getenv("LLM_TIMEOUT_MIN_SAMPLES", "20"))
+# Budget for one call across all its attempts and backoffs (to the first chunk,
+# for streams); below the frontend's 10 s validate_answer timeout
+CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "8"))
+# Longest gap allowed between chunks once a stream has started
+STREAM_STALL_TIMEOUT = float(os.getenv("LLM_STREAM_STALL_TIMEOUT", "10"))
+
+# Retries for transient failures, with full jitter
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+
+# Hedging (non-streaming calls only): if the first attempt is slower than the
+# call type's p-th percentile, send a second copy and take whichever lands first
+HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+
+# Circuit breaker over the last BREAKER_WINDOW calls
+BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Concurrent Anthropic calls per worker process; waiting calls are queued
+# fairly across clients
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Background calls (speculative Q2, chat digests) yield to interactive ones
+BACKGROUND_CALLS = {"followup_question", "chat_digest"}
+BACKGROUND_WEIGHT = 0.25
+
+_LATENCY_WINDOW = 200
+
+
+class CircuitOpen(Exception):
+    """The provider is considered down; callers should use the mock fallback."""
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """Errors that say the provider is unhealthy, as opposed to a bad request of ours."""
+    import anthropic  # lazy: already loaded by the time a call has failed
+
+    if isinstance(error, (asyncio.TimeoutError, anthropic.APIConnectionError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return False
+
+
+def is_auth_error(error: BaseException) -> bool:
+    """Rejected credentials: our configuration is wrong, not the provider's health."""
+    import anthropic
+
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in (401, 403)
+
+
+def is_retryable(error: BaseException) -> bool:
+    import anthropic
+
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return isinstance(error, (asyncio.TimeoutError, anthropic.APIConnectionError))
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    closed -> open when the error rate over the window reaches the threshold;
+    open -> half-open after the cooldown, letting one probe call through;
+    the probe's outcome closes the breaker or opens it again. The probe is
+    identified by the token acquire() returned, so calls admitted before
+    the breaker opened cannot settle or free it.
+    """
+
+    def __init__(self):
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trips = 0
+        self._outcomes = deque(maxlen=BREAKER_WINDOW)
+        self._probe = None  # token of the half-open probe in flight
+        self._tokens = itertools.count(1)
+
+    def available(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+            self.state = "half_open"
+        return self.state == "closed" or (self.state == "half_open" and self._probe is None)
+
+    def acquire(self) -> Optional[int]:
+        """Admit a call or raise CircuitOpen. Returns a probe token if the call is the half-open probe, else None."""
+        if not self.available():
+            raise CircuitOpen("LLM provider circuit is open")
+        if self.state == "half_open":
+            self._probe = next(self._tokens)
+            return self._probe
+        return None
+
+    def record(self, ok: bool, probe: Optional[int] = None):
+        if self.state == "half_open":
+            if probe is None or probe != self._probe:
+                return  # only the probe's outcome decides
+            self._probe = None
+            if ok:
+                self.state = "closed"
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= BREAKER_MIN_CALLS and failures / len(self._outcomes) >= BREAKER_ERROR_RATE:
+            self._open()
+
+    def release(self, probe: Optional[int]):
+        """The call ended without saying anything about provider health. Frees the probe if it was it."""
+        if probe is not None and probe == self._probe:
+            self._probe = None
+
+    def _open(self):
+        self.state = "open"
+        self._probe = None
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._outcomes.clear()
+
+    def error_rate(self) -> float:
+        return round(self._outcomes.count(False) / len(self._outcomes), 3) if self._outcomes else 0.0
+
+
+class LLMPolicy:
+    """
+    Timeouts, retries, hedging and circuit breaking around an Anthropic client.
+    `create` and `stream` take the call type (for per-endpoint latency
+    tracking) followed by the usual messages.create / messages.stream kwargs.
+    Without a `model` kwarg, the router picks one for the call type.
+    """
+
+    def __init__(self, client, router: Optional[ModelRouter] = None):
+        self.client = client
+        self.router = router or ModelRouter()
+        self.breaker = CircuitBreaker()
+        self.slots = FairLimiter(LLM_MAX_CONCURRENCY)
+        self._latency = {}  # call type -> deque of seconds (full call, or time to first chunk)
+        self.counters = {"calls": 0, "failures": 0, "timeouts": 0, "retries": 0, "hedges": 0, "rejected": 0,
+                         "auth_errors": 0}
+
+    def available(self) -> bool:
+        return self.client is not None and self.breaker.available()
+
+    def timeout(self, call: str) -> float:
+        samples = self._latency.get(call)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return TIMEOUT_MAX
+        return min(TIMEOUT_MAX, max(TIMEOUT_MIN, _percentile(samples, 95) * TIMEOUT_MULTIPLIER))
+
+    def _observe(self, call: str, seconds: float, model: Optional[str] = None):
+        self._latency.setdefault(call, deque(maxlen=_LATENCY_WINDOW)).append(seconds)
+        if model:
+            self.router.observe(call, model, seconds)
+
+    def _routed(self, call: str, kwargs: dict) -> dict:
+        if "model" in kwargs:
+            return kwargs
+        return {**kwargs, "model": self.router.choose(call, kwargs)}
+
+    def _acquire(self) -> Optional[int]:
+        try:
+            probe = self.breaker.acquire()
+        except CircuitOpen:
+            self.counters["rejected"] += 1
+            raise
+        self.counters["calls"] += 1
+        return probe
+
+    def _attempt_timeout(self, call: str, deadline: float) -> float:
+        return max(0.001, min(self.timeout(call), deadline - time.monotonic()))
+
+    def _retry_or_raise(self, error: Exception, attempt: int, deadline: float) -> float:
+        """
+        Raise unless the failed attempt may be retried within the deadline;
+        CircuitOpen if the breaker is what stops it. Returns the backoff to sleep.
+        """
+        delay = backoff(attempt + 1)
+        if attempt >= MAX_RETRIES or not is_retryable(error) or time.monotonic() + delay + TIMEOUT_MIN > deadline:
+            raise error
+        if not self.breaker.available():
+            self.counters["rejected"] += 1
+            raise CircuitOpen("LLM provider circuit is open") from error
+        return delay
+
+    def _readmit(self, error: Exception) -> Optional[int]:
+        """Admit a retry after its backoff: the breaker may have opened, or gone half-open, meanwhile."""
+        try:
+            return self.breaker.acquire()
+        except CircuitOpen as e:
+            self.counters["rejected"] += 1
+            raise e from error
+
+    def _failed(self, error: BaseException, probe: Optional[int] = None):
+        self.counters["failures"] += 1
+        if isinstance(error, asyncio.TimeoutError):
+            self.counters["timeouts"] += 1
+        if is_auth_error(error):
+            self.counters["auth_errors"] += 1
+            logger.error("Anthropic API rejected the credentials (HTTP %s); check ANTHROPIC_API_KEY", error.status_code)
+        if is_provider_failure(error):
+            self.breaker.record(False, probe)
+        else:
+            self.breaker.release(probe)
+
+    def slot(self, call: str):
+        """One of LLM_MAX_CONCURRENCY upstream slots, queued fairly by client."""
+        return self.slots.slot(weight=BACKGROUND_WEIGHT if call in BACKGROUND_CALLS else 1.0)
+
+    async def create(self, call: str, **kwargs):
+        kwargs = self._routed(call, kwargs)
+        metrics.mark("prompt_build")
+        async with self.slot(call):
+            metrics.mark("llm_queue")
+            return await self._create(call, kwargs, self._acquire())
+
+    async def _create(self, call: str, kwargs: dict, probe: Optional[int]):
+        attempt = 0
+        deadline = time.monotonic() + CALL_DEADLINE
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(self._hedged(call, kwargs), timeout=self._attempt_timeout(call, deadline))
+                except Exception as e:
+                    self._failed(e, probe)
+                    delay = self._retry_or_raise(e, attempt, deadline)
+                    attempt += 1
+                    self.counters["retries"] += 1
+                    await asyncio.sleep(delay)
+                    probe = self._readmit(e)
+                    continue
+                self._observe(call, time.monotonic() - started, kwargs["model"])
+                self.breaker.record(True, probe)
+                metrics.mark("upstream_wait")
+                return response
+        finally:
+            # Cancelled probes must not keep the breaker half-open forever
+            self.breaker.release(probe)
+
+    async def _hedged(self, call: str, kwargs: dict):
+        samples = self._latency.get(call)
+        if not HEDGE or not samples or len(samples) < MIN_SAMPLES:
+            return await self.client.messages.create(**kwargs)
+
+        tasks = {asyncio.create_task(self.client.messages.create(**kwargs))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=_percentile(samples, HEDGE_PERCENTILE))
+            if not done:
+                self.counters["hedges"] += 1
+                tasks.add(asyncio.create_task(self.client.messages.create(**kwargs)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stream(self, call: str, **kwargs) -> "GuardedStream":
+        return GuardedStream(self, call, self._routed(call, kwargs))
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "error_rate": self.breaker.error_rate(),
+            "trips": self.breaker.trips,
+            **self.counters,
+            "timeouts_s": {call: round(self.timeout(call), 2) for call in self._latency},
+            "slots": self.slots.stats(),
+            "routes": self.router.stats(),
+        }
+
+
+class GuardedStream:
+    """
+    Drop-in for `async with client.messages.stream(...) as stream`.
+    The first chunk must arrive within the adaptive timeout and later chunks
+    within STREAM_STALL_TIMEOUT. Failures before the first chunk are retried
+    while CALL_DEADLINE allows;
+    once text has been yielded the error is raised to the caller.
+    """
+
+    def __init__(self, policy: LLMPolicy, call: str, kwargs: dict):
+        self.policy = policy
+        self.call = call
+        self.kwargs = kwargs
+        self._manager = None
+        self._stream = None
+        self._probe = None
+        self._slot = None
+        self._streaming_time = 0.0
+
+    async def __aenter__(self):
+        metrics.mark("prompt_build")
+        self._slot = self.policy.slot(self.call)
+        await self._slot.__aenter__()
+        metrics.mark("llm_queue")
+        try:
+            self._probe = self.policy._acquire()
+        except BaseException:
+            await self._slot.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            self.policy.breaker.release(self._probe)
+            await self._close(*exc_info)
+        finally:
+            await self._slot.__aexit__(None, None, None)
+        return False
+
+    async def _close(self, *exc_info):
+        manager, self._manager = self._manager, None
+        if manager is not None:
+            await manager.__aexit__(*(exc_info or (None, None, None)))
+
+    async def _open(self):
+        self._manager = self.policy.client.messages.stream(**self.kwargs)
+        self._stream = await self._manager.__aenter__()
+        return self._stream.text_stream.__aiter__()
+
+    @property
+    def text_stream(self):
+        return self._text_stream()
+
+    async def _text_stream(self):
+        policy = self.policy
+        attempt = 0
+        deadline = time.monotonic() + CALL_DEADLINE
+        while True:
+            started = time.monotonic()
+            try:
+                timeout = policy._attempt_timeout(self.call, deadline)
+                chunks = await asyncio.wait_for(self._open(), timeout=timeout)
+                remaining = timeout - (time.monotonic() - started)
+                first = await asyncio.wait_for(chunks.__anext__(), timeout=max(remaining, 0.001))
+                break
+            except StopAsyncIteration:
+                policy._observe(self.call, time.monotonic() - started, self.kwargs["model"])
+                policy.breaker.record(True, self._probe)
+                return
+            except Exception as e:
+                await self._close()
+                policy._failed(e, self._probe)
+                delay = policy._retry_or_raise(e, attempt, deadline)
+                attempt += 1
+                policy.counters["retries"] += 1
+                await asyncio.sleep(delay)
+                self._probe = policy._readmit(e)
+
+        first_at = time.monotonic()
+        policy._observe(self.call, first_at - started, self.kwargs["model"])
+        metrics.llm_ttft.observe(first_at - started, call=self.call)
+        metrics.mark("upstream_wait")
+        yield first
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=STREAM_STALL_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except Exception as e:
+            policy._failed(e, self._probe)
+            raise
+        policy.breaker.record(True, self._probe)
+        self._streaming_time = time.monotonic() - first_at
+        metrics.mark("stream")
+
+    async def get_final_message(self):
+        message = await self._stream.get_final_message()
+        usage = getattr(message, "usage", None)
+        if usage is not None and self._streaming_time:
+            metrics.llm_tokens_per_second.observe(usage.output_tokens / self._streaming_time, call=self.call)
+        return message
@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Per-request trace spans (parse -> prompt_build -> llm_queue -> upstream_wait -> stream -> sse_flush)
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "false").lower() == "true"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))  # seconds between loop-lag probes
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        _registry.append(self)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        return self.header() + [f"{self.name}{_label_str(k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_label_str(key)} {series[-1]}")
+        return lines
+
+
+class Collected(_Metric):
+    """Values read from another module's stats at scrape time."""
+
+    def __init__(self, name: str, help_text: str, kind: str, collect: Callable):
+        super().__init__(name, help_text)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> list:
+        try:
+            value = self.collect()
+        except Exception:
+            logger.exception("metrics collector %s failed", self.name)
+            return []
+        samples = value if isinstance(value, list) else [({}, value)]
+        return self.header() + [
+            f"{self.name}{_label_str(tuple(sorted(labels.items())))} {v}" for labels, v in samples
+        ]
+
+
+def collect(name: str, help_text: str, fn: Callable, kind: str = "gauge") -> Collected:
+    """Register a metric whose value (or list of (labels, value)) comes from `fn` at scrape time."""
+    return Collected(name, help_text, kind, fn)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics recorded by the app ---
+
+http_requests = Counter("http_requests_total", "HTTP requests by route, method and status.")
+http_duration = Histogram("http_request_duration_seconds", "Time until the response body (including SSE streams) is complete.")
+llm_ttft = Histogram("llm_time_to_first_token_seconds", "Time from opening a Claude stream to its first text chunk.")
+llm_tokens_per_second = Histogram(
+    "llm_stream_tokens_per_second", "Output tokens per second after the first chunk of a Claude stream.",
+    buckets=(5, 10, 20, 40, 60, 80, 120, 160, 250),
+)
+llm_tokens = Counter("llm_tokens_total", "Anthropic token usage by call type and kind (input, output, cache_read, cache_write).")
+llm_route = Counter("llm_route_total", "Model chosen per Claude call type, by reason (route, input_size, latency_fallback).")
+llm_model_latency = Histogram("llm_model_latency_seconds", "Claude latency by call type and model (time to first chunk for streams).")
+runner_duration = Histogram("runner_execution_seconds", "Wall time of code runs by final status.")
+loop_lag = Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a sleeping probe task.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+admission_rejected = Counter("admission_rejected_total", "Requests refused with 429 by route and reason (rate, in_flight).")
+trace_spans = Histogram("request_span_seconds", "Per-request trace span durations (only with TRACE_REQUESTS=true).")
+
+
+# --- Trace spans ---
+
+class _Trace:
+    def __init__(self, route: str):
+        self.route = route
+        self.last = time.perf_counter()
+        self.spans = []
+
+    def mark(self, span: str):
+        now = time.perf_counter()
+        self.spans.append((span, now - self.last))
+        self.last = now
+
+
+_current_trace: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def mark(span: str):
+    """
+    Close the current trace span: the time since the previous mark (or the
+    start of the request) is attributed to `span`. No-op unless TRACE_REQUESTS.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.mark(span)
+
+
+def _finish_trace(trace: _Trace, total: float):
+    if len(trace.spans) < 2:
+        return  # route without marks; the request duration histogram covers it
+    for span, seconds in trace.spans:
+        trace_spans.observe(seconds, route=trace.route, span=span)
+    breakdown = " ".join(f"{span}={seconds * 1000:.1f}ms" for span, seconds in trace.spans)
+    logger.info("trace %s total=%.1fms %s", trace.route, total * 1000, breakdown)
+
+
+# --- HTTP middleware ---
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them until the last body
+    chunk is sent, so SSE endpoints are timed to the end of the stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        trace = _Trace(scope.get("path", "")) if TRACE_REQUESTS else None
+        token = _current_trace.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False) and trace is not None:
+                trace.mark("sse_flush")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            http_requests.inc(route=path, method=scope["method"], status=status["code"])
+            http_duration.observe(elapsed, route=path, method=scope["method"])
+            if trace is not None:
+                trace.route = path
+                _finish_trace(trace, elapsed)
+
+
+# --- Event-loop lag ---
+
+_lag_task = None
+
+
+async def _watch_loop_lag():
+    while True:
+        before = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag.observe(max(0.0, time.perf_counter() - before - LOOP_LAG_INTERVAL))
+
+
+def start_loop_monitor():
+    global _lag_task
+    if _lag_task is None:
+        _lag_task = asyncio.create_task(_watch_loop_lag())
+
+
+async def stop_loop_monitor():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
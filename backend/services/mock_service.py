@@ -1,24 +1,56 @@
 
 import asyncio
+import math
+import os
+import random
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Latency model for demo mode and load tests. Each entry is (median seconds, sigma)
+# of a lognormal draw; sigma 0 means a fixed delay.
+#   fixed     - the original constant delays
+#   realistic - spread roughly like hosted LLM calls (slow first token, long tail)
+#   instant   - no delays, for measuring server overhead alone
+LATENCY_PROFILES = {
+    "fixed": {"first_token": (0.0, 0), "token": (0.05, 0), "think": (1.0, 0)},
+    "realistic": {"first_token": (0.6, 0.5), "token": (0.03, 0.4), "think": (1.5, 0.5)},
+    "instant": {"first_token": (0.0, 0), "token": (0.0, 0), "think": (0.0, 0)},
+}
+MOCK_LATENCY_PROFILE = os.getenv("MOCK_LATENCY_PROFILE", "fixed")
+_profile = LATENCY_PROFILES.get(MOCK_LATENCY_PROFILE, LATENCY_PROFILES["fixed"])
+_rng = random.Random(os.getenv("MOCK_LATENCY_SEED"))
 
 MOCK_Q1 = "Hold up. You just pasted a database connection block but didn't include a teardown method. What happens to the connection pool if this fails?"
 MOCK_Q2 = "Okay, assuming you add a teardown, explain the time complexity of the nested loop on line 14 of that snippet."
 
+def _delay(kind: str) -> float:
+    median, sigma = _profile[kind]
+    if median <= 0:
+        return 0.0
+    return _rng.lognormvariate(math.log(median), sigma) if sigma else median
+
+async def _stream_words(text: str):
+    """Yield text word by word, paced like a streaming model response."""
+    await asyncio.sleep(_delay("first_token"))
+    for word in text.split(" "):
+        yield word + " "
+        await asyncio.sleep(_delay("token"))
+
 async def mock_stream_question(code_snippet: str, context_summary: str):
     """Stream MOCK_Q1 word by word with delay."""
-    words = MOCK_Q1.split(" ")
-    for word in words:
-        yield word + " "
-        await asyncio.sleep(0.05) # simulate typing
+    async for chunk in _stream_words(MOCK_Q1):
+        yield chunk
 
 async def mock_second_question(code_snippet: str, question_1: str, answer_1: str):
     """Return MOCK_Q2 as plain string."""
-    await asyncio.sleep(1) # simulate thinking
+    await asyncio.sleep(_delay("think")) # simulate thinking
     return MOCK_Q2
 
 async def mock_evaluate_combined(code_snippet: str, q1: str, a1: str, q2: str, a2: str):
     """Always pass."""
-    await asyncio.sleep(1) # simulate thinking
+    await asyncio.sleep(_delay("think")) # simulate thinking
     return {
         "status": "pass", 
         "feedback": "Good understanding demonstrated. Your editor is now unlocked."
@@ -27,14 +59,12 @@ async def mock_evaluate_combined(code_snippet: str, q1: str, a1: str, q2: str, a
 async def mock_stream_error_hint(error_message: str, line_code: str, context_summary: str):
     """Stream a mock hint."""
     hint = "[Demo Mode] I notice a possible syntax error here. In Python, ensure all blocks starting with 'def' or 'if' end with a colon. Have you checked line endings?"
-    for word in hint.split(" "):
-        yield word + " "
-        await asyncio.sleep(0.05)
+    async for chunk in _stream_words(hint):
+        yield chunk
 
 async def mock_stream_mentor_chat(selected_code: str, user_query: str, context_summary: str, full_file: str = ""):
     """Stream a mock chat response."""
     response = "[Demo Mode] That's an interesting question. In this architecture, this specific block handles the request lifecycle. It ensures that all incoming requests are properly authenticated before being passed to the business logic layer. Notice how the middleware intercepts the call first?"
-    for word in response.split(" "):
-        yield word + " "
-        await asyncio.sleep(0.05)
+    async for chunk in _stream_words(response):
+        yield chunk
 
@@ -0,0 +1,142 @@
+import os
+import time
+from collections import defaultdict, deque
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+
+from services import metrics
+from services.token_budget import estimate_tokens
+
+load_dotenv()
+
+
+def _pairs(spec: str, cast=str) -> dict:
+    """Parse "call=value,call=value" env settings."""
+    result = {}
+    for item in spec.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            result[key.strip()] = cast(value.strip())
+    return result
+
+
+# Model per tier, fastest first
+MODEL_TIERS = {
+    "fast": os.getenv("LLM_MODEL_FAST", "claude-3-5-haiku-20241022"),
+    "large": os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022"),
+}
+TIER_ORDER = list(MODEL_TIERS)
+
+# Tier per call type. One-sentence hints, PASS/FAIL verdicts and chat digests
+# do not need the large model; the questions and the mentor chat do.
+# Override with e.g. LLM_ROUTES="evaluate=large,mentor_chat=fast".
+DEFAULT_ROUTES = {
+    "first_question": "large",
+    "second_question": "large",
+    "followup_question": "large",
+    "mentor_chat": "large",
+    "evaluate": "fast",
+    "error_hint": "fast",
+    "chat_digest": "fast",
+}
+ROUTES = {**DEFAULT_ROUTES, **_pairs(os.getenv("LLM_ROUTES", ""))}
+for _call, _tier in ROUTES.items():
+    if _tier not in MODEL_TIERS:
+        raise ValueError(f"LLM_ROUTES: unknown tier {_tier!r} for {_call} (expected one of {', '.join(TIER_ORDER)})")
+
+# Calls routed below the largest tier move up one tier when their prompt is bigger than this
+ROUTE_UPGRADE_TOKENS = int(os.getenv("LLM_ROUTE_UPGRADE_TOKENS", "6000"))
+
+# p95 latency budgets in seconds (time to first chunk for streams, whole call
+# otherwise). When a call's model is over budget it falls back one tier faster
+# until its recent samples age out of the window.
+DEFAULT_BUDGETS = {"first_question": 4.0, "second_question": 6.0, "mentor_chat": 4.0}
+LATENCY_BUDGETS = {**DEFAULT_BUDGETS, **_pairs(os.getenv("LLM_LATENCY_BUDGETS", ""), float)}
+ROUTE_MIN_SAMPLES = int(os.getenv("LLM_ROUTE_MIN_SAMPLES", "10"))
+ROUTE_WINDOW = float(os.getenv("LLM_ROUTE_WINDOW", "300"))  # seconds of latency samples considered
+
+_MAX_SAMPLES = 200
+
+
+def _p95(values) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+def input_tokens(kwargs: dict) -> int:
+    """Rough prompt size of a messages.create / messages.stream call."""
+
+    def text_of(content) -> str:
+        if isinstance(content, str):
+            return content
+        return "".join(block.get("text", "") for block in content or [] if isinstance(block, dict))
+
+    return estimate_tokens(text_of(kwargs.get("system"))) + sum(
+        estimate_tokens(text_of(message.get("content"))) for message in kwargs.get("messages", [])
+    )
+
+
+class ModelRouter:
+    """
+    Picks the model for each call: the call type's tier from ROUTES, one tier
+    up for oversized prompts, one tier faster while the chosen model's recent
+    p95 is over the call's latency budget. Choices and per-model latency are
+    recorded for tuning (stats(), llm_route_total, llm_model_latency_seconds).
+    """
+
+    def __init__(self):
+        self._latency: Dict[Tuple[str, str], deque] = {}  # (call, model) -> deque of (monotonic time, seconds)
+        self.choices = defaultdict(int)  # (call, model, reason) -> count
+
+    def primary_model(self, call: str) -> str:
+        return MODEL_TIERS[ROUTES.get(call, TIER_ORDER[-1])]
+
+    def p95(self, call: str, model: str):
+        """p95 seconds over the window, or None with fewer than ROUTE_MIN_SAMPLES samples."""
+        samples = self._latency.get((call, model))
+        if not samples:
+            return None
+        cutoff = time.monotonic() - ROUTE_WINDOW
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        if len(samples) < ROUTE_MIN_SAMPLES:
+            return None
+        return _p95(seconds for _, seconds in samples)
+
+    def choose(self, call: str, kwargs: dict) -> str:
+        index = TIER_ORDER.index(ROUTES.get(call, TIER_ORDER[-1]))
+        reason = "route"
+        if index < len(TIER_ORDER) - 1 and input_tokens(kwargs) > ROUTE_UPGRADE_TOKENS:
+            index += 1
+            reason = "input_size"
+        else:
+            budget = LATENCY_BUDGETS.get(call)
+            p95 = self.p95(call, MODEL_TIERS[TIER_ORDER[index]])
+            if budget is not None and p95 is not None and p95 > budget and index > 0:
+                index -= 1
+                reason = "latency_fallback"
+        model = MODEL_TIERS[TIER_ORDER[index]]
+        self.choices[(call, model, reason)] += 1
+        metrics.llm_route.inc(call=call, model=model, reason=reason)
+        return model
+
+    def observe(self, call: str, model: str, seconds: float):
+        self._latency.setdefault((call, model), deque(maxlen=_MAX_SAMPLES)).append((time.monotonic(), seconds))
+        metrics.llm_model_latency.observe(seconds, call=call, model=model)
+
+    def stats(self) -> dict:
+        """Per call type: primary model, budget, and per model the current p95 and choice counts by reason."""
+        routes = {}
+
+        def entry(call: str, model: str) -> dict:
+            route = routes.setdefault(call, {"primary": self.primary_model(call),
+                                             "budget_s": LATENCY_BUDGETS.get(call), "models": {}})
+            return route["models"].setdefault(model, {"p95_s": None, "choices": {}})
+
+        for (call, model, reason), count in sorted(self.choices.items()):
+            entry(call, model)["choices"][reason] = count
+        for call, model in list(self._latency):
+            p95 = self.p95(call, model)
+            entry(call, model)["p95_s"] = round(p95, 3) if p95 is not None else None
+        return routes
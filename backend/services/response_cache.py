@@ -0,0 +1,106 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+from services import state_backend
+from services.state_backend import SQLiteBackend, StateBackend
+
+load_dotenv()
+
+CACHE_TTL = int(os.getenv("QUESTION_CACHE_TTL", "86400"))  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_MAX_ENTRIES", "1024"))
+CACHE_DB_PATH = os.getenv("QUESTION_CACHE_DB")  # optional on-disk tier, e.g. question_cache.db (unused with a shared STATE_BACKEND)
+
+
+def normalize_code(text: str) -> str:
+    """Ignore line-ending style, trailing whitespace and surrounding blank lines."""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def make_key(kind: str, model: str, *parts: str) -> str:
+    """Content hash of a request: call kind, model and the normalized inputs."""
+    h = hashlib.sha256()
+    for part in (kind, model, *parts):
+        h.update(normalize_code(part or "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated responses.
+    An in-memory LRU with TTL sits in front of an optional shared tier (a
+    state backend: a SQLite file that survives restarts, or the backend all
+    workers use). Values must be JSON-serializable. `get` and `set` are
+    coroutines so a shared tier's round trip happens off the event loop.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL,
+                 shared: Optional[StateBackend] = None, namespace: str = "responses"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.namespace = namespace
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._memory[key]
+
+        if self._shared is not None:
+            value = await self._shared.aget(self.namespace, key)
+            if value is not None:
+                self._remember(key, now + self.ttl, value)
+                self.hits += 1
+                self.shared_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        self._remember(key, time.time() + self.ttl, value)
+        if self._shared is not None:
+            await self._shared.aset(self.namespace, key, value, ttl=self.ttl)
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._memory),
+        }
+
+
+def shared_tier(db_path: Optional[str] = None) -> Optional[StateBackend]:
+    """The process-wide backend when it is shared, else a private SQLite file if one is configured."""
+    if state_backend.backend.shared:
+        return state_backend.backend
+    return SQLiteBackend(db_path) if db_path else None
+
+
+# Shared cache for Socratic questions (Q1 chunk lists and Q2 texts)
+question_cache = ResponseCache(shared=shared_tier(CACHE_DB_PATH), namespace="questions")
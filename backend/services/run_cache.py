@@ -0,0 +1,190 @@
+import ast
+import hashlib
+import json
+import os
+import sys
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from services import state_backend
+from services.state_backend import StateBackend
+
+load_dotenv()
+
+# Opt-in: reuse the result of an earlier run of byte-identical code when a
+# static check says the program cannot depend on anything but its source
+RUN_CACHE_ENABLED = os.getenv("RUN_CACHE_ENABLED", "false").lower() == "true"
+RUN_CACHE_MAX_ENTRIES = int(os.getenv("RUN_CACHE_MAX_ENTRIES", "512"))
+RUN_CACHE_MAX_BYTES = int(os.getenv("RUN_CACHE_MAX_MB", "16")) * 1024 * 1024
+RUN_CACHE_TTL = int(os.getenv("RUN_CACHE_TTL", "3600"))  # seconds an entry is kept in a shared state backend
+
+_NS = "run_result"
+
+# Pure-computation stdlib modules. Anything touching time, randomness, the
+# filesystem, the network, the environment or other processes is left out.
+ALLOWED_MODULES = {
+    "abc", "array", "bisect", "cmath", "collections", "copy", "dataclasses", "decimal", "enum",
+    "fractions", "functools", "heapq", "itertools", "json", "keyword", "math", "numbers",
+    "operator", "pprint", "re", "statistics", "string", "textwrap", "typing", "unicodedata",
+}
+
+# Builtins that do I/O, reach outside the program, or give results that
+# differ between processes (id, hash and the iteration order of sets of
+# strings depend on addresses and the per-process hash seed)
+FORBIDDEN_NAMES = {
+    "open", "input", "exec", "eval", "compile", "__import__", "breakpoint", "globals", "locals",
+    "vars", "help", "exit", "quit", "id", "hash", "set", "frozenset", "__builtins__", "__file__",
+}
+
+# Dunder attributes that are common in student code and cannot reach other modules
+_ALLOWED_DUNDERS = {"__init__", "__name__", "__doc__", "__class__", "__dict__", "__str__", "__repr__",
+                    "__len__", "__eq__", "__lt__"}
+
+# A default repr (<Foo object at 0x7f...>) prints an address that changes every run
+_ADDRESS_MARKER = " at 0x"
+# Whether a program runs out of memory depends on the machine's state, not just the source
+_RESOURCE_ERRORS = ("MemoryError", "CPU time limit exceeded")
+
+
+def is_deterministic(code: str) -> bool:
+    """
+    Cheap static check that a program's output depends only on its source:
+    imports come from ALLOWED_MODULES, no FORBIDDEN_NAMES, no set displays,
+    no dunder attribute tricks. Conservative: False whenever unsure.
+    Code that does not parse is not cached: it fails in milliseconds anyway.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split(".")[0] not in ALLOWED_MODULES for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or (node.module or "").split(".")[0] not in ALLOWED_MODULES:
+                return False
+        elif isinstance(node, ast.Name):
+            if node.id in FORBIDDEN_NAMES:
+                return False
+        elif isinstance(node, ast.Attribute):
+            if node.attr.startswith("__") and node.attr not in _ALLOWED_DUNDERS:
+                return False
+        elif isinstance(node, (ast.Set, ast.SetComp)):
+            return False
+    return True
+
+
+def cache_key(code: str, limits: dict) -> str:
+    """sha256 of the exact source, the interpreter version and the run limits."""
+    h = hashlib.sha256()
+    for part in (sys.version, json.dumps(limits, sort_keys=True), code):
+        h.update(part.encode("utf-8", errors="surrogatepass"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _entry_size(entry: dict) -> int:
+    return len(entry["stdout"].encode("utf-8", errors="replace")) + len(entry["stderr"].encode("utf-8", errors="replace"))
+
+
+class RunCache:
+    """
+    LRU of finished runs (stdout, stderr, status, usage) bounded by entry
+    count and by total output bytes. With a shared state backend, entries
+    are also written there so identical demo code run through any worker hits;
+    lookups and stores are then coroutines that reach it off the event loop.
+    """
+
+    def __init__(self, max_entries: int = RUN_CACHE_MAX_ENTRIES, max_bytes: int = RUN_CACHE_MAX_BYTES,
+                 shared: Optional[StateBackend] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._shared = shared
+        if shared is not None:
+            shared.set_limit(_NS, max_entries, max_bytes)
+        self._entries = OrderedDict()  # key -> entry
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+
+    async def contains(self, key: str) -> bool:
+        return key in self._entries or (self._shared is not None and await self._shared.aget(_NS, key) is not None)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        elif self._shared is not None:
+            entry = await self._shared.aget(_NS, key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def put(self, key: str, stdout: str, stderr: str, status: str, usage: dict, returncode: Optional[int] = None) -> bool:
+        """
+        Store a finished run. Returns False if it was cut short by a limit
+        (timeout, a signal such as SIGXCPU, running out of memory) or its
+        output shows it was not deterministic after all.
+        """
+        if status not in ("success", "error") or returncode is None or returncode < 0:
+            self.uncacheable += 1
+            return False
+        if any(marker in stderr for marker in _RESOURCE_ERRORS):
+            self.uncacheable += 1
+            return False
+        if _ADDRESS_MARKER in stdout or _ADDRESS_MARKER in stderr:
+            self.uncacheable += 1
+            return False
+        entry = {"stdout": stdout, "stderr": stderr, "status": status, "usage": usage}
+        if _entry_size(entry) > self.max_bytes:
+            return False
+        self._remember(key, entry)
+        if self._shared is not None:
+            await self._shared.aset(_NS, key, entry, ttl=RUN_CACHE_TTL)
+        return True
+
+    def _remember(self, key: str, entry: dict):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= _entry_size(old)
+        self._entries[key] = entry
+        self.size += _entry_size(entry)
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self.size -= _entry_size(dropped)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": RUN_CACHE_ENABLED,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "uncacheable": self.uncacheable,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "evictions": self.evictions,
+        }
+
+
+def key_for(code: str, limits: dict) -> Optional[str]:
+    """Cache key for a run, or None when caching is off or the code may not be deterministic."""
+    if not RUN_CACHE_ENABLED:
+        return None
+    if not is_deterministic(code):
+        results.uncacheable += 1
+        return None
+    return cache_key(code, limits)
+
+
+results = RunCache(shared=state_backend.backend if state_backend.backend.shared else None)
@@ -0,0 +1,207 @@
+"""
+Pre-warmed interpreter for the code runner pool.
+
+Started by services/code_runner.py, one process per pool slot, with a
+private scratch directory as its only argument. Reads one JSON job per line
+on stdin ({"code", "max_output", "limits"}) and forks a child that runs the
+code as __main__ in a fresh namespace, under resource limits and inside a
+private temp dir. Output is relayed live as JSON lines
+({"stream": "stdout" | "stderr", "data": ...}) followed by one final
+{"returncode", "truncated", "usage"} line. Forking an already-initialised
+interpreter skips interpreter startup and site import on every run.
+
+Timeouts are enforced by the pool, which kills this worker's whole process
+group and starts a replacement.
+"""
+import atexit
+import codecs
+import json
+import os
+import resource
+import runpy
+import selectors
+import shutil
+import signal
+import sys
+import tempfile
+import traceback
+
+_RLIMITS = {
+    "memory_bytes": resource.RLIMIT_AS,
+    "cpu_seconds": resource.RLIMIT_CPU,
+    "processes": resource.RLIMIT_NPROC,
+    "file_bytes": resource.RLIMIT_FSIZE,
+}
+
+
+def _apply_limits(limits: dict, run_dir: str):
+    """Runs in the forked child before any user code."""
+    for name, value in limits.items():
+        if value and value > 0:
+            # A CPU hard limit equal to the soft one would SIGKILL before SIGXCPU is seen
+            hard = value + 1 if name == "cpu_seconds" else value
+            resource.setrlimit(_RLIMITS[name], (value, hard))
+    os.chdir(run_dir)
+    os.environ["TMPDIR"] = run_dir
+    tempfile.tempdir = run_dir
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _print_user_traceback(code_path: str):
+    """Print the active exception starting at the user's file, like a cold `python file.py`."""
+    etype, value, tb = sys.exc_info()
+    while tb is not None and tb.tb_frame.f_code.co_filename != code_path:
+        tb = tb.tb_next
+    traceback.print_exception(etype, value, tb)
+
+
+def _exec_user_code(code_path: str) -> int:
+    """Runs in the forked child. Returns the process exit status."""
+    sys.argv = [code_path]
+    sys.path[0] = os.path.dirname(code_path)
+    try:
+        runpy.run_path(code_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        _print_user_traceback(code_path)
+        return 1
+    return 0
+
+
+def _relay(pid: int, stdout_fd: int, stderr_fd: int, emit, max_output: int) -> tuple:
+    """
+    Forward child output as it arrives until both pipes close.
+    Past max_output bytes the child is killed and the rest is dropped.
+    Returns (bytes relayed, truncated).
+    """
+    names = {stdout_fd: "stdout", stderr_fd: "stderr"}
+    decoders = {fd: codecs.getincrementaldecoder("utf-8")(errors="replace") for fd in names}
+    sel = selectors.DefaultSelector()
+    for fd in names:
+        sel.register(fd, selectors.EVENT_READ)
+
+    written = 0
+    truncated = False
+    open_fds = len(names)
+    while open_fds:
+        for key, _ in sel.select():
+            chunk = os.read(key.fd, 65536)
+            if not chunk:
+                sel.unregister(key.fd)
+                open_fds -= 1
+                text = decoders[key.fd].decode(b"", final=True)
+            elif truncated:
+                continue
+            else:
+                if written + len(chunk) > max_output:
+                    chunk = chunk[:max_output - written]
+                    truncated = True
+                    os.kill(pid, signal.SIGKILL)
+                written += len(chunk)
+                text = decoders[key.fd].decode(chunk)
+            if text:
+                emit({"stream": names[key.fd], "data": text})
+    sel.close()
+    return written, truncated
+
+
+def run_job(code: str, workdir: str, emit, max_output: int, limits: dict) -> dict:
+    fd, code_path = tempfile.mkstemp(suffix=".py", dir=workdir)
+    with os.fdopen(fd, "w") as f:
+        f.write(code)
+    run_dir = tempfile.mkdtemp(dir=workdir)
+
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            # Child: stdin must not be the job channel, stdout/stderr go to the pipes.
+            os.close(out_r)
+            os.close(err_r)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            for fd in (devnull, out_w, err_w):
+                os.close(fd)
+            # Flush per line so output reaches the client while the code runs
+            sys.stdout.reconfigure(line_buffering=True)
+            sys.stderr.reconfigure(line_buffering=True)
+            _apply_limits(limits, run_dir)
+            atexit._clear()  # handlers inherited from the worker are not the child's to run
+            status = _exec_user_code(code_path)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # os._exit: the child must never unwind into serve() or run the
+            # worker's cleanup, whatever happened above. Only the user's own
+            # atexit handlers run, as they would in `python file.py`.
+            try:
+                atexit._run_exitfuncs()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except BaseException:
+                pass
+            os._exit(status & 0xFF)
+
+    os.close(out_w)
+    os.close(err_w)
+    try:
+        output_bytes, truncated = _relay(pid, out_r, err_r, emit, max_output)
+    finally:
+        os.close(out_r)
+        os.close(err_r)
+    _, status, rusage = os.wait4(pid, 0)
+    returncode = os.waitstatus_to_exitcode(status)
+    if returncode == -signal.SIGXCPU:
+        emit({"stream": "stderr", "data": "\nCPU time limit exceeded.\n"})
+
+    usage = {
+        "cpu_time_ms": round((rusage.ru_utime + rusage.ru_stime) * 1000, 1),
+        "peak_rss_kb": rusage.ru_maxrss,
+        "output_bytes": output_bytes,
+        "file_bytes": _dir_size(run_dir),
+    }
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.unlink(code_path)
+
+    return {
+        "returncode": returncode,
+        "truncated": truncated,
+        "usage": usage,
+    }
+
+
+def serve(workdir: str):
+    channel_in = sys.stdin.buffer
+    channel_out = sys.stdout.buffer
+
+    def emit(message: dict):
+        channel_out.write(json.dumps(message).encode() + b"\n")
+        channel_out.flush()
+
+    for line in channel_in:
+        job = json.loads(line)
+        emit(run_job(job["code"], workdir, emit, job["max_output"], job.get("limits", {})))
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp(prefix="drona-worker-"))
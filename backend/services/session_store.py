@@ -0,0 +1,65 @@
+import os
+import secrets
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+from services import state_backend
+from services.state_backend import StateBackend
+
+load_dotenv()
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))  # seconds of inactivity
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "5000"))
+
+_NS = "session"
+
+
+class SessionStore:
+    """
+    Bounded, expiring store of per-session state dicts, kept in the state
+    backend so every worker sees the same sessions.
+    Sessions expire after `ttl` seconds without access; once `max_entries`
+    is reached the least recently used sessions are dropped. Changes must go
+    through `update` or `modify` to reach shared backends; both are atomic
+    across workers, so concurrent changes to one session are not lost.
+    Methods are coroutines: shared backends do their round trips off the loop.
+    """
+
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES, ttl: float = SESSION_TTL,
+                 backend: Optional[StateBackend] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend or state_backend.backend
+        self.backend.set_limit(_NS, max_entries)
+
+    async def create(self, **data) -> str:
+        session_id = secrets.token_urlsafe(16)
+        await self.backend.aset(_NS, session_id, data, ttl=self.ttl)
+        return session_id
+
+    async def get(self, session_id: Optional[str], kind: Optional[str] = None) -> Optional[dict]:
+        """The session, or None if it is unknown, expired, or not of the given kind."""
+        if not session_id:
+            return None
+        data = await self.backend.aget(_NS, session_id, ttl=self.ttl)
+        if data is None or (kind is not None and data.get("kind") != kind):
+            return None
+        return data
+
+    async def update(self, session_id: str, **fields) -> Optional[dict]:
+        return await self.modify(session_id, lambda data: {**data, **fields})
+
+    async def modify(self, session_id: str, fn: Callable[[dict], dict]) -> Optional[dict]:
+        """Replace the session with fn(session). `fn` must be pure: it may run more than once."""
+        return await self.backend.aupdate(_NS, session_id, fn, ttl=self.ttl)
+
+    async def delete(self, session_id: str):
+        await self.backend.adelete(_NS, session_id)
+
+    def __len__(self):
+        return self.backend.count(_NS) or 0
+
+
+# Quiz (paste -> Q1 -> Q2 -> verdict) and mentor chat sessions
+sessions = SessionStore()
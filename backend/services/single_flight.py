@@ -0,0 +1,99 @@
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Optional
+
+
+class _Flight:
+    """Chunks produced so far by one upstream stream, plus a wake-up for readers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException = None):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight streams.
+    The first caller for a key starts the upstream generator in its own task;
+    callers arriving while it runs get every chunk from the start, replayed
+    from the buffer and then live. The upstream task does not belong to any
+    caller, so a client disconnecting only ends its own subscription and the
+    stream (and whatever it caches on completion) finishes for everyone else.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks = set()
+        self.started = 0
+        self.joined = 0
+
+    def stream(self, key: str, upstream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            task = asyncio.create_task(self._drive(key, flight, upstream))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.started += 1
+        else:
+            self.joined += 1
+        return self._subscribe(flight)
+
+    def join(self, key: str) -> Optional[AsyncIterator[str]]:
+        """Subscribe to the stream for `key` if one is running, without starting one."""
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        self.joined += 1
+        return self._subscribe(flight)
+
+    async def _drive(self, key: str, flight: _Flight, upstream: Callable[[], AsyncIterator[str]]):
+        try:
+            async for chunk in upstream():
+                flight.publish(chunk)
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        except asyncio.CancelledError as e:
+            flight.finish(e)
+            raise
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    @staticmethod
+    async def _subscribe(flight: _Flight) -> AsyncIterator[str]:
+        flight.subscribers += 1
+        try:
+            position = 0
+            while True:
+                changed = flight._changed
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                if position == len(flight.chunks):
+                    await changed.wait()
+        finally:
+            flight.subscribers -= 1
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
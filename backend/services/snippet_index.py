@@ -0,0 +1,209 @@
+import builtins
+import hashlib
+import io
+import json
+import keyword
+import os
+import re
+import tokenize
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SIMILARITY_THRESHOLD = float(os.getenv("SNIPPET_SIMILARITY_THRESHOLD", "0.8"))
+INDEX_MAX_ENTRIES = int(os.getenv("SNIPPET_INDEX_MAX_ENTRIES", "10000"))
+INDEX_PATH = os.getenv("SNIPPET_INDEX_PATH")  # optional JSON file, loaded/saved by the app lifespan
+
+SHINGLE_SIZE = 5
+NUM_BINS = 64
+BANDS = 8
+ROWS = NUM_BINS // BANDS
+MIN_SHINGLES = 8  # too little structure to say two snippets are "the same"
+
+_EMPTY = (1 << 64) - 1
+_FALLBACK_TOKEN = re.compile(r"[A-Za-z_]\w*|\d+|\S")
+_SKIP = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+_BUILTINS = set(dir(builtins))
+
+
+def normalize_tokens(code: str) -> List[str]:
+    """
+    Token stream with formatting, comments and naming abstracted away:
+    locally chosen identifiers become ID and literals become STR/NUM, while
+    keywords, operators, builtins and attribute names (the library API being
+    used) stay. Falls back to a plain lexer when the snippet is not valid Python.
+    """
+    tokens = []
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+            if tok.type in _SKIP:
+                continue
+            if tok.type == tokenize.NAME:
+                keep = keyword.iskeyword(tok.string) or tok.string in _BUILTINS or (tokens and tokens[-1] == ".")
+                tokens.append(tok.string if keep else "ID")
+            elif tok.type == tokenize.STRING:
+                tokens.append("STR")
+            elif tok.type == tokenize.NUMBER:
+                tokens.append("NUM")
+            else:
+                tokens.append(tokenize.tok_name[tok.type] if not tok.string.strip() else tok.string)
+        return tokens
+    except (tokenize.TokenError, SyntaxError):
+        return [_fallback(t) for t in _FALLBACK_TOKEN.findall(code)]
+
+
+def _fallback(token: str) -> str:
+    if keyword.iskeyword(token) or token in _BUILTINS:
+        return token
+    if token[0].isalpha() or token[0] == "_":
+        return "ID"
+    if token.isdigit():
+        return "NUM"
+    return token
+
+
+def signature(code: str) -> Optional[tuple]:
+    """
+    One-permutation MinHash over token shingles: each shingle is hashed once,
+    the hash picks a bin and each bin keeps its minimum. Empty bins borrow
+    from the next filled bin so every position stays comparable.
+    Returns None for snippets with too few shingles.
+    """
+    tokens = normalize_tokens(code)
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    bins = [_EMPTY] * NUM_BINS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        b, value = h % NUM_BINS, h // NUM_BINS
+        if value < bins[b]:
+            bins[b] = value
+
+    for i in range(NUM_BINS):
+        if bins[i] == _EMPTY:
+            for offset in range(1, NUM_BINS):
+                donor = bins[(i + offset) % NUM_BINS]
+                if donor != _EMPTY:
+                    # Mix in the offset so borrowed values differ from the donor's own
+                    bins[i] = donor ^ (offset * 0x9E3779B97F4A7C15 & _EMPTY)
+                    break
+    return tuple(bins)
+
+
+def similarity(a: tuple, b: tuple) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_BINS
+
+
+class SnippetIndex:
+    """
+    Bounded LSH index from code signatures to previously generated payloads.
+    Signatures are split into BANDS bands of ROWS values; snippets sharing any
+    band are candidates and are confirmed against the similarity threshold.
+    Each entry has a scope (e.g. a hash of the model and prompt context the
+    payload was generated for); only entries in the caller's scope can match.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = INDEX_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id -> (signature, payload, scope)
+        self._buckets = {}  # (scope, band, values) -> set of ids
+        self._next_id = 0
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _band_keys(sig: tuple, scope: str):
+        return [(scope, band, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def lookup(self, code: str, sig: Optional[tuple] = None, scope: str = "") -> Optional[Any]:
+        """Payload of the most similar stored snippet in this scope above the threshold, if any."""
+        self.lookups += 1
+        sig = sig or signature(code)
+        if sig is None:
+            return None
+
+        candidates = set()
+        for key in self._band_keys(sig, scope):
+            candidates.update(self._buckets.get(key, ()))
+
+        best_id, best_score = None, self.threshold
+        for entry_id in candidates:
+            score = similarity(sig, self._entries[entry_id][0])
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+        if best_id is None:
+            return None
+
+        self._entries.move_to_end(best_id)
+        self.hits += 1
+        return self._entries[best_id][1]
+
+    def add(self, code: str, payload: Any, sig: Optional[tuple] = None, scope: str = ""):
+        sig = sig or signature(code)
+        if sig is not None:
+            self._insert(sig, payload, scope)
+
+    def _insert(self, sig: tuple, payload: Any, scope: str):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (sig, payload, scope)
+        for key in self._band_keys(sig, scope):
+            self._buckets.setdefault(key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        entry_id, (sig, _, scope) = self._entries.popitem(last=False)
+        for key in self._band_keys(sig, scope):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def save(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"  # workers may save at the same time
+        with open(tmp_path, "w") as f:
+            json.dump([[list(sig), payload, scope] for sig, payload, scope in self._entries.values()], f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for entry in json.load(f):
+                # Entries saved before scopes existed cannot be attributed to a model; skip them
+                if len(entry) == 3 and len(entry[0]) == NUM_BINS:
+                    self._insert(tuple(entry[0]), entry[1], entry[2])
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+# Shared index of pasted snippets -> generated Q1 chunks
+snippet_index = SnippetIndex()
+
+
+def load():
+    if INDEX_PATH:
+        snippet_index.load(INDEX_PATH)
+
+
+def save():
+    if INDEX_PATH:
+        snippet_index.save(INDEX_PATH)
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+from services.session_store import sessions
+
+load_dotenv()
+
+# Opt-in: start generating Q2 as soon as Q1 has streamed
+SPECULATIVE_Q2 = os.getenv("SPECULATIVE_Q2", "false").lower() == "true"
+# Speculative generations allowed per quiz session
+MAX_PER_SESSION = int(os.getenv("SPECULATIVE_MAX_PER_SESSION", "1"))
+# How long /validate_answer waits for a speculative Q2 that is still generating
+# before generating Q2 itself. Kept short: the frontend gives up on
+# /validate_answer after 10 s, and the fallback needs most of that.
+TAKE_TIMEOUT = float(os.getenv("SPECULATIVE_TAKE_TIMEOUT", "1.5"))
+_MAX_PENDING = 1000
+
+_STOPWORDS = {
+    "the", "and", "that", "this", "with", "for", "are", "was", "you", "your", "what",
+    "when", "how", "why", "not", "but", "have", "has", "will", "would", "could", "should",
+    "there", "their", "they", "then", "than", "from", "into", "about", "because", "just",
+    "does", "did", "its", "it's", "can", "all", "any", "out", "our", "use", "used", "get",
+}
+_WORD = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]{2,}")
+
+_pending = OrderedDict()  # session_id -> asyncio.Task
+
+
+def _terms(text: str) -> set:
+    return {w.lower() for w in _WORD.findall(text or "")} - _STOPWORDS
+
+
+def is_on_topic(answer: str, question: str, code_snippet: str) -> bool:
+    """
+    Cheap relevance check: the answer says something substantive and shares
+    vocabulary with the question or the code. A generic follow-up fits such
+    answers; off-topic or empty answers get a freshly generated Q2.
+    """
+    answer_terms = _terms(answer)
+    if len(answer_terms) < 3:
+        return False
+    shared = answer_terms & (_terms(question) | _terms(code_snippet))
+    return len(shared) >= 2 or len(shared) / len(answer_terms) >= 0.2
+
+
+async def start(session_id: str, generate: Callable[[], Awaitable[str]]) -> bool:
+    """Start a speculative Q2 for the session unless disabled or over its cap."""
+    if not SPECULATIVE_Q2 or session_id in _pending:
+        return False
+    session = await sessions.get(session_id)
+    spent = session.get("speculative_calls", 0) if session else MAX_PER_SESSION
+    if spent >= MAX_PER_SESSION:
+        return False
+    await sessions.update(session_id, speculative_calls=spent + 1)
+    if session_id in _pending:  # started by a concurrent call meanwhile
+        return False
+
+    _pending[session_id] = asyncio.create_task(generate())
+    while len(_pending) > _MAX_PENDING:
+        _, task = _pending.popitem(last=False)
+        task.cancel()
+    return True
+
+
+async def take(session_id: Optional[str], answer: str, question: str, code_snippet: str) -> Optional[str]:
+    """
+    Claim the speculative Q2 for a session.
+    Returns it when the answer is on-topic and generation succeeded in time,
+    otherwise None (and the speculation is discarded).
+    """
+    task = _pending.pop(session_id, None) if session_id else None
+    if task is None:
+        return None
+    if not is_on_topic(answer, question, code_snippet):
+        task.cancel()
+        return None
+    try:
+        result = await asyncio.wait_for(asyncio.shield(task), timeout=TAKE_TIMEOUT)
+    except Exception:  # timed out or failed: the caller generates Q2 itself
+        task.cancel()
+        return None
+    if not result or result.startswith("Error"):
+        return None
+    return result
+
+
+def cancel(session_id: str):
+    """Drop any speculative work for the session (e.g. the paste was undone)."""
+    task = _pending.pop(session_id, None)
+    if task is not None:
+        task.cancel()
+
+
+def stats() -> dict:
+    return {"pending": len(_pending)}
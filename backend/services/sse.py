@@ -0,0 +1,107 @@
+import asyncio
+import os
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Text chunks are merged into one SSE event until either limit is hit.
+# SSE_COALESCE_MS=0 turns coalescing off (one event per upstream chunk).
+COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "64"))
+COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "30"))
+# Chunks read ahead of a slow client before the upstream is paused
+BUFFER_CHUNKS = int(os.getenv("SSE_BUFFER_CHUNKS", "256"))
+
+_END = object()
+
+
+def response(events, headers: dict = None):
+    """EventSourceResponse, with sse_starlette imported on the first streaming request rather than at startup."""
+    from sse_starlette.sse import EventSourceResponse
+
+    return EventSourceResponse(events, headers=headers)
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def _pump(chunks: AsyncIterator[str], queue: asyncio.Queue):
+    try:
+        async for chunk in chunks:
+            await queue.put(chunk)
+        await queue.put(_END)
+    except Exception as e:
+        await queue.put(_Failed(e))
+
+
+async def coalesce(
+    chunks: AsyncIterator[str],
+    max_bytes: int = COALESCE_BYTES,
+    max_delay_ms: float = COALESCE_MS,
+    max_buffered: int = BUFFER_CHUNKS,
+) -> AsyncIterator[str]:
+    """
+    Merge small text chunks into fewer, larger ones for SSE.
+    The first chunk is passed through at once so time-to-first-token is
+    unchanged; after that, chunks are joined until `max_bytes` is reached
+    or `max_delay_ms` has passed since the batch started.
+
+    The upstream is read by a separate task into a queue of `max_buffered`
+    chunks, so a slow client stalls the upstream instead of growing memory.
+    Closing this generator (client disconnect) cancels that task, which
+    closes the upstream iterator.
+    """
+    if max_delay_ms <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_buffered)
+    pump = asyncio.create_task(_pump(chunks, queue))
+    max_delay = max_delay_ms / 1000
+    try:
+        first = True
+        finished = False
+        while not finished:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            if first:
+                first = False
+                yield item
+                continue
+
+            batch = [item]
+            size = len(item.encode())
+            deadline = loop.time() + max_delay
+            while size < max_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _END:
+                    finished = True
+                    break
+                if isinstance(item, _Failed):
+                    yield "".join(batch)
+                    raise item.error
+                batch.append(item)
+                size += len(item.encode())
+            yield "".join(batch)
+    finally:
+        pump.cancel()
+        try:
+            await pump
+        except asyncio.CancelledError:
+            pass
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
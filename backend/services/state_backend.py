@@ -0,0 +1,532 @@
+import asyncio
+import json
+import logging
+import math
+import queue
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# memory: per-process (single worker). sqlite: shared by every worker on one
+# host through a WAL-mode file. redis: shared across hosts (needs the redis package).
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "drona:")
+
+_PRUNE_EVERY = 256  # sqlite: writes between sweeps of expired rows
+_LIMIT_CHECK_EVERY = 16  # sqlite: writes to a bounded namespace between limit checks
+
+
+class StateBackend(ABC):
+    """
+    Key/value state shared by the app's workers: sessions, cache tiers,
+    rate-limit counters. Keys live in namespaces; values must be
+    JSON-serializable for the shared backends. `ttl` is in seconds.
+    Code on the event loop uses the `a`-prefixed methods, which do network
+    round trips off the loop.
+    """
+
+    shared = False  # True when other processes see the same state
+
+    @abstractmethod
+    def get(self, ns: str, key: str, ttl: Optional[float] = None) -> Optional[Any]:
+        """Value or None. A `ttl` also pushes the expiry out (sliding expiration)."""
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value, replacing any existing one; without `ttl` it does not expire."""
+
+    @abstractmethod
+    def delete(self, ns: str, key: str):
+        """Drop a key; unknown keys are ignored."""
+
+    @abstractmethod
+    def incr(self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None,
+             floor: Optional[int] = None, sliding: bool = False) -> int:
+        """
+        Atomically add to a counter and return the new value. `ttl` applies
+        when the counter is created (fixed window), or on every call with
+        `sliding`. With `floor`, the counter never goes below it.
+        """
+
+    @abstractmethod
+    def update(self, ns: str, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None) -> Optional[Any]:
+        """
+        Atomically replace an existing value with fn(value), across workers.
+        Returns the new value, or None if the key does not exist. `fn` must
+        be pure: a backend may call it more than once.
+        """
+
+    # In-process and local-file backends answer inline; RedisBackend overrides these
+    async def aget(self, ns: str, key: str, ttl: Optional[float] = None) -> Optional[Any]:
+        return self.get(ns, key, ttl)
+
+    async def aset(self, ns: str, key: str, value: Any, ttl: Optional[float] = None):
+        self.set(ns, key, value, ttl)
+
+    async def adelete(self, ns: str, key: str):
+        self.delete(ns, key)
+
+    async def aincr(self, ns: str, key: str, amount: int = 1, ttl: Optional[float] = None,
+                    floor: Optional[int] = None, sliding: bool = False) -> int:
+        return self.incr(ns, key, amount, ttl, floor, sliding)
+
+    async def aupdate(self, ns: str, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None) -> Optional[Any]:
+        return self.update(ns, key, fn, ttl)
+
+    def count(self, ns: str) -> Optional[int]:
+        """Live keys in a namespace, or None if the backend cannot tell cheaply."""
+        return None
+
+    def set_limit(self, ns: str, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Bound a namespace: beyond `max_entries` keys (or `max_bytes` of stored
+        values, where the backend supports it) the keys closest to expiry go first.
+        """
+
+    def close(self):
+        """Flush pending writes. Called on shutdown."""
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "shared": self.shared}
+
+
+class MemoryBackend(StateBackend):
+    """
+    Per-process dicts. Values are stored as-is (not copied or serialized),
+    so single-worker deployments behave exactly like plain module globals.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, OrderedDict] = {}  # ns -> key -> (expires_at, value)
+        self._limits: Dict[str, int] = {}
+
+    def _ns(self, ns: str) -> OrderedDict:
+        return self._data.setdefault(ns, OrderedDict())
+
+    def get(self, ns, key, ttl=None):
+        entries = self._ns(ns)
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.time():
+            del entries[key]
+            return None
+        if ttl is not None:
+            entries[key] = (time.time() + ttl, value)
+        entries.move_to_end(key)
+        return value
+
+    def set(self, ns, key, value, ttl=None):
+        entries = self._ns(ns)
+        entries[key] = (time.time() + ttl if ttl is not None else None, value)
+        entries.move_to_end(key)
+        limit = self._limits.get(ns)
+        while limit is not None and len(entries) > limit:
+            entries.popitem(last=False)
+
+    def delete(self, ns, key):
+        self._ns(ns).pop(key, None)
+
+    def incr(self, ns, key, amount=1, ttl=None, floor=None, sliding=False):
+        entries = self._ns(ns)
+        entry = entries.get(key)
+        now = time.time()
+        if entry is None or (entry[0] is not None and entry[0] <= now):
+            entry = (now + ttl if ttl is not None else None, 0)
+        value = entry[1] + amount
+        if floor is not None:
+            value = max(floor, value)
+        entries[key] = (now + ttl if sliding and ttl is not None else entry[0], value)
+        return value
+
+    def update(self, ns, key, fn, ttl=None):
+        value = self.get(ns, key)
+        if value is None:
+            return None
+        value = fn(value)
+        self.set(ns, key, value, ttl=ttl)
+        return value
+
+    def count(self, ns):
+        return len(self._ns(ns))
+
+    def set_limit(self, ns, max_entries=None, max_bytes=None):
+        # Byte limits are left to the callers' own in-memory tiers (e.g. BlobStore)
+        if max_entries is not None:
+            self._limits[ns] = max_entries
+
+
+_DELETED = object()
+
+
+class SQLiteBackend(StateBackend):
+    """
+    One WAL-mode SQLite file. Every worker process on the host opens it, so
+    they all see the same sessions, cache entries and counters.
+
+    Reads run on the caller's thread: in WAL mode they never wait for a
+    writer. Every write goes to a dedicated writer thread with its own
+    connection, so lock waits between workers and large values never block
+    the event loop. set/delete/update return at once; until the writer has
+    committed them, this process reads its own pending writes from an
+    overlay. incr needs the stored result, so incr() waits for the writer;
+    async callers use aincr().
+    """
+
+    shared = True
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()  # guards the reader connection and the overlay
+        self._pending: Dict[tuple, tuple] = {}  # (ns, key) -> (seq, expires_at, value or _DELETED)
+        self._seq = 0
+        self._limits: Dict[str, tuple] = {}  # ns -> (max_entries, max_bytes)
+        self._writes = 0
+        self._limit_writes: Dict[str, int] = {}
+        self._reader = self._connect()
+        self._reader.execute(
+            "CREATE TABLE IF NOT EXISTS kv (ns TEXT, key TEXT, expires_at REAL, value TEXT, "
+            "PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        self._reader.execute("CREATE INDEX IF NOT EXISTS kv_expiry ON kv (ns, expires_at)")
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="state-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- Reads (caller's thread) ---
+
+    def get(self, ns, key, ttl=None):
+        now = time.time()
+        with self._lock:
+            pending = self._pending.get((ns, key))
+            if pending is not None:
+                _, expires_at, value = pending
+                if value is _DELETED or (expires_at is not None and expires_at <= now):
+                    return None
+            else:
+                row = self._reader.execute(
+                    "SELECT value FROM kv WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (ns, key, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                value = json.loads(row[0])
+        if ttl is not None:
+            self._submit(self._touch, ns, key, now + ttl)
+        return value
+
+    def count(self, ns):
+        with self._lock:
+            row = self._reader.execute(
+                "SELECT COUNT(*) FROM kv WHERE ns = ? AND (expires_at IS NULL OR expires_at > ?)", (ns, time.time())
+            ).fetchone()
+        return row[0]
+
+    # --- Writes (writer thread) ---
+
+    def _submit(self, op, *args) -> Future:
+        future = Future()
+        self._queue.put((op, args, future))
+        return future
+
+    def _overlay(self, ns: str, key: str, expires_at, value) -> int:
+        with self._lock:
+            self._seq += 1
+            self._pending[(ns, key)] = (self._seq, expires_at, value)
+            return self._seq
+
+    def _settle(self, ns: str, key: str, seq: int):
+        with self._lock:
+            pending = self._pending.get((ns, key))
+            if pending is not None and pending[0] == seq:
+                del self._pending[(ns, key)]
+
+    def set(self, ns, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        seq = self._overlay(ns, key, expires_at, value)
+        self._submit(self._write_set, ns, key, expires_at, json.dumps(value), seq)
+
+    def delete(self, ns, key):
+        seq = self._overlay(ns, key, None, _DELETED)
+        self._submit(self._write_delete, ns, key, seq)
+
+    def update(self, ns, key, fn, ttl=None):
+        current = self.get(ns, key)
+        if current is None:
+            return None
+        value = fn(current)
+        expires_at = time.time() + ttl if ttl is not None else None
+        seq = self._overlay(ns, key, expires_at, value)
+        # The writer applies fn again to whatever is committed by then, so
+        # concurrent updates from other workers are not lost
+        self._submit(self._write_update, ns, key, fn, expires_at, seq)
+        return value
+
+    def incr(self, ns, key, amount=1, ttl=None, floor=None, sliding=False):
+        return self._submit(self._write_incr, ns, key, amount, ttl, floor, sliding).result()
+
+    async def aincr(self, ns, key, amount=1, ttl=None, floor=None, sliding=False):
+        return await asyncio.wrap_future(self._submit(self._write_incr, ns, key, amount, ttl, floor, sliding))
+
+    def set_limit(self, ns, max_entries=None, max_bytes=None):
+        self._limits[ns] = (max_entries, max_bytes)
+
+    def close(self):
+        self._submit(None).result(timeout=10)
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            op, args, future = self._queue.get()
+            if op is None:
+                future.set_result(None)
+                continue
+            try:
+                result = op(db, *args)
+            except Exception as e:
+                logger.exception("state backend write failed")
+                future.set_exception(e)
+                if op in (self._write_set, self._write_delete, self._write_update):
+                    self._settle(args[0], args[1], args[-1])
+                continue
+            future.set_result(result)
+
+    def _transaction(self, db, fn):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn()
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _write_set(self, db, ns, key, expires_at, raw, seq):
+        db.execute("INSERT OR REPLACE INTO kv (ns, key, expires_at, value) VALUES (?, ?, ?, ?)", (ns, key, expires_at, raw))
+        self._settle(ns, key, seq)
+        self._after_write(db, ns)
+
+    def _write_delete(self, db, ns, key, seq):
+        db.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+        self._settle(ns, key, seq)
+
+    def _touch(self, db, ns, key, expires_at):
+        db.execute("UPDATE kv SET expires_at = ? WHERE ns = ? AND key = ?", (expires_at, ns, key))
+
+    def _write_update(self, db, ns, key, fn, expires_at, seq):
+        def apply():
+            row = db.execute(
+                "SELECT value FROM kv WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (ns, key, time.time()),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE kv SET value = ?, expires_at = ? WHERE ns = ? AND key = ?",
+                    (json.dumps(fn(json.loads(row[0]))), expires_at, ns, key),
+                )
+
+        self._transaction(db, apply)
+        self._settle(ns, key, seq)
+
+    def _write_incr(self, db, ns, key, amount, ttl, floor, sliding):
+        now = time.time()
+
+        def apply():
+            row = db.execute(
+                "SELECT value, expires_at FROM kv WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (ns, key, now),
+            ).fetchone()
+            if row is None:
+                value, expires_at = amount, (now + ttl if ttl is not None else None)
+            else:
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            if floor is not None:
+                value = max(floor, value)
+            if sliding and ttl is not None:
+                expires_at = now + ttl
+            db.execute(
+                "INSERT OR REPLACE INTO kv (ns, key, expires_at, value) VALUES (?, ?, ?, ?)",
+                (ns, key, expires_at, json.dumps(value)),
+            )
+            return value
+
+        value = self._transaction(db, apply)
+        self._after_write(db, ns)
+        return value
+
+    def _after_write(self, db, ns: str):
+        self._writes += 1
+        if self._writes % _PRUNE_EVERY == 0:
+            db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+        if ns in self._limits:
+            self._limit_writes[ns] = self._limit_writes.get(ns, 0) + 1
+            if self._limit_writes[ns] % _LIMIT_CHECK_EVERY == 0:
+                self._enforce_limit(db, ns, *self._limits[ns])
+
+    def _enforce_limit(self, db, ns: str, max_entries: Optional[int], max_bytes: Optional[int]):
+        """Drop the keys closest to expiry (least recently used with sliding TTLs) until within the limits."""
+        rows = db.execute(
+            "SELECT key, length(value) FROM kv WHERE ns = ? ORDER BY expires_at IS NULL DESC, expires_at DESC", (ns,)
+        ).fetchall()
+        total, keep = 0, 0
+        for _, size in rows:
+            if (max_entries is not None and keep >= max_entries) or (max_bytes is not None and total + size > max_bytes):
+                break
+            total += size
+            keep += 1
+        dropped = [key for key, _ in rows[keep:]]
+        if dropped:
+            db.executemany("DELETE FROM kv WHERE ns = ? AND key = ?", [(ns, key) for key in dropped])
+
+    def stats(self):
+        return {**super().stats(), "path": self.path, "pending_writes": self._queue.qsize()}
+
+
+class RedisBackend(StateBackend):
+    """
+    Redis (or any server speaking its protocol), for workers on several hosts.
+    Bounded namespaces keep a sorted-set index of their keys by expiry so the
+    ones closest to expiry can be dropped; byte limits are not supported.
+    """
+
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=redis needs the redis package (pip install redis)") from e
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self._limits: Dict[str, int] = {}
+
+    def _key(self, ns: str, key: str) -> str:
+        return f"{self.prefix}{ns}:{key}"
+
+    def _index(self, ns: str) -> str:
+        return f"{self.prefix}{ns}:__index"
+
+    @staticmethod
+    def _seconds(ttl: float) -> int:
+        return max(1, math.ceil(ttl))
+
+    def _track(self, pipe, ns: str, key: str, ttl: Optional[float]):
+        if ns in self._limits:
+            pipe.zadd(self._index(ns), {key: time.time() + ttl if ttl is not None else math.inf})
+
+    def get(self, ns, key, ttl=None):
+        k = self._key(ns, key)
+        raw = self._redis.getex(k, ex=self._seconds(ttl)) if ttl is not None else self._redis.get(k)
+        if raw is not None and ttl is not None and ns in self._limits:
+            self._redis.zadd(self._index(ns), {key: time.time() + ttl})
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, ns, key, value, ttl=None):
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(ns, key), json.dumps(value), ex=self._seconds(ttl) if ttl is not None else None)
+        self._track(pipe, ns, key, ttl)
+        pipe.execute()
+        if ns in self._limits:
+            self._enforce_limit(ns)
+
+    def delete(self, ns, key):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(ns, key))
+        if ns in self._limits:
+            pipe.zrem(self._index(ns), key)
+        pipe.execute()
+
+    def incr(self, ns, key, amount=1, ttl=None, floor=None, sliding=False):
+        k = self._key(ns, key)
+        pipe = self._redis.pipeline()
+        pipe.incrby(k, amount)
+        if ttl is not None:
+            pipe.expire(k, self._seconds(ttl), nx=not sliding)
+        value = pipe.execute()[0]
+        if floor is not None and value < floor:
+            # Raise it back atomically; a concurrent incr in between is kept
+            value = self._redis.incrby(k, floor - value) if self._redis.get(k) is not None else floor
+        return value
+
+    def update(self, ns, key, fn, ttl=None):
+        k = self._key(ns, key)
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(k)
+                    raw = pipe.get(k)
+                    if raw is None:
+                        return None
+                    value = fn(json.loads(raw))
+                    pipe.multi()
+                    pipe.set(k, json.dumps(value), ex=self._seconds(ttl) if ttl is not None else None)
+                    self._track(pipe, ns, key, ttl)
+                    pipe.execute()
+                    return value
+                except self._watch_error:
+                    continue
+
+    async def aget(self, ns, key, ttl=None):
+        return await asyncio.to_thread(self.get, ns, key, ttl)
+
+    async def aset(self, ns, key, value, ttl=None):
+        await asyncio.to_thread(self.set, ns, key, value, ttl)
+
+    async def adelete(self, ns, key):
+        await asyncio.to_thread(self.delete, ns, key)
+
+    async def aincr(self, ns, key, amount=1, ttl=None, floor=None, sliding=False):
+        return await asyncio.to_thread(self.incr, ns, key, amount, ttl, floor, sliding)
+
+    async def aupdate(self, ns, key, fn, ttl=None):
+        return await asyncio.to_thread(self.update, ns, key, fn, ttl)
+
+    def count(self, ns):
+        return self._redis.zcard(self._index(ns)) if ns in self._limits else None
+
+    def set_limit(self, ns, max_entries=None, max_bytes=None):
+        if max_entries is not None:
+            self._limits[ns] = max_entries
+
+    def _enforce_limit(self, ns: str):
+        index = self._index(ns)
+        self._redis.zremrangebyscore(index, "-inf", time.time())  # keys Redis has already expired
+        excess = self._redis.zcard(index) - self._limits[ns]
+        if excess > 0:
+            dropped = [member.decode() for member, _ in self._redis.zpopmin(index, excess)]
+            self._redis.delete(*(self._key(ns, key) for key in dropped))
+
+
+def make_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend(STATE_DB_PATH)
+    if kind == "redis":
+        return RedisBackend(REDIS_URL)
+    raise ValueError(f"Unknown STATE_BACKEND {kind!r} (expected memory, sqlite or redis)")
+
+
+# Process-wide state backend, chosen by STATE_BACKEND
+backend = make_backend()
@@ -0,0 +1,85 @@
+import os
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Ceiling for the variable part of a prompt (file contents, tree, summaries)
+MAX_INPUT_TOKENS = int(os.getenv("MAX_INPUT_TOKENS", "20000"))
+# Rough chars-per-token for code and English; close enough for budgeting
+CHARS_PER_TOKEN = 4
+MAX_TREE_ENTRIES = 50
+
+# Which related files matter most when the budget is tight
+RELATION_PRIORITY = {"import": 0, "dependency": 1, "sibling": 2}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the head of the text, cut on a line boundary, and say what was dropped."""
+    text = text or ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN)
+    head = text[:max_chars]
+    if "\n" in head:
+        head = head[:head.rindex("\n")]
+    dropped = text.count("\n") - head.count("\n")
+    return f"{head}\n... ({dropped} more lines truncated)"
+
+
+def _truncate_file(file: dict, max_tokens: int) -> str:
+    return truncate_to_tokens(file.get("content", ""), max_tokens)
+
+
+def fit_workspace(workspace_context: dict, budget: int = MAX_INPUT_TOKENS,
+                  truncate: Optional[Callable[[dict, int], str]] = None) -> dict:
+    """
+    Trim a workspace context to roughly `budget` tokens.
+    The active file is kept first (truncated to at most half the budget if it
+    is huge), then related files in RELATION_PRIORITY order while they fit,
+    then as much of the file tree as is left. `truncate(file, max_tokens)`
+    can be swapped for a memoized version.
+    """
+    truncate = truncate or _truncate_file
+    active_file = dict(workspace_context.get("activeFile") or {})
+    active_file["content"] = truncate(active_file, max(budget // 2, 1))
+    remaining = budget - estimate_tokens(active_file["content"])
+
+    related = sorted(
+        workspace_context.get("relatedFiles") or [],
+        key=lambda rf: RELATION_PRIORITY.get(rf.get("relation"), len(RELATION_PRIORITY)),
+    )
+    kept = []
+    omitted = []
+    for rf in related:
+        cost = estimate_tokens(rf.get("content", "")) + estimate_tokens(rf.get("path", "")) + 8
+        if cost <= remaining:
+            kept.append(rf)
+            remaining -= cost
+        elif remaining > 200:
+            # Partial file is still useful context; give it what is left
+            kept.append({**rf, "content": truncate(rf, remaining - 50)})
+            remaining = 0
+        else:
+            omitted.append(rf.get("path", ""))
+
+    tree = []
+    for path in (workspace_context.get("fileTree") or [])[:MAX_TREE_ENTRIES]:
+        cost = estimate_tokens(path) + 1
+        if cost > remaining:
+            break
+        tree.append(path)
+        remaining -= cost
+
+    return {
+        "activeFile": active_file,
+        "relatedFiles": kept,
+        "omittedFiles": omitted,
+        "fileTree": tree,
+        "fileTreeTotal": len(workspace_context.get("fileTree") or []),
+    }
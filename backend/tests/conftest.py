@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Tests import the backend's modules the way main.py does (`from services import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never reach the real Anthropic API or a developer's shared state from tests
+os.environ["ANTHROPIC_API_KEY"] = ""
+os.environ["STATE_BACKEND"] = "memory"
@@ -0,0 +1,147 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services import admission, state_backend
+from services.state_backend import MemoryBackend
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(state_backend, "backend", MemoryBackend())
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "RATE_LIMIT_PER_MIN", 60)
+    monkeypatch.setattr(admission, "RATE_LIMIT_BURST", 3)
+    monkeypatch.setattr(admission, "CLIENT_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "IP_RATE_LIMIT_PER_MIN", 600)
+    monkeypatch.setattr(admission, "IP_RATE_LIMIT_BURST", 5)
+    monkeypatch.setattr(admission, "IP_MAX_IN_FLIGHT", 2)
+    monkeypatch.setattr(admission, "TRUST_PROXY_HEADERS", False)
+    monkeypatch.setattr(admission, "TRUSTED_PROXY_HOPS", 1)
+
+
+def make_app(release: asyncio.Event = None):
+    async def app(scope, receive, send):
+        if release is not None:
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": admission.current_client().encode()})
+
+    return admission.AdmissionMiddleware(app)
+
+
+def client(app, address="10.0.0.1"):
+    transport = httpx.ASGITransport(app=app, client=(address, 5000))
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+async def statuses(http, count, headers=None, path="/api/run"):
+    return [(await http.post(path, headers=headers)).status_code for _ in range(count)]
+
+
+def test_token_bucket_rejects_past_the_burst_with_retry_after():
+    async def scenario():
+        async with client(make_app()) as http:
+            codes = await statuses(http, 3)
+            rejected = await http.post("/api/run")
+            return codes, rejected
+
+    codes, rejected = asyncio.run(scenario())
+    assert codes == [200, 200, 200]
+    assert rejected.status_code == 429
+    assert int(rejected.headers["retry-after"]) >= 1
+
+
+def test_unlimited_routes_pass_through():
+    async def scenario():
+        async with client(make_app()) as http:
+            return await statuses(http, 6, path="/cache_stats")
+
+    assert asyncio.run(scenario()) == [200] * 6
+
+
+def test_client_ids_behind_one_address_get_their_own_budget():
+    async def scenario():
+        async with client(make_app()) as http:
+            alice = await statuses(http, 3, {"X-Client-Id": "alice-browser-1"})
+            bob = await statuses(http, 2, {"X-Client-Id": "bob-browser-22"})
+            # The address ceiling (burst 5) still bounds a script rotating ids
+            carol = await statuses(http, 1, {"X-Client-Id": "carol-browser-3"})
+            return alice, bob, carol
+
+    alice, bob, carol = asyncio.run(scenario())
+    assert alice == [200, 200, 200]
+    assert bob == [200, 200]
+    assert carol == [429]
+
+
+def test_malformed_client_ids_fall_back_to_the_address():
+    assert admission.client_key({"client": ("10.0.0.1", 1), "headers": [(b"x-client-id", b"x")]}) == "10.0.0.1"
+    assert admission.client_key({"client": ("10.0.0.1", 1), "headers": [(b"x-client-id", b"abc/def/ghi")]}) == "10.0.0.1"
+    assert admission.client_key({"client": ("10.0.0.1", 1), "headers": [(b"x-client-id", b"browser-123")]}) == "10.0.0.1/browser-123"
+
+
+def test_spoofed_forwarded_for_hops_are_ignored(monkeypatch):
+    monkeypatch.setattr(admission, "TRUST_PROXY_HEADERS", True)
+
+    async def scenario():
+        async with client(make_app(), address="10.9.9.9") as http:
+            codes = []
+            for i in range(4):
+                # The proxy appends the real address; the client controls what is left of it
+                headers = {"X-Forwarded-For": f"198.51.100.{i}, 203.0.113.7"}
+                codes.append((await http.post("/api/run", headers=headers)).status_code)
+            return codes
+
+    assert asyncio.run(scenario()) == [200, 200, 200, 429]
+
+
+def test_forwarded_for_counts_trusted_hops_from_the_right(monkeypatch):
+    monkeypatch.setattr(admission, "TRUST_PROXY_HEADERS", True)
+    scope = {"client": ("10.9.9.9", 1), "headers": [(b"x-forwarded-for", b"1.1.1.1, 203.0.113.7, 10.0.0.2")]}
+    assert admission.client_address(scope) == "10.0.0.2"
+    monkeypatch.setattr(admission, "TRUSTED_PROXY_HOPS", 2)
+    assert admission.client_address(scope) == "203.0.113.7"
+    monkeypatch.setattr(admission, "TRUST_PROXY_HEADERS", False)
+    assert admission.client_address(scope) == "10.9.9.9"
+
+
+def test_in_flight_limit_and_counter_never_goes_negative():
+    async def scenario():
+        release = asyncio.Event()
+        async with client(make_app(release)) as http:
+            held = asyncio.create_task(http.post("/api/run"))
+            await asyncio.sleep(0.05)
+            second = await http.post("/api/run")
+            release.set()
+            first = await held
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.status_code == 200
+    assert second.status_code == 429
+    backend = state_backend.backend
+    assert backend.get("in_flight", "10.0.0.1") == 0
+    # A decrement arriving after the counter expired stays at zero
+    backend.delete("in_flight", "10.0.0.1")
+    assert backend.incr("in_flight", "10.0.0.1", -1, ttl=60, floor=0, sliding=True) == 0
+
+
+def test_fair_queue_key_is_the_client():
+    async def scenario():
+        async with client(make_app()) as http:
+            response = await http.post("/api/run", headers={"X-Client-Id": "alice-browser-1"})
+            return response.text
+
+    assert asyncio.run(scenario()) == "10.0.0.1/alice-browser-1"
+
+
+def test_disabled_admission_lets_everything_through(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", False)
+
+    async def scenario():
+        async with client(make_app()) as http:
+            return await statuses(http, 6)
+
+    assert asyncio.run(scenario()) == [200] * 6
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import blob_store, mock_service
+from services.blob_store import BlobStore, blob_hash
+
+MAIN = "from helpers import total\nprint(total([1, 2]))\n"
+HELPERS = "def total(values):\n    return sum(values)\n"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(blob_store, "blobs", BlobStore())
+    monkeypatch.setattr(mock_service, "_profile", mock_service.LATENCY_PROFILES["instant"])
+    return TestClient(main.app)
+
+
+def chat(client, refs):
+    return client.post("/mentor_chat", json={
+        "selected_code": "print(total([1, 2]))", "user_query": "What does this print?", "workspace_refs": refs,
+    })
+
+
+def test_upload_is_checked_against_its_hash(client):
+    assert client.put(f"/blobs/{blob_hash(MAIN)}", content=MAIN).json() == {"hash": blob_hash(MAIN)}
+    assert client.put(f"/blobs/{blob_hash(MAIN)}", content=HELPERS).status_code == 400
+    missing = client.post("/blobs/missing", json={"hashes": [blob_hash(MAIN), blob_hash(HELPERS)]}).json()
+    assert missing == {"missing": [blob_hash(HELPERS)]}
+
+
+def test_chat_names_the_blobs_to_upload(client):
+    refs = {
+        "activeFile": {"path": "main.py", "hash": blob_hash(MAIN)},
+        "relatedFiles": [{"path": "helpers.py", "hash": blob_hash(HELPERS), "relation": "import"}],
+        "fileTree": ["main.py", "helpers.py"],
+    }
+    client.put(f"/blobs/{blob_hash(MAIN)}", content=MAIN)
+    response = chat(client, refs)
+    assert response.status_code == 409
+    assert response.json()["detail"] == {"missing": [blob_hash(HELPERS)]}
+
+    client.put(f"/blobs/{blob_hash(HELPERS)}", content=HELPERS)
+    assert chat(client, refs).status_code == 200
+
+
+def test_least_recently_used_blobs_are_evicted():
+    store = BlobStore(max_bytes=2 * len(MAIN))
+
+    async def scenario():
+        await store.put(blob_hash(MAIN), MAIN)
+        await store.put(blob_hash(HELPERS), HELPERS)
+        await store.get(blob_hash(MAIN))
+        third = MAIN.replace("1, 2", "3, 4")
+        await store.put(blob_hash(third), third)
+        return await store.missing([blob_hash(MAIN), blob_hash(HELPERS), blob_hash(third)])
+
+    assert asyncio.run(scenario()) == [blob_hash(HELPERS)]
+    assert store.stats()["evictions"] == 1
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from services import chat_history
+from services.session_store import SessionStore
+from services.state_backend import MemoryBackend
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    monkeypatch.setattr(chat_history, "sessions", SessionStore(backend=MemoryBackend()))
+    monkeypatch.setattr(chat_history, "CHAT_HISTORY_MAX_TOKENS", 100)
+    monkeypatch.setattr(chat_history, "CHAT_KEEP_RECENT_TURNS", 2)
+
+
+async def chat_session(turns):
+    session_id = await chat_history.sessions.create(kind="mentor", turns=[], digest="")
+    for i in range(turns):
+        await chat_history.add_turn(session_id, f"question {i}", f"Answer {i}. " + "detail " * 20)
+    return session_id
+
+
+def test_threshold():
+    async def scenario():
+        short = await chat_history.sessions.get(await chat_session(2))
+        long = await chat_history.sessions.get(await chat_session(6))
+        return chat_history.needs_compaction(short), chat_history.needs_compaction(long)
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_older_turns_are_folded_into_the_digest():
+    async def summarize(digest, turns):
+        return f"{len(turns)} turns about " + ", ".join(t["user"] for t in turns)
+
+    async def scenario():
+        session_id = await chat_session(6)
+        await chat_history.compact(session_id, summarize)
+        return await chat_history.sessions.get(session_id)
+
+    session = asyncio.run(scenario())
+    assert session["digest"] == "4 turns about question 0, question 1, question 2, question 3"
+    assert [t["user"] for t in session["turns"]] == ["question 4", "question 5"]
+
+
+def test_turns_added_during_the_summary_are_kept():
+    async def scenario():
+        session_id = await chat_session(6)
+
+        async def slow_summary(digest, turns):
+            await chat_history.add_turn(session_id, "question 6", "Answer 6.")
+            return "summary"
+
+        await chat_history.compact(session_id, slow_summary)
+        return await chat_history.sessions.get(session_id)
+
+    session = asyncio.run(scenario())
+    assert [t["user"] for t in session["turns"]] == ["question 4", "question 5", "question 6"]
+
+
+def test_failed_summary_falls_back_to_a_local_digest():
+    async def broken(digest, turns):
+        raise RuntimeError("model unavailable")
+
+    async def scenario():
+        session_id = await chat_session(6)
+        await chat_history.compact(session_id, broken)
+        return await chat_history.sessions.get(session_id)
+
+    session = asyncio.run(scenario())
+    assert session["digest"].splitlines()[0] == "- Student asked: question 0 / Mentor: Answer 0"
+    assert len(session["turns"]) == 2
@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import claude_service, code_analyzer
+from services.response_cache import ResponseCache
+from services.snippet_index import SnippetIndex
+
+INJECTABLE = '''import sqlite3
+
+def find_user(conn, name):
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM users WHERE name = '" + name + "'")
+    return cur.fetchall()
+'''
+
+
+def test_confident_finding_becomes_the_question():
+    facts = code_analyzer.analyze(INJECTABLE)
+    assert facts["findings"][0]["kind"] == "sql_injection"
+    question = code_analyzer.template_question(facts)
+    assert question.startswith("On line 5") and "**cur.execute**" in question
+
+
+def test_large_snippets_are_analyzed_in_a_non_forking_pool(monkeypatch):
+    monkeypatch.setattr(code_analyzer, "INLINE_MAX_BYTES", 16)
+    monkeypatch.setattr(code_analyzer, "analysis_cache", ResponseCache())
+    try:
+        facts = asyncio.run(code_analyzer.analyze_async(INJECTABLE))
+        assert code_analyzer._pool._mp_context.get_start_method() != "fork"
+    finally:
+        code_analyzer.shutdown()
+        code_analyzer._pool = None
+    assert facts == code_analyzer.analyze(INJECTABLE)
+
+
+class NoMessages:
+    def stream(self, **kwargs):
+        raise AssertionError("a templated Q1 needs no LLM call")
+
+
+def test_templated_questions_are_indexed_for_near_duplicates(monkeypatch):
+    client = SimpleNamespace(messages=NoMessages())
+    monkeypatch.setattr(claude_service, "client", client)
+    monkeypatch.setattr(claude_service.policy, "client", client)
+    monkeypatch.setattr(claude_service, "question_cache", ResponseCache())
+    monkeypatch.setattr(claude_service, "snippet_index", SnippetIndex())
+
+    async def first_question(code, context=""):
+        return "".join([chunk async for chunk in claude_service.stream_first_question(code, context)])
+
+    question = asyncio.run(first_question(INJECTABLE))
+    renamed = INJECTABLE.replace("find_user", "lookup_account").replace("name", "login")
+    assert asyncio.run(first_question(renamed)) == question
+    assert claude_service.snippet_index.hits == 1
+    # A different file context is a different prompt, so the index is not consulted for it
+    asyncio.run(first_question(renamed, "import sqlite3\n"))
+    assert claude_service.snippet_index.hits == 1
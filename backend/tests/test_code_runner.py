@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import code_runner
+from services.admission import FairLimiter
+
+
+@pytest.fixture(autouse=True)
+def no_pool(monkeypatch):
+    # One-shot workers: the engine itself, without the pre-warmed pool
+    monkeypatch.setattr(code_runner, "_idle_workers", None)
+
+
+def test_execute_reports_output_and_status():
+    ok = asyncio.run(code_runner.execute("print('hello')"))
+    assert ok["status"] == "success" and ok["stdout"] == "hello\n"
+    failed = asyncio.run(code_runner.execute("raise ValueError('boom')"))
+    assert failed["status"] == "error" and "ValueError: boom" in failed["stderr"]
+
+
+def test_wall_clock_timeout(monkeypatch):
+    monkeypatch.setattr(code_runner, "RUN_TIMEOUT", 0.5)
+    result = asyncio.run(code_runner.execute("while True:\n    pass\n"))
+    assert result["status"] == "timeout"
+
+
+def test_runs_do_not_block_the_event_loop():
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await code_runner.execute("import time\ntime.sleep(0.5)\n")
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        return ticks, elapsed
+
+    ticks, elapsed = asyncio.run(scenario())
+    # A blocked loop would tick once or twice at the end, not every 10 ms throughout
+    assert ticks >= elapsed / 0.01 / 3
+
+
+def test_concurrency_cap_queue_and_busy(monkeypatch):
+    monkeypatch.setattr(code_runner, "_slots", FairLimiter(1, max_waiting=1))
+
+    async def scenario():
+        slow = "import time\ntime.sleep(0.3)\nprint('done')\n"
+        first = asyncio.create_task(code_runner.execute(slow))
+        await asyncio.sleep(0.05)
+        assert code_runner.running() == 1
+        queued = asyncio.create_task(code_runner.execute(slow))
+        await asyncio.sleep(0.05)
+        assert code_runner.queue_depth() == 1 and code_runner.saturated()
+        with pytest.raises(code_runner.RunnerBusy):
+            await code_runner.execute("print(1)")
+        return await first, await queued
+
+    first, queued = asyncio.run(scenario())
+    assert first["stdout"] == queued["stdout"] == "done\n"
+
+
+def test_busy_runner_answers_503(monkeypatch):
+    monkeypatch.setattr(code_runner, "saturated", lambda: True)
+
+    async def busy(code, kernel_id=None):
+        raise code_runner.RunnerBusy()
+
+    monkeypatch.setattr(code_runner, "execute", busy)
+    response = TestClient(main.app).post("/api/run", json={"code": "print(1)"})
+    assert response.status_code == 503
+    assert response.json()["status"] == "busy"
+    assert response.headers["retry-after"] == "1"
+
+
+def test_output_limit_reports_truncated(monkeypatch):
+    monkeypatch.setattr(code_runner, "MAX_OUTPUT_BYTES", 1000)
+    result = asyncio.run(code_runner.execute("while True:\n    print('x' * 100)\n"))
+    assert result["status"] == "truncated"
+    assert len(result["stdout"]) <= 1000 and "Output truncated" in result["stderr"]
+
+
+def test_pooled_output_limit_reports_truncated(monkeypatch):
+    monkeypatch.setattr(code_runner, "MAX_OUTPUT_BYTES", 1000)
+    monkeypatch.setattr(code_runner, "POOL_SIZE", 1)
+
+    async def scenario():
+        await code_runner.start_pool()
+        try:
+            return await code_runner.execute("while True:\n    print('x' * 100)\n")
+        finally:
+            await code_runner.stop_pool()
+
+    result = asyncio.run(scenario())
+    assert result["status"] == "truncated"
+    assert len(result["stdout"]) <= 1000 and "Output truncated" in result["stderr"]
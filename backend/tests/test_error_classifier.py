@@ -0,0 +1,34 @@
+from services import error_classifier
+
+
+def fresh_hint(monkeypatch, error_message, line_code, context=""):
+    monkeypatch.setattr(error_classifier, "_memo", type(error_classifier._memo)())
+    return error_classifier.local_hint(error_message, line_code, context)
+
+
+def test_editor_message_matches_a_rule(monkeypatch):
+    hint = fresh_hint(monkeypatch, "SyntaxError: expected ':'", "if x == 1")
+    assert hint and "`if` block" in hint
+
+
+def test_compiler_diagnosis_from_context(monkeypatch):
+    context = "def f():\nreturn 1\n"
+    hint = fresh_hint(monkeypatch, "Problem on this line", "return 1", context)
+    assert hint == error_classifier._hint_for("expected_indent", "return 1")
+
+
+def test_large_context_parses_only_the_enclosing_block(monkeypatch):
+    monkeypatch.setattr(error_classifier, "CONTEXT_MAX_BYTES", 200)
+    filler = "".join(f"value_{i} = {i}\n" for i in range(500))
+    block = "def f():\n    total = (1,\n    return total\n"
+    context = filler + block + filler
+    assert error_classifier._parse_window("    total = (1,", context) == block.rstrip("\n")
+    hint = fresh_hint(monkeypatch, "Problem on this line", "    total = (1,", context)
+    assert hint == error_classifier._hint_for("unclosed_bracket", "    total = (1,")
+
+
+def test_valid_block_header_is_not_flagged(monkeypatch):
+    monkeypatch.setattr(error_classifier, "CONTEXT_MAX_BYTES", 200)
+    filler = "".join(f"value_{i} = {i}\n" for i in range(500))
+    context = filler + "def f():\n    if x:\n        return 1\n" + filler
+    assert fresh_hint(monkeypatch, "Problem on this line", "    if x:", context) is None
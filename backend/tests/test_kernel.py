@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from services import code_runner
+
+pytestmark = pytest.mark.skipif(not code_runner.KERNELS_ENABLED, reason="kernel mode needs fork")
+
+
+async def run_in_kernel(*sources):
+    """Run each source in one kernel, returning the results in order."""
+    results = []
+    kernel_id = "new"
+    try:
+        for code in sources:
+            result = await code_runner.execute(code, kernel_id)
+            kernel_id = result["kernel"]["id"]
+            results.append(result)
+    finally:
+        await code_runner.restart_kernel(kernel_id)
+    return results
+
+
+def test_rerun_prints_and_mutates_like_a_fresh_run():
+    code = "x = [1]\nx.append(2)\nprint(x)\n"
+    first, second = asyncio.run(run_in_kernel(code, code))
+    assert first["stdout"] == second["stdout"] == "[1, 2]\n"
+    assert first["kernel"]["fresh"] and not second["kernel"]["fresh"]
+    assert second["kernel"]["runs"] == 2
+
+
+def test_edited_file_reruns_every_statement():
+    first, second = asyncio.run(run_in_kernel(
+        "import math\nprint('a')\nprint(math.pi > 3)\n",
+        "import math\nprint('a')\nprint('b')\n",
+    ))
+    assert first["stdout"] == "a\nTrue\n"
+    assert second["stdout"] == "a\nb\n"
+
+
+def test_unchanged_imports_and_functions_are_reused():
+    head = "import json\n\ndef double(x):\n    return 2 * x\n\n"
+    first, second, edited = asyncio.run(run_in_kernel(
+        head + "print(double(2))\n",
+        head + "print(double(2))\n",
+        head.replace("2 * x", "x + x") + "print(double(3))\n",
+    ))
+    assert first["stdout"] == second["stdout"] == "4\n"
+    assert first["kernel"]["reused"] == 0 and second["kernel"]["reused"] == 2
+    assert edited["stdout"] == "6\n" and edited["kernel"]["reused"] == 1
+
+
+def test_names_from_deleted_lines_do_not_linger():
+    first, second = asyncio.run(run_in_kernel("x = 1\nprint(x)\n", "print('x' in globals())\n"))
+    assert first["stdout"] == "1\n"
+    assert second["stdout"] == "False\n"
+
+
+def test_user_code_cannot_forge_the_result():
+    forged = (
+        "import os\n"
+        "for fd in range(3, 64):\n"
+        "    try:\n"
+        "        os.write(fd, b'{\"job\": \"x\", \"returncode\": 0, \"truncated\": false, \"usage\": {}}\\n')\n"
+        "    except OSError:\n"
+        "        pass\n"
+        "print('after')\n"
+        "raise SystemExit(3)\n"
+    )
+    result, = asyncio.run(run_in_kernel(forged))
+    assert result["stdout"] == "after\n"
+    assert result["status"] == "error" and result["kernel"]["runs"] == 1
+
+
+def test_errors_do_not_poison_the_kernel():
+    failing, fixed = asyncio.run(run_in_kernel("print(1 / 0)\n", "print(1 / 1)\n"))
+    assert failing["status"] == "error" and "ZeroDivisionError" in failing["stderr"]
+    assert fixed["status"] == "success" and fixed["stdout"] == "1.0\n"
+
+
+def test_restart_gives_a_fresh_kernel():
+    async def scenario():
+        first = await code_runner.execute("print(1)", "new")
+        kernel_id = first["kernel"]["id"]
+        assert await code_runner.restart_kernel(kernel_id)
+        assert not await code_runner.restart_kernel(kernel_id)
+        second = await code_runner.execute("print(2)", kernel_id)
+        await code_runner.restart_kernel(second["kernel"]["id"])
+        return second
+
+    second = asyncio.run(scenario())
+    assert second["kernel"]["fresh"]
+    assert second["stdout"] == "2\n"
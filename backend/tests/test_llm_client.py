@@ -0,0 +1,57 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+from services import llm_client
+from services.llm_client import LazyClient
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def fresh_warmup(monkeypatch):
+    monkeypatch.setattr(llm_client, "warmup", {"import_ms": None, "connect_ms": None, "connections": 0, "error": None})
+
+
+def test_app_starts_without_importing_the_sdk():
+    env = {**os.environ, "ANTHROPIC_API_KEY": "test-key", "STATE_BACKEND": "memory"}
+    out = subprocess.run([sys.executable, "-c", "import sys, main; print('anthropic' in sys.modules)"],
+                         cwd=BACKEND, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "False"
+
+
+def test_client_is_built_on_first_use_with_the_pool_limits():
+    client = LazyClient(api_key="test-key", base_url="http://llm.test")
+    assert client._client is None
+    assert str(client.base_url).startswith("http://llm.test")
+    assert client.http is not None and llm_client.warmup["import_ms"] is not None
+
+
+def test_prewarm_opens_connections_in_parallel():
+    requests = []
+
+    def handler(request):
+        requests.append(request.method)
+        return httpx.Response(404)
+
+    client = LazyClient(api_key="test-key", base_url="http://llm.test")
+    client.get()
+    client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    asyncio.run(llm_client.prewarm(client, connections=3))
+    assert requests == ["HEAD"] * 3
+    assert llm_client.warmup["connections"] == 3 and llm_client.warmup["error"] is None
+
+
+def test_prewarm_failures_are_recorded_not_raised():
+    def handler(request):
+        raise httpx.ConnectError("unreachable")
+
+    client = LazyClient(api_key="test-key", base_url="http://llm.test")
+    client.get()
+    client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    asyncio.run(llm_client.prewarm(client, connections=2))
+    assert llm_client.warmup["connections"] == 0 and "unreachable" in llm_client.warmup["error"]
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from services import llm_policy
+from services.llm_policy import CircuitBreaker, CircuitOpen, LLMPolicy
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(monkeypatch):
+    monkeypatch.setattr(llm_policy, "BREAKER_MIN_CALLS", 2)
+    monkeypatch.setattr(llm_policy, "BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(llm_policy, "BREAKER_COOLDOWN", 30)
+    monkeypatch.setattr(llm_policy, "MAX_RETRIES", 1)
+    monkeypatch.setattr(llm_policy, "backoff", lambda attempt: 0)
+
+
+def tripped() -> CircuitBreaker:
+    breaker = CircuitBreaker()
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == "open"
+    return breaker
+
+
+def cooled(breaker: CircuitBreaker) -> CircuitBreaker:
+    breaker.opened_at -= llm_policy.BREAKER_COOLDOWN
+    return breaker
+
+
+def test_breaker_opens_at_the_error_rate():
+    breaker = tripped()
+    assert not breaker.available()
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+def test_half_open_admits_exactly_one_probe():
+    breaker = cooled(tripped())
+    assert breaker.available()
+    probe = breaker.acquire()
+    assert probe is not None and breaker.state == "half_open"
+    assert not breaker.available()
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+@pytest.mark.parametrize("ok, state", [(True, "closed"), (False, "open")])
+def test_probe_outcome_decides(ok, state):
+    breaker = cooled(tripped())
+    breaker.record(ok, breaker.acquire())
+    assert breaker.state == state
+
+
+def test_only_the_probe_holder_frees_or_settles_the_probe():
+    breaker = cooled(tripped())
+    probe = breaker.acquire()
+    # A call admitted before the breaker opened finishes now
+    breaker.release(None)
+    breaker.record(True)
+    breaker.record(False, probe + 1)
+    assert breaker.state == "half_open" and not breaker.available()
+    breaker.release(probe)
+    assert breaker.available()
+
+
+class FailingMessages:
+    def __init__(self, error, on_call=None):
+        self.error = error
+        self.on_call = on_call
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.on_call:
+            self.on_call()
+        raise self.error
+
+
+def make_policy(messages) -> LLMPolicy:
+    return LLMPolicy(SimpleNamespace(messages=messages))
+
+
+def create(policy: LLMPolicy):
+    return policy.create("second_question", model="test-model", max_tokens=10,
+                         messages=[{"role": "user", "content": "hi"}])
+
+
+def test_retry_stopped_by_the_breaker_raises_circuit_open(monkeypatch):
+    monkeypatch.setattr(llm_policy, "BREAKER_MIN_CALLS", 1)
+    messages = FailingMessages(asyncio.TimeoutError())
+    policy = make_policy(messages)
+    with pytest.raises(CircuitOpen):
+        asyncio.run(create(policy))
+    assert messages.calls == 1
+    assert policy.counters["rejected"] == 1
+
+
+def test_breaker_opening_during_backoff_raises_circuit_open(monkeypatch):
+    policy = make_policy(FailingMessages(asyncio.TimeoutError()))
+
+    def open_meanwhile(attempt):
+        policy.breaker._open()  # another call tripped it while this one slept
+        return 0
+
+    monkeypatch.setattr(llm_policy, "backoff", open_meanwhile)
+    with pytest.raises(CircuitOpen):
+        asyncio.run(create(policy))
+
+
+def test_failed_retry_leaves_no_probe_behind():
+    policy = make_policy(FailingMessages(ValueError("bad request")))
+    policy.breaker = cooled(tripped())
+    with pytest.raises(ValueError):
+        asyncio.run(create(policy))
+    # A non-provider failure says nothing about health: the probe slot is free again
+    assert policy.breaker.state == "half_open" and policy.breaker.available()
+
+
+class SlowMessages:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+
+
+def test_retries_stop_at_the_call_deadline(monkeypatch):
+    monkeypatch.setattr(llm_policy, "CALL_DEADLINE", 0.3)
+    monkeypatch.setattr(llm_policy, "TIMEOUT_MIN", 0.05)
+    monkeypatch.setattr(llm_policy, "MAX_RETRIES", 10)
+    monkeypatch.setattr(llm_policy, "BREAKER_MIN_CALLS", 100)
+    messages = SlowMessages(5)
+    policy = make_policy(messages)
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(create(policy))
+    # The first attempt's timeout is clamped to the deadline, leaving no room for a retry
+    assert time.monotonic() - started < 0.6
+    assert messages.calls == 1
+
+
+def auth_error(status: int):
+    import anthropic
+    import httpx
+
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    return anthropic.APIStatusError("denied", response=httpx.Response(status, request=request), body=None)
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_rejected_credentials_do_not_trip_the_breaker(status):
+    policy = make_policy(FailingMessages(auth_error(status)))
+    for _ in range(4):
+        with pytest.raises(Exception):
+            asyncio.run(create(policy))
+    assert policy.breaker.state == "closed" and policy.breaker.error_rate() == 0.0
+    assert policy.counters["auth_errors"] == 4
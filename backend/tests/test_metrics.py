@@ -0,0 +1,35 @@
+from fastapi.testclient import TestClient
+
+import main
+from services import metrics
+
+
+def test_histogram_buckets_are_cumulative(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+    latency = metrics.Histogram("test_latency_seconds", "Test latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value, route="/x")
+    assert metrics.render().splitlines()[2:] == [
+        'test_latency_seconds_bucket{route="/x",le="0.1"} 1',
+        'test_latency_seconds_bucket{route="/x",le="1.0"} 2',
+        'test_latency_seconds_bucket{route="/x",le="+Inf"} 3',
+        'test_latency_seconds_sum{route="/x"} 5.55',
+        'test_latency_seconds_count{route="/x"} 3',
+    ]
+
+
+def test_a_failing_collector_is_skipped(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+    metrics.collect("test_broken", "Raises.", lambda: 1 / 0)
+    metrics.collect("test_depth", "Works.", lambda: [({"queue": "runs"}, 3)])
+    assert metrics.render().splitlines()[-1] == 'test_depth{queue="runs"} 3'
+
+
+def test_requests_are_counted_by_route():
+    client = TestClient(main.app)
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/"}' in response.text
+    assert "# TYPE runner_queue_depth gauge" in response.text
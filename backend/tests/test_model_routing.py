@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import claude_service, model_router
+from services.model_router import ModelRouter
+from services.response_cache import ResponseCache
+
+
+class RecordingMessages:
+    def __init__(self):
+        self.models = []
+
+    async def create(self, **kwargs):
+        self.models.append(kwargs["model"])
+        return SimpleNamespace(content=[SimpleNamespace(text=f"Question from {kwargs['model']}")], usage=None)
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    messages = RecordingMessages()
+    client = SimpleNamespace(messages=messages)
+    monkeypatch.setattr(claude_service, "client", client)
+    monkeypatch.setattr(claude_service.policy, "client", client)
+    monkeypatch.setattr(claude_service.policy, "router", ModelRouter())
+    monkeypatch.setattr(claude_service, "question_cache", ResponseCache())
+    return messages
+
+
+def second_question():
+    return asyncio.run(claude_service.generate_second_question("x = 1", "Why x?", "Because."))
+
+
+def test_routing_picks_the_call_types_tier():
+    router = ModelRouter()
+    assert router.choose("evaluate", {}) == model_router.MODEL_TIERS["fast"]
+    assert router.choose("second_question", {}) == model_router.MODEL_TIERS["large"]
+    huge = {"messages": [{"role": "user", "content": "x " * 4 * model_router.ROUTE_UPGRADE_TOKENS}]}
+    assert router.choose("evaluate", huge) == model_router.MODEL_TIERS["large"]
+
+
+def test_cached_answers_are_keyed_on_the_model_that_was_chosen(messages):
+    large, fast = model_router.MODEL_TIERS["large"], model_router.MODEL_TIERS["fast"]
+    assert second_question() == f"Question from {large}"
+    assert second_question() == f"Question from {large}"  # cached
+    assert messages.models == [large]
+
+    # The large model goes over its latency budget: the fallback model's answer is its own cache entry
+    router = claude_service.policy.router
+    for _ in range(model_router.ROUTE_MIN_SAMPLES):
+        router.observe("second_question", large, model_router.LATENCY_BUDGETS["second_question"] + 1)
+    assert second_question() == f"Question from {fast}"
+    assert messages.models == [large, fast]
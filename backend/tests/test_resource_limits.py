@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from services import code_runner
+
+pytestmark = pytest.mark.skipif(not code_runner.SANDBOXED, reason="resource limits need fork")
+
+
+@pytest.fixture(autouse=True)
+def no_pool(monkeypatch):
+    monkeypatch.setattr(code_runner, "_idle_workers", None)
+    monkeypatch.setattr(code_runner.run_cache, "RUN_CACHE_ENABLED", False)
+
+
+def run(code):
+    return asyncio.run(code_runner.execute(code))
+
+
+def test_usage_is_reported():
+    result = run("data = bytearray(32 * 1024 * 1024)\nprint(len(data))\nopen('out.txt', 'w').write('x' * 100)\n")
+    assert result["status"] == "success"
+    usage = result["usage"]
+    assert usage["peak_rss_kb"] >= 32 * 1024
+    assert usage["output_bytes"] == len(result["stdout"])
+    assert usage["file_bytes"] == 100
+    assert usage["cpu_time_ms"] >= 0 and usage["wall_time_ms"] > 0
+
+
+def test_memory_limit(monkeypatch):
+    monkeypatch.setitem(code_runner.LIMITS, "memory_bytes", 256 * 1024 * 1024)
+    result = run("data = bytearray(512 * 1024 * 1024)\n")
+    assert result["status"] == "error" and "MemoryError" in result["stderr"]
+
+
+def test_cpu_limit(monkeypatch):
+    monkeypatch.setitem(code_runner.LIMITS, "cpu_seconds", 1)
+    result = run("while True:\n    pass\n")
+    assert result["status"] == "error" and "CPU time limit exceeded" in result["stderr"]
+
+
+def test_file_size_limit(monkeypatch):
+    monkeypatch.setitem(code_runner.LIMITS, "file_bytes", 1024)
+    result = run("with open('big.txt', 'w') as f:\n    f.write('x' * 4096)\n")
+    assert result["status"] == "error" and "File too large" in result["stderr"]
+    assert result["usage"]["file_bytes"] <= 1024
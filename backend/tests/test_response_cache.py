@@ -0,0 +1,45 @@
+import asyncio
+
+from services import response_cache
+from services.response_cache import ResponseCache, make_key
+from services.state_backend import SQLiteBackend
+
+
+def test_keys_ignore_formatting_but_not_content():
+    code = "def f():\n    return 1\n"
+    assert make_key("q1", "model", code, "") == make_key("q1", "model", "\n" + code.replace("\n", "  \r\n"), "")
+    assert make_key("q1", "model", code, "") != make_key("q1", "model", code.replace("1", "2"), "")
+    assert make_key("q1", "model", code, "") != make_key("q1", "other-model", code, "")
+    assert make_key("q1", "model", code, "") != make_key("q2", "model", code, "")
+
+
+def test_lru_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(max_entries=2, ttl=60)
+
+    async def scenario():
+        await cache.set("a", ["one"])
+        await cache.set("b", ["two"])
+        assert await cache.get("a") == ["one"]
+        await cache.set("c", ["three"])  # "b" is now the least recently used
+        assert await cache.get("b") is None
+        now[0] += 61
+        assert await cache.get("a") is None and await cache.get("c") is None
+
+    asyncio.run(scenario())
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_shared_tier_outlives_the_process_cache(tmp_path):
+    path = str(tmp_path / "questions.db")
+
+    async def scenario():
+        writer = SQLiteBackend(path)
+        await ResponseCache(shared=writer).set("key", ["question"])
+        writer.close()  # waits for the write to be committed
+        fresh = ResponseCache(shared=SQLiteBackend(path))
+        return await fresh.get("key"), fresh
+
+    value, fresh = asyncio.run(scenario())
+    assert value == ["question"] and fresh.shared_hits == 1
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from services import run_cache
+from services.run_cache import RunCache, is_deterministic
+
+
+@pytest.mark.parametrize("code", [
+    "print(sum(range(10)))",
+    "import math\nprint(math.sqrt(2))",
+    "from collections import Counter\nprint(Counter('abca').most_common(1))",
+    "class Point:\n    def __init__(self, x):\n        self.x = x\nprint(Point(1).x)",
+])
+def test_pure_programs_are_deterministic(code):
+    assert is_deterministic(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import random\nprint(random.random())",
+    "import time\nprint(time.time())",
+    "from os import environ\nprint(environ)",
+    "print(open('x').read())",
+    "print(input())",
+    "print(id(object()))",
+    "print({'a', 'b'})",
+    "print(set('ab'))",
+    "print(().__class__.__base__.__subclasses__())",
+    "from . import sibling",
+    "print(1",
+])
+def test_anything_else_is_not(code):
+    assert not is_deterministic(code)
+
+
+def test_key_for_respects_the_gate(monkeypatch):
+    monkeypatch.setattr(run_cache, "RUN_CACHE_ENABLED", True)
+    assert run_cache.key_for("print(1)", {}) is not None
+    assert run_cache.key_for("print(1", {}) is None
+    assert run_cache.key_for("import random", {}) is None
+    assert run_cache.key_for("print(1)", {"timeout": 5}) != run_cache.key_for("print(1)", {"timeout": 6})
+    monkeypatch.setattr(run_cache, "RUN_CACHE_ENABLED", False)
+    assert run_cache.key_for("print(1)", {}) is None
+
+
+def test_finished_runs_are_cached():
+    cache = RunCache()
+    assert asyncio.run(cache.put("ok", "1\n", "", "success", {}, 0))
+    assert asyncio.run(cache.put("raised", "", "ValueError: x\n", "error", {}, 1))
+    assert asyncio.run(cache.get("ok"))["stdout"] == "1\n"
+    assert asyncio.run(cache.get("raised"))["status"] == "error"
+
+
+@pytest.mark.parametrize("stdout, stderr, status, returncode", [
+    ("", "", "timeout", None),
+    ("", "\nCPU time limit exceeded.\n", "error", -24),  # SIGXCPU
+    ("", "", "error", -9),  # killed
+    ("", "MemoryError\n", "error", 1),
+    ("<__main__.Point object at 0x7f3a2c>\n", "", "success", 0),
+])
+def test_limit_hits_and_address_dependent_output_are_not_cached(stdout, stderr, status, returncode):
+    cache = RunCache()
+    assert not asyncio.run(cache.put("key", stdout, stderr, status, {}, returncode))
+    assert asyncio.run(cache.get("key")) is None
+    assert cache.uncacheable == 1
+
+
+def test_bounded_by_entries_and_bytes():
+    cache = RunCache(max_entries=2, max_bytes=10)
+    for key in ("a", "b", "c"):
+        asyncio.run(cache.put(key, "x", "", "success", {}, 0))
+    assert asyncio.run(cache.get("a")) is None and asyncio.run(cache.get("c")) is not None
+    assert not asyncio.run(cache.put("big", "x" * 11, "", "success", {}, 0))
+    asyncio.run(cache.put("d", "x" * 9, "", "success", {}, 0))
+    assert cache.size <= 10
+
+
+def test_identical_runs_are_answered_from_the_cache(monkeypatch):
+    from services import code_runner
+    monkeypatch.setattr(code_runner, "_idle_workers", None)
+    monkeypatch.setattr(run_cache, "RUN_CACHE_ENABLED", True)
+    monkeypatch.setattr(run_cache, "results", RunCache())
+
+    first = asyncio.run(code_runner.execute("print(sum(range(10)))"))
+    second = asyncio.run(code_runner.execute("print(sum(range(10)))"))
+    assert not first["cached"] and second["cached"]
+    assert second["stdout"] == first["stdout"] == "45\n"
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import code_runner
+
+
+@pytest.fixture(autouse=True)
+def no_pool(monkeypatch):
+    monkeypatch.setattr(code_runner, "_idle_workers", None)
+
+
+def read_events(response):
+    """(event, payload) pairs, split on blank lines as a browser's EventSource would."""
+    text = response.text.replace("\r\n", "\n")
+    events = []
+    for block in text.split("\n\n"):
+        name, data = "message", []
+        for line in block.split("\n"):
+            if line.startswith("event:"):
+                name = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].removeprefix(" "))
+        if data:
+            events.append((name, json.loads("\n".join(data))))
+    return events
+
+
+def test_output_streams_before_the_exit_event():
+    code = "import sys\nprint('one')\nprint('two', file=sys.stderr)\nprint('three')\n"
+    response = TestClient(main.app).post("/api/run/stream", json={"code": code})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = read_events(response)
+    names = [name for name, _ in events]
+    assert names[-1] == "exit" and names.count("exit") == 1
+    assert "".join(p["data"] for n, p in events if n == "stdout") == "one\nthree\n"
+    assert "".join(p["data"] for n, p in events if n == "stderr") == "two\n"
+    exit_event = events[-1][1]
+    assert exit_event["status"] == "success" and exit_event["returncode"] == 0
+    assert exit_event["duration_ms"] >= 0 and "usage" in exit_event
+
+
+def test_failed_run_reports_error_on_exit():
+    response = TestClient(main.app).post("/api/run/stream", json={"code": "raise KeyError('k')"})
+    name, payload = read_events(response)[-1]
+    assert name == "exit" and payload["status"] == "error" and payload["returncode"] == 1
@@ -0,0 +1,62 @@
+import asyncio
+
+from services.single_flight import SingleFlight
+
+
+def test_identical_streams_share_one_upstream():
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def scenario():
+        flights = SingleFlight()
+
+        async def read(delay):
+            await asyncio.sleep(delay)
+            return "".join([chunk async for chunk in flights.stream("key", upstream)])
+
+        # The late reader joins after "a" was produced and still gets it
+        return await asyncio.gather(read(0), read(0.015)), flights.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == ["abc", "abc"] and calls == 1
+    assert stats == {"in_flight": 0, "started": 1, "joined": 1}
+
+
+def test_a_disconnecting_reader_does_not_stop_the_others():
+    async def upstream():
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def scenario():
+        flights = SingleFlight()
+        first = flights.stream("key", upstream)
+        assert await first.__anext__() == "a"
+        await first.aclose()
+        return "".join([chunk async for chunk in flights.stream("key", upstream)]), flights.stats()
+
+    text, stats = asyncio.run(scenario())
+    assert text == "abc" and stats["started"] == 1
+
+
+def test_upstream_errors_reach_every_reader():
+    async def upstream():
+        yield "a"
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        flights = SingleFlight()
+
+        async def read():
+            return [chunk async for chunk in flights.stream("key", upstream)]
+
+        return await asyncio.gather(read(), read(), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
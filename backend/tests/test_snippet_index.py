@@ -0,0 +1,30 @@
+from services.snippet_index import SnippetIndex
+
+SNIPPET = """
+def total_price(items, tax_rate):
+    subtotal = 0
+    for item in items:
+        subtotal += item.price * item.quantity
+    return subtotal * (1 + tax_rate)
+"""
+RENAMED = SNIPPET.replace("total_price", "order_cost").replace("subtotal", "running")
+
+
+def test_near_duplicates_match_within_a_scope():
+    index = SnippetIndex()
+    index.add(SNIPPET, ["question"], scope="model-a/context-1")
+    assert index.lookup(RENAMED, scope="model-a/context-1") == ["question"]
+    assert index.lookup(RENAMED, scope="model-b/context-1") is None
+    assert index.lookup(RENAMED, scope="model-a/context-2") is None
+
+
+def test_scopes_survive_save_and_load(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = SnippetIndex()
+    index.add(SNIPPET, ["question"], scope="model-a")
+    index.save(path)
+
+    loaded = SnippetIndex()
+    loaded.load(path)
+    assert loaded.lookup(RENAMED, scope="model-a") == ["question"]
+    assert loaded.lookup(RENAMED) is None
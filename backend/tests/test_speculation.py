@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from services import speculation
+from services.session_store import SessionStore
+from services.state_backend import MemoryBackend
+
+CODE = "def average(values):\n    return sum(values) / len(values)\n"
+QUESTION = "What happens when average is called with an empty list of values?"
+ON_TOPIC = "len of the empty values list is zero, so the division raises ZeroDivisionError"
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(speculation, "SPECULATIVE_Q2", True)
+    monkeypatch.setattr(speculation, "MAX_PER_SESSION", 1)
+    monkeypatch.setattr(speculation, "sessions", SessionStore(backend=MemoryBackend()))
+    monkeypatch.setattr(speculation, "_pending", type(speculation._pending)())
+
+
+def test_relevance_check():
+    assert speculation.is_on_topic(ON_TOPIC, QUESTION, CODE)
+    assert not speculation.is_on_topic("no idea", QUESTION, CODE)
+    assert not speculation.is_on_topic("pizza tastes great with pineapple toppings", QUESTION, CODE)
+
+
+def test_on_topic_answer_takes_the_speculative_q2():
+    async def scenario():
+        session_id = await speculation.sessions.create(kind="quiz")
+        assert await speculation.start(session_id, lambda: asyncio.sleep(0.05, result="Q2?"))
+        return await speculation.take(session_id, ON_TOPIC, QUESTION, CODE)
+
+    assert asyncio.run(scenario()) == "Q2?"
+
+
+def test_off_topic_answer_discards_it():
+    async def scenario():
+        session_id = await speculation.sessions.create(kind="quiz")
+        await speculation.start(session_id, lambda: asyncio.sleep(10, result="Q2?"))
+        task = speculation._pending[session_id]
+        taken = await speculation.take(session_id, "pizza tastes great with pineapple", QUESTION, CODE)
+        await asyncio.sleep(0)
+        return taken, task.cancelled()
+
+    assert asyncio.run(scenario()) == (None, True)
+
+
+def test_one_speculation_per_session():
+    async def scenario():
+        session_id = await speculation.sessions.create(kind="quiz")
+        first = await speculation.start(session_id, lambda: asyncio.sleep(0, result="Q2?"))
+        speculation.cancel(session_id)
+        second = await speculation.start(session_id, lambda: asyncio.sleep(0, result="Q2?"))
+        return first, second
+
+    assert asyncio.run(scenario()) == (True, False)
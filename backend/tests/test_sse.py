@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from services import sse
+
+
+async def tokens(count, delay=0.0, produced=None):
+    for i in range(count):
+        if delay:
+            await asyncio.sleep(delay)
+        if produced is not None:
+            produced.append(i)
+        yield f"t{i} "
+
+
+def collect(chunks, **options):
+    async def scenario():
+        return [chunk async for chunk in sse.coalesce(chunks, **options)]
+
+    return asyncio.run(scenario())
+
+
+def test_first_chunk_alone_then_batches():
+    events = collect(tokens(50), max_bytes=32, max_delay_ms=1000)
+    assert events[0] == "t0 "
+    assert "".join(events) == "".join(f"t{i} " for i in range(50))
+    assert len(events) < 10 and all(len(e) < 32 + 5 for e in events)
+
+
+def test_batches_are_flushed_after_the_delay():
+    events = collect(tokens(6, delay=0.03), max_bytes=10_000, max_delay_ms=10)
+    assert len(events) == 6
+
+
+def test_disabled_passes_chunks_through():
+    assert collect(tokens(5), max_delay_ms=0) == [f"t{i} " for i in range(5)]
+
+
+def test_errors_after_partial_output_are_raised():
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("upstream failed")
+
+    with pytest.raises(RuntimeError):
+        collect(failing(), max_bytes=1000, max_delay_ms=1000)
+
+
+def test_slow_reader_pauses_the_upstream():
+    produced = []
+
+    async def scenario():
+        stream = sse.coalesce(tokens(1000, produced=produced), max_bytes=1, max_delay_ms=1000, max_buffered=4)
+        await stream.__anext__()
+        await asyncio.sleep(0.05)
+        buffered = len(produced)
+        await stream.aclose()
+        return buffered
+
+    assert asyncio.run(scenario()) <= 4 + 2
@@ -0,0 +1,233 @@
+import asyncio
+import sys
+import threading
+import types
+
+import pytest
+
+from services.session_store import SessionStore
+from services.state_backend import MemoryBackend, RedisBackend, SQLiteBackend, StateBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryBackend()
+        return
+    backend = SQLiteBackend(str(tmp_path / "state.db"))
+    yield backend
+    backend.close()
+
+
+def test_backends_must_implement_the_interface():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_reads_see_this_process_writes(backend):
+    backend.set("ns", "k", {"a": 1}, ttl=60)
+    assert backend.get("ns", "k") == {"a": 1}
+    backend.delete("ns", "k")
+    assert backend.get("ns", "k") is None
+
+
+def test_incr_floor_and_async_variant(backend):
+    assert backend.incr("c", "k", -1, ttl=60, floor=0) == 0
+    assert backend.incr("c", "k", 2, ttl=60, sliding=True) == 2
+
+    async def many():
+        return await asyncio.gather(*(backend.aincr("c", "n") for _ in range(20)))
+
+    assert sorted(asyncio.run(many())) == list(range(1, 21))
+
+
+def test_update_missing_key_is_none(backend):
+    assert backend.update("ns", "missing", lambda value: value) is None
+
+
+def test_sessions_reject_the_other_kind(backend):
+    sessions = SessionStore(backend=backend)
+
+    async def scenario():
+        quiz = await sessions.create(kind="quiz", question_1=None)
+        assert await sessions.get(quiz, kind="quiz") is not None
+        assert await sessions.get(quiz, kind="mentor") is None
+        assert (await sessions.update(quiz, question_1="Why?"))["question_1"] == "Why?"
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_updates_from_two_workers_are_not_lost(tmp_path):
+    path = str(tmp_path / "state.db")
+    workers = [SQLiteBackend(path), SQLiteBackend(path)]
+    first = SessionStore(backend=workers[0])
+    second = SessionStore(backend=workers[1])
+    session_id = asyncio.run(first.create(kind="mentor", turns=[]))
+    workers[0].close()
+
+    def add(store, i):
+        asyncio.run(store.modify(session_id, lambda data: {**data, "turns": data["turns"] + [i]}))
+
+    threads = [threading.Thread(target=add, args=(first if i % 2 else second, i)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for worker in workers:
+        worker.close()
+    assert sorted(asyncio.run(first.get(session_id))["turns"]) == list(range(20))
+
+
+def test_sqlite_enforces_limits(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "state.db"))
+    backend.set_limit("entries", max_entries=5)
+    backend.set_limit("bytes", max_bytes=100)
+    for i in range(64):
+        backend.set("entries", str(i), i, ttl=1000 + i)
+        backend.set("bytes", str(i), "x" * 20, ttl=1000 + i)
+    backend.close()
+    # Checked every few writes, so a namespace may briefly run over
+    assert backend.count("entries") <= 5 + 16
+    assert backend.get("entries", "63") == 63
+    assert backend.get("entries", "0") is None
+    assert backend.count("bytes") * 22 <= 100 + 16 * 22
+
+
+class FakeRedis:
+    """The few Redis commands RedisBackend uses, over a dict shared by every client of one URL."""
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def getex(self, key, ex=None):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def incrby(self, key, amount):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    def expire(self, key, seconds, nx=False):
+        pass
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update({member.encode(): score for member, score in mapping.items()})
+
+    def zrem(self, key, member):
+        self.data.get(key, {}).pop(member.encode(), None)
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def zremrangebyscore(self, key, low, high):
+        index = self.data.get(key, {})
+        for member in [m for m, score in index.items() if score <= high]:
+            del index[member]
+
+    def zpopmin(self, key, count):
+        index = self.data.get(key, {})
+        popped = sorted(index.items(), key=lambda item: item[1])[:count]
+        for member, _ in popped:
+            del index[member]
+        return popped
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queues commands until execute(); after watch() they run at once until multi()."""
+
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.queued = []
+        self.immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def watch(self, key):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def execute(self):
+        results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.queued]
+        self.queued = []
+        return results
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            if self.immediate:
+                return getattr(self.client, name)(*args, **kwargs)
+            self.queued.append((name, args, kwargs))
+            return self
+        return command
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    servers = {}
+    clients = []
+
+    def from_url(url):
+        clients.append(FakeRedis(servers.setdefault(url, {})))
+        return clients[-1]
+
+    module = types.ModuleType("redis")
+    module.Redis = types.SimpleNamespace(from_url=from_url)
+    module.WatchError = type("WatchError", (Exception,), {})
+    monkeypatch.setitem(sys.modules, "redis", module)
+    return servers
+
+
+def test_redis_sessions_round_trip_off_the_loop(fake_redis):
+    sessions = SessionStore(backend=RedisBackend("redis://fake/0"))
+    loop_thread = threading.get_ident()
+    touched_from = set()
+    backend = sessions.backend
+    real_get = backend.get
+
+    def get(*args, **kwargs):
+        touched_from.add(threading.get_ident())
+        return real_get(*args, **kwargs)
+
+    backend.get = get
+
+    async def scenario():
+        session_id = await sessions.create(kind="quiz", question_1=None)
+        assert (await sessions.update(session_id, question_1="Why?"))["question_1"] == "Why?"
+        assert (await sessions.get(session_id, kind="quiz"))["question_1"] == "Why?"
+        await sessions.delete(session_id)
+        assert await sessions.get(session_id) is None
+
+    asyncio.run(scenario())
+    assert touched_from and loop_thread not in touched_from
+
+
+def test_redis_sessions_are_visible_across_workers(fake_redis):
+    first = SessionStore(backend=RedisBackend("redis://fake/0"))
+    second = SessionStore(backend=RedisBackend("redis://fake/0"))
+
+    async def scenario():
+        session_id = await first.create(kind="mentor", turns=[])
+        await second.modify(session_id, lambda data: {**data, "turns": data["turns"] + ["hi"]})
+        assert (await first.get(session_id, kind="mentor"))["turns"] == ["hi"]
+        await first.delete(session_id)
+        assert await second.get(session_id) is None
+
+    asyncio.run(scenario())
+    assert len(first) == 0
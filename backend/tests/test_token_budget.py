@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from services import claude_service
+from services.token_budget import estimate_tokens, fit_workspace, truncate_to_tokens
+
+
+def lines(count, width=40):
+    return "".join(f"{i:04d} " + "x" * width + "\n" for i in range(count))
+
+
+def test_truncation_cuts_on_a_line_and_says_so():
+    text = lines(100)
+    short = truncate_to_tokens(text, 100)
+    assert estimate_tokens(short) <= 120
+    assert short.endswith("more lines truncated)")
+    assert truncate_to_tokens("print(1)\n", 100) == "print(1)\n"
+
+
+def test_workspace_is_fitted_by_relation_priority():
+    workspace = {
+        "activeFile": {"path": "main.py", "content": lines(20)},
+        "relatedFiles": [
+            {"path": "sibling.py", "relation": "sibling", "content": lines(200)},
+            {"path": "helpers.py", "relation": "import", "content": lines(20)},
+        ],
+        "fileTree": [f"pkg/file_{i}.py" for i in range(100)],
+    }
+    fitted = fit_workspace(workspace, budget=800)
+    assert fitted["activeFile"]["content"] == workspace["activeFile"]["content"]
+    assert fitted["relatedFiles"][0]["path"] == "helpers.py"
+    assert fitted["fileTreeTotal"] == 100 and len(fitted["fileTree"]) <= 50
+    used = sum(estimate_tokens(f["content"]) for f in [fitted["activeFile"], *fitted["relatedFiles"]])
+    assert used <= 800
+
+
+def test_system_prompt_is_marked_for_caching():
+    (block,) = claude_service.cached_system("You are a mentor.")
+    assert block["text"] == "You are a mentor." and block["cache_control"] == {"type": "ephemeral"}
+
+
+def test_usage_totals_count_cached_tokens(monkeypatch):
+    monkeypatch.setattr(claude_service, "usage_totals", {})
+    usage = SimpleNamespace(input_tokens=100, output_tokens=20, cache_read_input_tokens=900,
+                            cache_creation_input_tokens=None)
+    claude_service.record_usage("chat", usage)
+    claude_service.record_usage("chat", usage)
+    assert claude_service.usage_totals["chat"] == {
+        "requests": 2, "input_tokens": 200, "cached_input_tokens": 1800,
+        "cache_write_tokens": 0, "output_tokens": 40,
+    }
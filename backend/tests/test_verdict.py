@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from services import claude_service
+from services.claude_service import feedback_text, parse_verdict
+
+
+@pytest.mark.parametrize("text, verdict", [
+    ("PASS\nClear grasp of the leak.", "pass"),
+    ("\nPASS\nClear grasp of the leak.", "pass"),
+    ("  \n\n  **PASS**\nGood.", "pass"),
+    ("\n\nFAIL\nThe answer skips the teardown.", "fail"),
+    ("The answer is vague.\nPASS", "fail"),  # a finished first line without PASS
+    ("\n\n", None),
+    ("\n  PA", None),
+])
+def test_parse_verdict_skips_leading_whitespace(text, verdict):
+    assert parse_verdict(text) == verdict
+
+
+def test_feedback_text_skips_the_verdict_line_after_blank_lines():
+    assert feedback_text("\n \nPASS\n  Clear grasp of the leak. ") == "Clear grasp of the leak."
+    assert feedback_text("FAIL") == ""
+
+
+def test_live_feedback_skips_leading_blank_lines_and_the_verdict():
+    async def upstream():
+        for chunk in ["\n", " \nPA", "SS\n", "\nGood ", "job."]:
+            await asyncio.sleep(0)
+            yield chunk
+
+    async def scenario():
+        first = claude_service.verdict_flights.stream("verdict-test", upstream)
+        feedback = [chunk async for chunk in claude_service.stream_verdict_feedback("verdict-test")]
+        await first.aclose()
+        return "".join(feedback)
+
+    assert asyncio.run(scenario()) == "Good job."
@@ -13,7 +13,7 @@ import type { OnMount } from '@monaco-editor/react';
 import { usePasteDetection } from './hooks/usePasteDetection';
 import { useUndoEscape } from './hooks/useUndoEscape';
 import { useBuilderScore } from './hooks/useBuilderScore';
-import { analyzePaste, validateAnswer, analyzeError, mentorChat, executeCode } from './services/api';
+import { analyzePaste, validateAnswer, fetchVerdictFeedback, analyzeError, mentorChat, executeCodeStream, restartKernel, endSession } from './services/api';
 import { soundManager } from './utils/SoundManager';
 import { StatusBar } from '@/components/StatusBar';
 import type { Message } from './components/MentorChat';
@@ -52,9 +52,14 @@ function AppContent() {
     const [isTerminalOpen, setIsTerminalOpen] = useState(false);
     const [terminalOutput, setTerminalOutput] = useState({ stdout: '', stderr: '' });
     const [isRunningCode, setIsRunningCode] = useState(false);
+    // Opt-in: runs share a persistent kernel that keeps imports and the namespace warm
+    const useRunnerKernel = import.meta.env.VITE_RUNNER_KERNEL === 'true';
 
     const editorRef = useRef<any>(null);
     const abortControllerRef = useRef<AbortController | null>(null);
+    const quizSessionRef = useRef<string | undefined>(undefined);
+    const chatSessionRef = useRef<string | undefined>(undefined);
+    const kernelRef = useRef<string | undefined>(undefined);
 
     // Cleanup: Abort any in-flight SSE streams on unmount
     useEffect(() => {
@@ -86,6 +91,7 @@ function AppContent() {
         setMentorMode('active'); // Quiz active
 
         abortControllerRef.current = new AbortController();
+        quizSessionRef.current = undefined;
 
         // Get full content for context
         const context = editorRef.current?.getModel()?.getValue() || "";
@@ -101,7 +107,8 @@ function AppContent() {
             onError: (err) => {
                 if (err !== "Timeout") toast.error(`Mentor Error: ${err}`);
             },
-            abortSignal: abortControllerRef.current ? abortControllerRef.current.signal : undefined
+            abortSignal: abortControllerRef.current ? abortControllerRef.current.signal : undefined,
+            onSession: (sessionId) => { quizSessionRef.current = sessionId; }
         });
     };
 
@@ -135,7 +142,8 @@ function AppContent() {
                 codeSnippet: pastedCode,
                 questionNumber: questionNumber,
                 question1: questionNumber === 2 ? q1Text : undefined,
-                answer1: questionNumber === 2 ? a1Text : undefined
+                answer1: questionNumber === 2 ? a1Text : undefined,
+                sessionId: quizSessionRef.current
             });
 
             if (response.status === "next_question" && response.next_question) {
@@ -156,6 +164,13 @@ function AppContent() {
                 toast.error("Explanation failed. Try again.");
             }
 
+            if (response.feedback_id) {
+                // The verdict arrives as soon as PASS/FAIL is known; its explanation follows
+                fetchVerdictFeedback(response.feedback_id)
+                    .then(feedback => { if (feedback) toast(feedback, { duration: 6000 }); })
+                    .catch(() => { });
+            }
+
         } catch (err: any) {
             toast.error(`Error: ${err.message}`);
         } finally {
@@ -177,6 +192,10 @@ function AppContent() {
         if (abortControllerRef.current) {
             abortControllerRef.current.abort();
         }
+        if (quizSessionRef.current) {
+            endSession(quizSessionRef.current);
+            quizSessionRef.current = undefined;
+        }
 
         toast.success("Paste undone. Score restored.");
     };
@@ -219,6 +238,7 @@ function AppContent() {
         setMentorMode('chat');
         setSelectedContext(code);
         setChatMessages([]);
+        chatSessionRef.current = undefined; // new chat, new conversation
         toast("Mentor Mode Activated", { icon: "🧠" });
         // We wait for user to type their first message in the chat
     };
@@ -248,6 +268,8 @@ function AppContent() {
             contextSummary: context,
             fullFile: context,
             workspaceContext: workspaceContext || undefined,
+            sessionId: chatSessionRef.current,
+            onSession: (sessionId) => { chatSessionRef.current = sessionId; },
             onChunk: (text) => {
                 if (text === '[DONE]') return;
                 setChatMessages(prev => {
@@ -266,6 +288,14 @@ function AppContent() {
 
     // --- Code Execution Handler ---
 
+    const handleRestartKernel = async () => {
+        const kernelId = kernelRef.current;
+        kernelRef.current = undefined;
+        setTerminalOutput({ stdout: '', stderr: '' });
+        if (kernelId) await restartKernel(kernelId);
+        toast.success("Kernel restarted");
+    };
+
     const handleRunCode = async () => {
         const code = editorRef.current?.getModel()?.getValue() || "";
 
@@ -279,7 +309,10 @@ function AppContent() {
         setTerminalOutput({ stdout: '', stderr: '' });
 
         try {
-            const result = await executeCode(code);
+            const result = await executeCodeStream(code, (stream, text) => {
+                setTerminalOutput(prev => ({ ...prev, [stream]: prev[stream] + text }));
+            }, useRunnerKernel ? (kernelRef.current ?? "new") : undefined);
+            if (result.kernel) kernelRef.current = result.kernel.id;
             setTerminalOutput({
                 stdout: result.stdout,
                 stderr: result.stderr
@@ -289,6 +322,10 @@ function AppContent() {
                 toast.success("Code executed successfully");
             } else if (result.status === "timeout") {
                 toast.error("Execution timed out");
+            } else if (result.status === "truncated") {
+                toast.error("Output limit reached, the program was stopped");
+            } else if (result.status === "busy") {
+                toast.error("Code runner is busy, try again shortly");
             } else if (result.stderr) {
                 toast.error("Code execution failed");
             }
@@ -359,6 +396,7 @@ function AppContent() {
                             stderr={terminalOutput.stderr}
                             isRunning={isRunningCode}
                             onClose={() => setIsTerminalOpen(false)}
+                            onRestartKernel={useRunnerKernel ? handleRestartKernel : undefined}
                         />
                     )}
                 </div>
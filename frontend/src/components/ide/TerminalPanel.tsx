@@ -1,14 +1,16 @@
 import React from 'react';
-import { X, Loader2 } from 'lucide-react';
+import { X, Loader2, RotateCcw } from 'lucide-react';
 
 interface TerminalPanelProps {
     stdout: string;
     stderr: string;
     isRunning: boolean;
     onClose: () => void;
+    // Shown in kernel mode: drops the session's interpreter and its namespace
+    onRestartKernel?: () => void;
 }
 
-const TerminalPanel: React.FC<TerminalPanelProps> = ({ stdout, stderr, isRunning, onClose }) => {
+const TerminalPanel: React.FC<TerminalPanelProps> = ({ stdout, stderr, isRunning, onClose, onRestartKernel }) => {
     return (
         <div className="absolute bottom-0 left-0 right-0 bg-[#1e1e1e] border-t border-white/[0.08] flex flex-col z-10 h-[280px] animate-in slide-in-from-bottom duration-200">
             {/* Header */}
@@ -22,13 +24,26 @@ const TerminalPanel: React.FC<TerminalPanelProps> = ({ stdout, stderr, isRunning
                         </div>
                     )}
                 </div>
-                <button
-                    onClick={onClose}
-                    className="text-gray-500 hover:text-gray-300 transition-colors p-1 hover:bg-white/[0.05] rounded"
-                    aria-label="Close terminal"
-                >
-                    <X className="w-4 h-4" />
-                </button>
+                <div className="flex items-center gap-1">
+                    {onRestartKernel && (
+                        <button
+                            onClick={onRestartKernel}
+                            disabled={isRunning}
+                            className="text-gray-500 hover:text-gray-300 disabled:opacity-40 transition-colors p-1 hover:bg-white/[0.05] rounded"
+                            aria-label="Restart kernel"
+                            title="Restart kernel"
+                        >
+                            <RotateCcw className="w-4 h-4" />
+                        </button>
+                    )}
+                    <button
+                        onClick={onClose}
+                        className="text-gray-500 hover:text-gray-300 transition-colors p-1 hover:bg-white/[0.05] rounded"
+                        aria-label="Close terminal"
+                    >
+                        <X className="w-4 h-4" />
+                    </button>
+                </div>
             </div>
 
             {/* Terminal Output */}
@@ -2,6 +2,31 @@
 const API_BASE = import.meta.env.VITE_BACKEND_URL || import.meta.env.VITE_API_BASE_URL || "http://localhost:8000";
 export const USE_MOCK = false; // Toggle for demo safety
 
+// Random per-browser id; the backend's rate limits are per client id, so
+// students sharing one NAT address do not share one budget
+function newClientId(): string {
+    // crypto.randomUUID only exists in secure contexts (https, localhost)
+    if (typeof crypto !== "undefined" && typeof crypto.randomUUID === "function") {
+        return crypto.randomUUID();
+    }
+    return Array.from({ length: 4 }, () => Math.random().toString(36).slice(2, 10)).join("");
+}
+
+function loadClientId(): string {
+    try {
+        let id = localStorage.getItem("drona-client-id");
+        if (!id) {
+            id = newClientId();
+            localStorage.setItem("drona-client-id", id);
+        }
+        return id;
+    } catch {
+        return newClientId();
+    }
+}
+const CLIENT_ID = loadClientId();
+const JSON_HEADERS = { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID };
+
 export interface AnalyzeParams {
     codeSnippet: string;
     contextSummary: string;
@@ -9,6 +34,7 @@ export interface AnalyzeParams {
     onDone: () => void;
     onError: (error: string) => void;
     abortSignal?: AbortSignal;
+    onSession?: (sessionId: string) => void;
 }
 
 export interface ValidateParams {
@@ -18,12 +44,25 @@ export interface ValidateParams {
     questionNumber: number;
     question1?: string;
     answer1?: string;
+    sessionId?: string;
 }
 
 export interface ValidateResponse {
     status: "next_question" | "pass" | "fail";
     feedback: string;
     next_question?: string;
+    // Set on verdicts: the full feedback streams from fetchVerdictFeedback
+    feedback_id?: string;
+}
+
+// Seconds from a 429's Retry-After header (the server's admission control)
+function retryAfterSeconds(response: Response): number {
+    return Number(response.headers.get("Retry-After")) || 1;
+}
+
+function failureMessage(response: Response, fallback: string): string {
+    if (response.status === 429) return `Too many requests. Try again in ${retryAfterSeconds(response)}s.`;
+    return fallback;
 }
 
 // Helper for fetch with timeout
@@ -46,34 +85,51 @@ async function fetchWithTimeout(resource: RequestInfo, options: RequestInit & {
     }
 }
 
+/**
+ * Event name and data of one SSE event. Multi-line data fields are joined
+ * with "\n", and the space after the colon is optional.
+ */
+function parseSSEEvent(eventStr: string): { name: string; data: string } {
+    let name = "message";
+    const dataLines: string[] = [];
+    for (const line of eventStr.split("\n")) {
+        const field = line.startsWith("event:") ? "event" : line.startsWith("data:") ? "data" : null;
+        if (!field) continue;
+        let value = line.slice(field.length + 1);
+        if (value.startsWith(" ")) value = value.slice(1);
+        if (field === "event") name = value;
+        else dataLines.push(value);
+    }
+    return { name, data: dataLines.join("\n") };
+}
+
 /**
  * Process SSE events from a buffered string.
- * Handles the "data: ..." format, calling onChunk for each token
+ * Handles the "data: ..." format, calling onChunk for each event
  * and returning true if [DONE] was received.
+ * The server coalesces tokens, so one event can span several "data:"
+ * lines; per the SSE spec they are joined with newlines.
  */
 function processSSEEvents(
     eventStr: string,
     onChunk: (text: string) => void,
     onDone: () => void
 ): boolean {
-    const lines = eventStr.split("\n");
-    for (const line of lines) {
-        if (line.startsWith("data: ")) {
-            const data = line.slice(6);
-            if (data === "[DONE]") {
-                onDone();
-                return true;
-            }
-            // Safety: strip [DONE] if it leaked into the end of a data chunk
-            const cleaned = data.replace(/\[DONE\]$/g, '').trimEnd();
-            if (cleaned) {
-                onChunk(cleaned);
-            }
-            if (data.endsWith("[DONE]")) {
-                onDone();
-                return true;
-            }
-        }
+    const { data } = parseSSEEvent(eventStr);
+    if (!data) return false;
+
+    if (data === "[DONE]") {
+        onDone();
+        return true;
+    }
+    // Safety: strip [DONE] if it leaked into the end of a data chunk
+    const cleaned = data.replace(/\[DONE\]$/g, '');
+    if (cleaned) {
+        onChunk(cleaned);
+    }
+    if (data.endsWith("[DONE]")) {
+        onDone();
+        return true;
     }
     return false;
 }
@@ -104,7 +160,8 @@ async function readSSEStream(
             return;
         }
 
-        buffer += decoder.decode(value, { stream: true });
+        // sse-starlette separates lines with \r\n; normalize so events split cleanly
+        buffer = (buffer + decoder.decode(value, { stream: true })).replace(/\r\n/g, "\n");
 
         // Split by double newline (SSE event boundary)
         const events = buffer.split("\n\n");
@@ -125,19 +182,23 @@ export async function analyzePaste({
     onChunk,
     onDone,
     onError,
-    abortSignal
+    abortSignal,
+    onSession
 }: AnalyzeParams): Promise<void> {
     const endpoint = USE_MOCK ? "/mock_stream" : "/analyze_paste";
 
     try {
         const response = await fetch(`${API_BASE}${endpoint}`, {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
+            headers: JSON_HEADERS,
             body: JSON.stringify({ code_snippet: codeSnippet, context_summary: contextSummary }),
             signal: abortSignal
         });
 
-        if (!response.ok) throw new Error("Backend connection failed");
+        if (!response.ok) throw new Error(failureMessage(response, "Backend connection failed"));
+
+        const sessionId = response.headers.get("X-Session-Id");
+        if (sessionId && onSession) onSession(sessionId);
 
         const reader = response.body?.getReader();
         if (!reader) throw new Error("No response body");
@@ -163,14 +224,29 @@ export async function validateAnswer(params: ValidateParams): Promise<ValidateRe
         question_1: params.question1,
         answer_1: params.answer1
     };
+    // With a live session the server already holds the snippet and earlier Q/A
+    const sessionBody = {
+        session_id: params.sessionId,
+        user_answer: params.userAnswer,
+        question_number: params.questionNumber
+    };
+
+    const post = (payload: object) => fetchWithTimeout(`${API_BASE}${endpoint}`, {
+        method: "POST",
+        headers: JSON_HEADERS,
+        body: JSON.stringify(payload),
+        timeout: 10000 // 10s timeout
+    });
 
     try {
-        const response = await fetchWithTimeout(`${API_BASE}${endpoint}`, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(body),
-            timeout: 10000 // 10s timeout
-        });
+        let response = await post(params.sessionId ? sessionBody : body);
+        // Session expired server-side: fall back to the full payload
+        if (response.status === 404 && params.sessionId) response = await post(body);
+        // Rate limited: wait as told (briefly) and try once more rather than auto-passing
+        if (response.status === 429) {
+            await new Promise(resolve => setTimeout(resolve, Math.min(retryAfterSeconds(response), 10) * 1000));
+            response = await post(params.sessionId ? sessionBody : body);
+        }
 
         if (!response.ok) throw new Error("Validation failed");
         return response.json();
@@ -184,6 +260,30 @@ export async function validateAnswer(params: ValidateParams): Promise<ValidateRe
     }
 }
 
+/**
+ * Fetch the explanation behind a verdict. /validate_answer returns as soon as
+ * PASS/FAIL is known, so this may still be generating; resolves with the full text.
+ */
+export async function fetchVerdictFeedback(feedbackId: string): Promise<string> {
+    const response = await fetch(`${API_BASE}/verdict_feedback/${encodeURIComponent(feedbackId)}`);
+    if (!response.ok) throw new Error(failureMessage(response, "Backend connection failed"));
+
+    const reader = response.body?.getReader();
+    if (!reader) throw new Error("No response body");
+
+    let feedback = "";
+    await readSSEStream(reader, (text) => { if (text !== '[DONE]') feedback += text; }, () => { });
+    return feedback.trim();
+}
+
+/**
+ * Tell the server a quiz session is over (e.g. the paste was undone) so it
+ * can cancel speculative work. Fire-and-forget.
+ */
+export function endSession(sessionId: string): void {
+    fetch(`${API_BASE}/session/${encodeURIComponent(sessionId)}`, { method: "DELETE" }).catch(() => { });
+}
+
 export interface AnalyzeErrorParams {
     errorMessage: string;
     lineCode: string;
@@ -210,6 +310,9 @@ export interface MentorChatParams {
     contextSummary: string;
     history?: string;
     workspaceContext?: WorkspaceContext;
+    // Chat session from an earlier message; the server keeps the conversation
+    sessionId?: string;
+    onSession?: (sessionId: string) => void;
     onChunk: (text: string) => void;
     onDone: () => void;
     onError: (error: string) => void;
@@ -227,7 +330,7 @@ export async function analyzeError({
     try {
         const response = await fetch(`${API_BASE}${endpoint}`, {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
+            headers: JSON_HEADERS,
             body: JSON.stringify({
                 error_message: errorMessage,
                 line_code: lineCode,
@@ -235,7 +338,7 @@ export async function analyzeError({
             })
         });
 
-        if (!response.ok) throw new Error("Backend connection failed");
+        if (!response.ok) throw new Error(failureMessage(response, "Backend connection failed"));
 
         const reader = response.body?.getReader();
         if (!reader) throw new Error("No response body");
@@ -246,6 +349,62 @@ export async function analyzeError({
     }
 }
 
+// Hashes the server is known to hold, so unchanged files are not re-uploaded
+const uploadedBlobs = new Set<string>();
+
+async function sha256Hex(text: string): Promise<string> {
+    const digest = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(text));
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, "0")).join("");
+}
+
+async function uploadBlobs(blobs: Map<string, string>, hashes: string[]): Promise<void> {
+    await Promise.all(hashes.map(async hash => {
+        const response = await fetch(`${API_BASE}/blobs/${hash}`, {
+            method: "PUT",
+            headers: { "Content-Type": "text/plain; charset=utf-8", "X-Client-Id": CLIENT_ID },
+            body: blobs.get(hash)
+        });
+        if (!response.ok) throw new Error("Blob upload failed");
+        uploadedBlobs.add(hash);
+    }));
+}
+
+/**
+ * Upload workspace files the server does not have yet and return
+ * workspace_refs naming them by hash, or null if the blob store is unusable.
+ */
+async function syncWorkspaceBlobs(workspaceContext: WorkspaceContext): Promise<{ refs: object; blobs: Map<string, string> } | null> {
+    try {
+        const blobs = new Map<string, string>();
+        const ref = async (file: { path: string; content: string }) => {
+            const hash = await sha256Hex(file.content);
+            blobs.set(hash, file.content);
+            return { path: file.path, hash };
+        };
+        const refs = {
+            activeFile: await ref(workspaceContext.activeFile),
+            relatedFiles: await Promise.all(workspaceContext.relatedFiles.map(async rf => ({ ...(await ref(rf)), relation: rf.relation }))),
+            fileTree: workspaceContext.fileTree
+        };
+
+        const unknown = [...blobs.keys()].filter(hash => !uploadedBlobs.has(hash));
+        if (unknown.length) {
+            const response = await fetch(`${API_BASE}/blobs/missing`, {
+                method: "POST",
+                headers: JSON_HEADERS,
+                body: JSON.stringify({ hashes: unknown })
+            });
+            if (!response.ok) return null;
+            const { missing } = await response.json();
+            unknown.filter(hash => !missing.includes(hash)).forEach(hash => uploadedBlobs.add(hash));
+            await uploadBlobs(blobs, missing);
+        }
+        return { refs, blobs };
+    } catch {
+        return null;
+    }
+}
+
 export async function mentorChat({
     selectedCode,
     fullFile,
@@ -253,26 +412,59 @@ export async function mentorChat({
     contextSummary,
     history,
     workspaceContext,
+    sessionId,
+    onSession,
     onChunk,
     onDone,
     onError
 }: MentorChatParams): Promise<void> {
     const endpoint = "/mentor_chat"; // mock fallback handled server-side
+    const post = (payload: object) => fetch(`${API_BASE}${endpoint}`, {
+        method: "POST",
+        headers: JSON_HEADERS,
+        body: JSON.stringify(payload)
+    });
+    const fullBody = {
+        selected_code: selectedCode,
+        full_file: fullFile,
+        user_query: userQuery,
+        context_summary: contextSummary,
+        history: history || null,
+        workspace_context: workspaceContext || null,
+        session_id: sessionId || null
+    };
     try {
-        const response = await fetch(`${API_BASE}${endpoint}`, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
+        // Files go up once to the blob store; the chat request only names them by hash
+        const synced = workspaceContext ? await syncWorkspaceBlobs(workspaceContext) : null;
+        let response: Response;
+        if (synced) {
+            const refsBody = {
                 selected_code: selectedCode,
-                full_file: fullFile,
                 user_query: userQuery,
-                context_summary: contextSummary,
                 history: history || null,
-                workspace_context: workspaceContext || null
-            })
-        });
+                workspace_refs: synced.refs,
+                session_id: sessionId || null
+            };
+            response = await post(refsBody);
+            if (response.status === 409) {
+                // Server evicted some blobs: upload them again and retry once
+                const { detail } = await response.json();
+                detail.missing.forEach((hash: string) => uploadedBlobs.delete(hash));
+                try {
+                    await uploadBlobs(synced.blobs, detail.missing);
+                    response = await post(refsBody);
+                } catch {
+                    response = await post(fullBody);
+                }
+            }
+        } else {
+            response = await post(fullBody);
+        }
+
+        if (!response.ok) throw new Error(failureMessage(response, "Backend connection failed"));
 
-        if (!response.ok) throw new Error("Backend connection failed");
+        const newSessionId = response.headers.get("X-Session-Id");
+        if (newSessionId && onSession) onSession(newSessionId);
 
         const reader = response.body?.getReader();
         if (!reader) throw new Error("No response body");
@@ -286,18 +478,44 @@ export async function mentorChat({
 export interface ExecuteCodeResponse {
     stdout: string;
     stderr: string;
-    status: "success" | "error" | "timeout";
+    // "truncated": output passed the runner's limit and the program was stopped
+    status: "success" | "error" | "timeout" | "truncated" | "busy";
+    usage?: {
+        cpu_time_ms?: number;
+        peak_rss_kb?: number;
+        output_bytes?: number;
+        file_bytes?: number;
+        wall_time_ms: number;
+    };
+    // True when the backend reused the result of an identical earlier run
+    cached?: boolean;
+    // Present when the run used a persistent kernel; send kernel.id next time
+    kernel?: {
+        id: string;
+        fresh: boolean;
+        runs?: number;
+        // Leading top-level statements skipped because they were unchanged
+        reused?: number;
+        restarted?: boolean;
+    };
 }
 
-export async function executeCode(code: string): Promise<ExecuteCodeResponse> {
+/**
+ * kernelId runs the code in a persistent per-session kernel (any id the
+ * backend does not know, e.g. "new", starts one). Unchanged leading
+ * imports and function definitions are reused; the rest of the file runs.
+ */
+export async function executeCode(code: string, kernelId?: string): Promise<ExecuteCodeResponse> {
     try {
         const response = await fetch(`${API_BASE}/api/run`, {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ code })
+            headers: JSON_HEADERS,
+            body: JSON.stringify({ code, kernel_id: kernelId })
         });
 
-        if (!response.ok) throw new Error("Code execution failed");
+        // 503 carries a regular result body with status "busy"
+        if (response.status === 503) return response.json();
+        if (!response.ok) throw new Error(failureMessage(response, "Code execution failed"));
         return response.json();
     } catch (err: any) {
         return {
@@ -308,3 +526,82 @@ export async function executeCode(code: string): Promise<ExecuteCodeResponse> {
     }
 }
 
+
+/**
+ * Run code via /api/run/stream, calling onOutput for each stdout/stderr chunk
+ * as it is produced. Resolves with the accumulated result once the "exit"
+ * event arrives.
+ */
+export async function executeCodeStream(
+    code: string,
+    onOutput: (stream: "stdout" | "stderr", text: string) => void,
+    kernelId?: string
+): Promise<ExecuteCodeResponse> {
+    const result: ExecuteCodeResponse = { stdout: "", stderr: "", status: "error" };
+    try {
+        const response = await fetch(`${API_BASE}/api/run/stream`, {
+            method: "POST",
+            headers: JSON_HEADERS,
+            body: JSON.stringify({ code, kernel_id: kernelId })
+        });
+
+        if (response.status === 503) return response.json();
+        if (!response.ok) throw new Error(failureMessage(response, "Code execution failed"));
+
+        const reader = response.body?.getReader();
+        if (!reader) throw new Error("No response body");
+
+        const decoder = new TextDecoder();
+        let buffer = "";
+        // Returns true once the "exit" event has been handled
+        const handle = (event: string): boolean => {
+            const { name, data } = parseSSEEvent(event);
+            if (!data) return false;
+            const payload = JSON.parse(data);
+            if (name === "stdout" || name === "stderr") {
+                result[name] += payload.data;
+                onOutput(name, payload.data);
+            } else if (name === "exit") {
+                result.status = payload.status;
+                result.kernel = payload.kernel;
+                result.cached = payload.cached;
+                return true;
+            }
+            return false;
+        };
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                if (buffer.trim()) handle(buffer);
+                return result;
+            }
+
+            // Normalize the whole buffer: a \r\n can be split across two reads
+            buffer = (buffer + decoder.decode(value, { stream: true })).replace(/\r\n/g, "\n");
+            const events = buffer.split("\n\n");
+            buffer = events.pop() || "";
+
+            for (const event of events) {
+                if (handle(event)) return result;
+            }
+        }
+    } catch (err: any) {
+        return {
+            stdout: result.stdout,
+            stderr: result.stderr + `Execution error: ${err.message}`,
+            status: "error"
+        };
+    }
+}
+
+
+export async function restartKernel(kernelId: string): Promise<boolean> {
+    try {
+        const response = await fetch(`${API_BASE}/api/kernel/${encodeURIComponent(kernelId)}/restart`, { method: "POST" });
+        if (!response.ok) return false;
+        const data = await response.json();
+        return data.restarted;
+    } catch {
+        return false;
+    }
+}